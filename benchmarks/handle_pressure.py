@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Stress test of rename_images at high concurrency under a low RLIMIT_NOFILE.
+
+Creates a folder of small JPEGs with distinct EXIF dates, lowers the soft
+descriptor limit and renames the folder with many extract and apply workers
+(backups on, so every rename copies a file). Reports the run time, the peak
+number of handles held from the pool and whether any file failed. Without
+the handle pool such a run fails with EMFILE ("Too many open files").
+
+Usage:
+    PYTHONPATH=. python benchmarks/handle_pressure.py [count] [nofile] [workers]
+"""
+
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from PIL import Image
+
+from imagerenamer.core import rename_images
+from imagerenamer.metadata import HANDLES
+
+START = datetime(2022, 1, 1)
+
+def create_files(folder, count):
+    """Write count copies of a small JPEG, each with its own DateTimeOriginal."""
+    exif = Image.Exif()
+    exif[0x8769] = {0x9003: START.strftime("%Y:%m:%d %H:%M:%S")}
+    template = os.path.join(folder, "template.jpg")
+    Image.new("RGB", (8, 8)).save(template, exif=exif.tobytes())
+    with open(template, "rb") as f:
+        data = f.read()
+    os.remove(template)
+    marker = START.strftime("%Y:%m:%d %H:%M:%S").encode()
+    for i in range(count):
+        date = (START + timedelta(seconds=i)).strftime("%Y:%m:%d %H:%M:%S").encode()
+        with open(os.path.join(folder, f"IMG_{i:06d}.jpg"), "wb") as f:
+            f.write(data.replace(marker, date))
+
+def main():
+    """Run the stress test."""
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    nofile = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 256
+    
+    folder = tempfile.mkdtemp()
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    try:
+        create_files(folder, count)
+        resource.setrlimit(resource.RLIMIT_NOFILE, (nofile, hard))
+        HANDLES.resize()
+        
+        errors = []
+        started = time.monotonic()
+        stats = rename_images(
+            folder,
+            create_backup=True,
+            callback=lambda message: errors.append(message) if message.startswith("Error") else None,
+            workers={"extract": workers, "apply": workers // 4 or 1}
+        )
+        elapsed = time.monotonic() - started
+        
+        print(f"files:            {count}")
+        print(f"RLIMIT_NOFILE:    {nofile}")
+        print(f"handle pool size: {HANDLES.size}")
+        print(f"peak handles:     {HANDLES.peak}")
+        print(f"renamed:          {stats['renamed']}")
+        print(f"errors:           {len(errors)}")
+        print(f"time:             {elapsed:.1f} s ({count / elapsed:.0f} files/s)")
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        HANDLES.resize()
+        shutil.rmtree(folder)
+
+if __name__ == "__main__":
+    main()
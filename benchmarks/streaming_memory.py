@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Benchmark peak memory of rename_images in streaming mode.
+
+Creates folders with a growing number of empty media files and reports the
+peak traced allocation (tracemalloc) for a streaming run over each of them.
+In streaming mode the peak should stay flat as the entry count grows.
+
+Usage:
+    PYTHONPATH=. python benchmarks/streaming_memory.py [count ...]
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+from imagerenamer.core import rename_images
+
+START = datetime(2022, 1, 1)
+
+def measure(count, streaming):
+    """Return the peak traced memory in bytes for one run over count files."""
+    folder = tempfile.mkdtemp()
+    try:
+        for i in range(count):
+            # Timestamps in the name avoid any metadata reads
+            timestamp = START + timedelta(seconds=i)
+            open(os.path.join(folder, timestamp.strftime("IMG_%Y%m%d_%H%M%S.jpg")), "w").close()
+        
+        report_path = os.path.join(tempfile.gettempdir(), f"imagerenamer-bench-{os.getpid()}.jsonl")
+        tracemalloc.start()
+        rename_images(
+            folder,
+            callback=lambda message: None,
+            date_sources=("filename", "stat"),
+            streaming=streaming,
+            report_path=report_path
+        )
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        os.remove(report_path)
+        return peak
+    finally:
+        shutil.rmtree(folder)
+
+def main():
+    """Run the benchmark for the given entry counts."""
+    counts = [int(arg) for arg in sys.argv[1:]] or [10000, 50000, 100000]
+    print(f"{'entries':>10} {'listing (KiB)':>15} {'streaming (KiB)':>17}")
+    for count in counts:
+        listing = measure(count, streaming=False)
+        streaming = measure(count, streaming=True)
+        print(f"{count:>10} {listing / 1024:>15.0f} {streaming / 1024:>17.0f}")
+
+if __name__ == "__main__":
+    main()
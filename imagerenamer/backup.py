@@ -0,0 +1,320 @@
+"""
+Backups that avoid creating a file per backed up file.
+
+BackupStore is a content-addressed store that keeps identical files only
+once. Every file is stored as an object named after the hash of its data, and a
+manifest of JSON lines maps the name each file had when it was backed up to
+its hash:
+
+    backup/
+        manifest.jsonl    {"path": "IMG_0001.JPG", "hash": "9f86...", "size": 2048, ...}
+        objects/9f/9f86...
+
+Files whose inode, size and modification time match a manifest entry are
+skipped without being read, so repeat runs cost one stat per file. Other
+files are hashed and only copied if no object has their hash yet.
+
+BackupArchive streams the files into a single uncompressed tar or stored zip
+file from a writer thread, with an index of where each file's data starts,
+so a backup is one sequential write and a single file restores with a seek.
+"""
+
+import json
+import os
+import queue
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+
+from imagerenamer.metadata import HANDLES, hash_file
+
+# Hash naming the objects, and the size of each read while copying into or
+# out of an archive
+BACKUP_HASH = "sha256"
+COPY_CHUNK_SIZE = 1024 * 1024
+
+MANIFEST_NAME = "manifest.jsonl"
+OBJECTS_NAME = "objects"
+
+# Archive formats, the suffix of the index next to an archive, and the number
+# of opened files waiting for the archive writer
+ARCHIVE_FORMATS = ("tar", "zip")
+INDEX_SUFFIX = ".index.json"
+ARCHIVE_QUEUE_SIZE = 64
+
+# Windows refuses to rename or remove a file that is open, so there add()
+# waits until the writer has copied the file and closed it
+WAIT_FOR_COPY = os.name == "nt"
+
+def _stat_key(stat):
+    """Key identifying a file's content as long as it is not modified."""
+    return (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns)
+
+class BackupStore:
+    """
+    Deduplicating backup store in a folder. Safe to use from several threads.
+    
+    Args:
+        folder (str): Folder holding the manifest and the objects; created if needed
+    """
+    
+    def __init__(self, folder):
+        self.folder = folder
+        self.manifest_path = os.path.join(folder, MANIFEST_NAME)
+        self.objects_folder = os.path.join(folder, OBJECTS_NAME)
+        self.bytes_written = 0
+        # Hash of each backed up name, and of each known file by _stat_key
+        self.paths = {}
+        self._known = {}
+        self._lock = threading.Lock()
+        os.makedirs(self.objects_folder, exist_ok=True)
+        self._load()
+    
+    def _load(self):
+        try:
+            with open(self.manifest_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash; the entries before it still count
+                        continue
+                    self.paths[entry["path"]] = entry["hash"]
+                    if entry.get("inode") is not None:
+                        key = (entry["device"], entry["inode"], entry["size"], entry["mtime_ns"])
+                        self._known[key] = entry["hash"]
+        except FileNotFoundError:
+            pass
+    
+    def object_path(self, digest):
+        """Return the path of the object holding the data with the given hash."""
+        return os.path.join(self.objects_folder, digest[:2], digest)
+    
+    def _record(self, name, digest, stat):
+        entry = {"path": name, "hash": digest, "size": stat.st_size, "device": stat.st_dev,
+                 "inode": stat.st_ino, "mtime_ns": stat.st_mtime_ns, "time": time.time()}
+        with self._lock:
+            self.paths[name] = digest
+            self._known[_stat_key(stat)] = digest
+            with HANDLES.held(), open(self.manifest_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry) + "\n")
+    
+    def add(self, file_path, name=None):
+        """
+        Back up a file unless its content is stored already.
+        
+        Args:
+            file_path (str): Path of the file to back up
+            name (str): Name to record in the manifest (default: the file's name)
+        
+        Returns:
+            bool: True if the data was copied, False if an object already held it
+        """
+        name = name or os.path.basename(file_path)
+        stat = os.stat(file_path)
+        with self._lock:
+            digest = self._known.get(_stat_key(stat))
+        if digest and self.paths.get(name) == digest and os.path.exists(self.object_path(digest)):
+            # Backed up before under this name, unchanged since
+            return False
+        
+        if not digest:
+            digest = hash_file(file_path, BACKUP_HASH)
+        object_path = self.object_path(digest)
+        copied = False
+        if not os.path.exists(object_path):
+            os.makedirs(os.path.dirname(object_path), exist_ok=True)
+            # Copy under a temporary name, so an object is always complete
+            temp_path = f"{object_path}.{threading.get_ident()}.tmp"
+            try:
+                with HANDLES.held(2):
+                    shutil.copy2(file_path, temp_path)
+                os.replace(temp_path, object_path)
+            except BaseException:
+                try:
+                    os.remove(temp_path)
+                except OSError:
+                    pass
+                raise
+            with self._lock:
+                self.bytes_written += stat.st_size
+            copied = True
+        self._record(name, digest, stat)
+        return copied
+    
+    def restore(self, name, target_path):
+        """
+        Copy the backup of a file back out of the store.
+        
+        Args:
+            name (str): Name the file was backed up under
+            target_path (str): Path to write the file to
+        
+        Raises:
+            KeyError: If no file was backed up under that name
+        """
+        with HANDLES.held(2):
+            shutil.copy2(self.object_path(self.paths[name]), target_path)
+
+class BackupArchive:
+    """
+    Backup archive written sequentially by its own thread.
+    
+    add() opens the file and queues it, so the caller may rename or remove
+    the file right away; the writer copies the data from the open file. On
+    Windows, where open files cannot be renamed, add() instead returns once
+    the file is copied and closed (see WAIT_FOR_COPY). An existing archive is
+    appended to. Use close() (or the archive as a context
+    manager) to finish the archive and write its index.
+    
+    Args:
+        path (str): Path of the archive
+        archive_format (str): "tar" (uncompressed) or "zip" (stored), see ARCHIVE_FORMATS
+        queue_size (int): Most opened files waiting for the writer
+    """
+    
+    def __init__(self, path, archive_format="tar", queue_size=ARCHIVE_QUEUE_SIZE):
+        if archive_format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format: {archive_format}")
+        self.path = path
+        self.archive_format = archive_format
+        self.index_path = path + INDEX_SUFFIX
+        self.bytes_written = 0
+        self.index = {}
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            pass
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._error = None
+        self._writer = threading.Thread(target=self._write, daemon=True)
+        self._writer.start()
+    
+    def add(self, file_path, name=None):
+        """
+        Queue a file for the archive.
+        
+        Args:
+            file_path (str): Path of the file to back up
+            name (str): Name of the member (default: the file's name)
+        
+        Raises:
+            OSError: If the writer failed on this file (when waiting for the copy)
+                     or on an earlier one
+        """
+        if self._error:
+            raise self._error
+        # The descriptor stays open until the writer is done with it
+        HANDLES.acquire()
+        try:
+            source = open(file_path, "rb")
+        except BaseException:
+            HANDLES.release()
+            raise
+        copied = threading.Event() if WAIT_FOR_COPY else None
+        self._queue.put((name or os.path.basename(file_path), source, copied))
+        if copied:
+            copied.wait()
+            if self._error:
+                raise self._error
+    
+    def _write(self):
+        archive = None
+        try:
+            # Both formats create the archive or append to an existing one
+            if self.archive_format == "tar":
+                archive = tarfile.open(self.path, "a", format=tarfile.PAX_FORMAT,
+                                       copybufsize=COPY_CHUNK_SIZE)
+            else:
+                archive = zipfile.ZipFile(self.path, "a", zipfile.ZIP_STORED, allowZip64=True)
+        except Exception as e:
+            self._error = e
+        try:
+            while True:
+                item = self._queue.get()
+                if item is None:
+                    break
+                name, source, copied = item
+                try:
+                    if self._error is None:
+                        self._add_member(archive, name, source)
+                except Exception as e:
+                    self._error = e
+                finally:
+                    source.close()
+                    HANDLES.release()
+                    if copied:
+                        copied.set()
+        finally:
+            if archive:
+                archive.close()
+    
+    def _add_member(self, archive, name, source):
+        stat = os.fstat(source.fileno())
+        if self.archive_format == "tar":
+            info = tarfile.TarInfo(name)
+            info.size = stat.st_size
+            info.mtime = stat.st_mtime
+            info.mode = stat.st_mode & 0o7777
+            archive.addfile(info, source)
+            # The data ends where the padding to the next block starts
+            blocks = -(-stat.st_size // tarfile.BLOCKSIZE)
+            offset = archive.offset - blocks * tarfile.BLOCKSIZE
+        else:
+            info = zipfile.ZipInfo(name, time.localtime(stat.st_mtime)[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with archive.open(info, "w", force_zip64=stat.st_size > 0x7FFFFFFF) as member:
+                shutil.copyfileobj(source, member, COPY_CHUNK_SIZE)
+            offset = archive.fp.tell() - info.compress_size
+        self.index[name] = {"offset": offset, "size": stat.st_size, "mtime": stat.st_mtime}
+        self.bytes_written += stat.st_size
+    
+    def close(self):
+        """
+        Wait for the queued files, finish the archive and write its index.
+        
+        Raises:
+            Exception: The first error of the writer, if any
+        """
+        self._queue.put(None)
+        self._writer.join()
+        temp_path = f"{self.index_path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.index, f)
+        os.replace(temp_path, self.index_path)
+        if self._error:
+            raise self._error
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def restore_from_archive(archive_path, name, target_path):
+    """
+    Copy one file out of a backup archive, using its index instead of scanning.
+    
+    Args:
+        archive_path (str): Path of the archive written by BackupArchive
+        name (str): Name of the member
+        target_path (str): Path to write the file to
+    
+    Raises:
+        KeyError: If the archive holds no file of that name
+    """
+    with open(archive_path + INDEX_SUFFIX, encoding="utf-8") as f:
+        entry = json.load(f)[name]
+    with HANDLES.held(2), open(archive_path, "rb") as archive, open(target_path, "wb") as target:
+        archive.seek(entry["offset"])
+        remaining = entry["size"]
+        while remaining:
+            data = archive.read(min(remaining, COPY_CHUNK_SIZE))
+            if not data:
+                raise OSError(f"Backup archive {archive_path} is truncated")
+            target.write(data)
+            remaining -= len(data)
+    os.utime(target_path, (entry["mtime"], entry["mtime"]))
@@ -0,0 +1,252 @@
+"""
+Read-only metadata catalog of a media library, for analytics.
+
+Every media file below a folder becomes one row: its path, size, inode,
+creation date and where the date came from, camera make and model and,
+optionally, a hash of its data. Rows are written as CSV, JSON lines or, with
+pyarrow installed, Parquet. The folder tree is walked lazily and rows are
+written in batches (one Parquet row group each), so memory use stays flat
+however large the library is. Files are never modified.
+"""
+
+import csv
+import json
+import os
+
+from imagerenamer.core import (
+    Pipeline, get_creation_date, index_xmp_sidecars, DEFAULT_DATE_SOURCES, DATE_SOURCES,
+    IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+)
+from imagerenamer.metadata import (
+    HeaderFile, read_header, read_exif_date, hash_file, MetadataLimitError
+)
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    # Parquet output is optional: pip install modern-image-renamer[parquet]
+    pyarrow = None
+
+CATALOG_FORMATS = ("csv", "jsonl", "parquet")
+
+# Columns of the catalog, in order. Dates are ISO 8601 text, with the UTC
+# offset when the file recorded one.
+CATALOG_COLUMNS = ("path", "size", "inode", "date", "date_source", "camera_make", "camera_model",
+                   "sha256", "error")
+
+# Rows per write, and per Parquet row group
+CATALOG_BATCH_SIZE = 10000
+
+# Threads reading metadata
+DEFAULT_CATALOG_WORKERS = 8
+
+def catalog_format(output_path):
+    """Return the catalog format matching the extension of output_path, or None."""
+    extension = os.path.splitext(output_path)[1].lower()
+    return {".csv": "csv", ".jsonl": "jsonl", ".json": "jsonl", ".parquet": "parquet"}.get(extension)
+
+def walk_media_files(folder_path, file_filter, with_sidecars=False):
+    """
+    Lazily yield the media files below a folder, depth first.
+    
+    Only one directory listing is held at a time per level, so memory does
+    not grow with the number of files. Symbolic links to directories are not
+    followed.
+    
+    Args:
+        folder_path (str): Folder to walk
+        file_filter (function): Function deciding which filenames to yield
+        with_sidecars (bool): Whether to look up each file's XMP sidecar
+    
+    Yields:
+        tuple: (path relative to folder_path, full path, sidecar path or None)
+    """
+    pending = [""]
+    while pending:
+        relative_folder = pending.pop()
+        folder = os.path.join(folder_path, relative_folder)
+        try:
+            with os.scandir(folder) as iterator:
+                entries = sorted(iterator, key=lambda entry: entry.name)
+        except OSError:
+            # An unreadable subfolder leaves a gap rather than ending the walk
+            if not relative_folder:
+                raise
+            continue
+        sidecars = index_xmp_sidecars(entry.name for entry in entries) if with_sidecars else {}
+        for entry in reversed(entries):
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(os.path.join(relative_folder, entry.name))
+        for entry in entries:
+            if entry.is_dir() or not file_filter(entry.name):
+                continue
+            sidecar = sidecars.get(entry.name.lower()) or sidecars.get(os.path.splitext(entry.name)[0].lower())
+            yield (os.path.join(relative_folder, entry.name), entry.path,
+                   os.path.join(folder, sidecar) if sidecar else None)
+
+class CsvCatalogWriter:
+    """Write catalog rows as CSV with a header line."""
+    
+    def __init__(self, output_path):
+        self._file = open(output_path, "w", encoding="utf-8", newline="")
+        self._writer = csv.DictWriter(self._file, CATALOG_COLUMNS)
+        self._writer.writeheader()
+    
+    def write_batch(self, rows):
+        self._writer.writerows(rows)
+    
+    def close(self):
+        self._file.close()
+
+class JsonLinesCatalogWriter:
+    """Write catalog rows as one JSON object per line."""
+    
+    def __init__(self, output_path):
+        self._file = open(output_path, "w", encoding="utf-8")
+    
+    def write_batch(self, rows):
+        self._file.writelines(json.dumps(row) + "\n" for row in rows)
+    
+    def close(self):
+        self._file.close()
+
+class ParquetCatalogWriter:
+    """Write catalog rows to a Parquet file, one row group per batch."""
+    
+    def __init__(self, output_path):
+        if pyarrow is None:
+            raise RuntimeError("Parquet output needs pyarrow: pip install pyarrow")
+        types = {"size": pyarrow.int64(), "inode": pyarrow.uint64()}
+        self._schema = pyarrow.schema([(column, types.get(column, pyarrow.string()))
+                                       for column in CATALOG_COLUMNS])
+        self._writer = pyarrow.parquet.ParquetWriter(output_path, self._schema)
+    
+    def write_batch(self, rows):
+        columns = {column: [row[column] for row in rows] for column in CATALOG_COLUMNS}
+        self._writer.write_table(pyarrow.Table.from_pydict(columns, schema=self._schema))
+    
+    def close(self):
+        self._writer.close()
+
+CATALOG_WRITERS = {"csv": CsvCatalogWriter, "jsonl": JsonLinesCatalogWriter, "parquet": ParquetCatalogWriter}
+
+def catalog_row(relative_path, file_path, date_sources=DEFAULT_DATE_SOURCES, sidecar_path=None,
+                hash_files=False):
+    """
+    Collect the catalog row of one file.
+    
+    The header is read once and shared by the date sources and the camera
+    fields. Errors are recorded in the row's "error" column instead of
+    stopping the catalog.
+    
+    Args:
+        relative_path (str): Path to record in the row
+        file_path (str): Path of the file
+        date_sources (tuple): Date sources to try in order, see DATE_SOURCES
+        sidecar_path (str): Optional path of the file's XMP sidecar
+        hash_files (bool): Whether to hash the whole file (reads all of it)
+    
+    Returns:
+        dict: Values by CATALOG_COLUMNS
+    """
+    row = dict.fromkeys(CATALOG_COLUMNS)
+    row["path"] = relative_path
+    try:
+        header, stat = read_header(file_path)
+        row["size"] = stat.st_size
+        row["inode"] = stat.st_ino
+        tags = {}
+        date, date_source = get_creation_date(file_path, date_sources, header=header, stat_result=stat,
+                                              sidecar_path=sidecar_path, tags=tags)
+        # The camera fields come with the metadata date, and are only read on
+        # their own when an earlier source already gave the date
+        tried = date_sources[:date_sources.index(date_source) + 1] if date_source else date_sources
+        if "metadata" not in tried:
+            with HeaderFile(file_path, header=header) as reader:
+                read_exif_date(reader, tags=tags)
+        row["camera_make"] = tags.get("Make") or None
+        row["camera_model"] = tags.get("Model") or None
+        if date:
+            row["date"] = date.isoformat()
+            row["date_source"] = date_source
+        if hash_files:
+            row["sha256"] = hash_file(file_path)
+    except (OSError, MetadataLimitError) as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    return row
+
+def catalog_folder(folder_path, output_path, output_format=None, date_sources=None, file_filter=None,
+                   hash_files=False, workers=DEFAULT_CATALOG_WORKERS, batch_size=CATALOG_BATCH_SIZE,
+                   callback=None):
+    """
+    Write a catalog of the media files below a folder.
+    
+    Metadata is read by several worker threads while a single writer keeps
+    the rows in walk order and writes them in batches.
+    
+    Args:
+        folder_path (str): Folder to catalog, including its subfolders
+        output_path (str): File to write
+        output_format (str): One of CATALOG_FORMATS (default: from the extension of output_path)
+        date_sources (tuple): Date sources to try in order (default: metadata, then stat)
+        file_filter (function): Optional function deciding which files to catalog
+                                (default: images and videos)
+        hash_files (bool): Add the SHA-256 of each file (reads every byte)
+        workers (int): Threads reading metadata
+        batch_size (int): Rows per write and per Parquet row group
+        callback (function): Optional callback function for progress updates
+    
+    Returns:
+        dict: {"total": rows written, "errors": rows with an error}
+    
+    Raises:
+        ValueError: If the format or a date source is unknown
+        RuntimeError: If Parquet is asked for and pyarrow is not installed
+    """
+    output_format = output_format or catalog_format(output_path)
+    if output_format not in CATALOG_FORMATS:
+        raise ValueError(f"Unknown catalog format: {output_format}")
+    date_sources = date_sources or DEFAULT_DATE_SOURCES
+    for source in date_sources:
+        if source not in DATE_SOURCES:
+            raise ValueError(f"Unknown date source: {source}")
+    if file_filter is None:
+        media_extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
+        
+        def file_filter(filename):
+            return filename.lower().endswith(media_extensions)
+    
+    stats = {"total": 0, "errors": 0}
+    batch = []
+    writer = CATALOG_WRITERS[output_format](output_path)
+    
+    def flush():
+        writer.write_batch(batch)
+        stats["total"] += len(batch)
+        stats["errors"] += sum(1 for row in batch if row["error"])
+        batch.clear()
+        message = f"Cataloged {stats['total']} files"
+        if callback:
+            callback(message)
+        else:
+            print(message)
+    
+    def extract(item):
+        relative_path, file_path, sidecar_path = item
+        return catalog_row(relative_path, file_path, date_sources, sidecar_path, hash_files)
+    
+    def write(row):
+        batch.append(row)
+        if len(batch) >= batch_size:
+            flush()
+        return None
+    
+    pipeline = Pipeline([("extract", extract, workers), ("write", write, 1)], ordered=("write",))
+    try:
+        pipeline.run(walk_media_files(folder_path, file_filter, with_sidecars="xmp" in date_sources))
+        if batch:
+            flush()
+    finally:
+        writer.close()
+    return stats
@@ -5,25 +5,204 @@ Command-line interface for the Image Renamer tool.
 
 import sys
 import argparse
+import glob
 import os
-from imagerenamer.core import rename_images
+from imagerenamer.core import (
+    rename_images, rename_folders, ingest_images, DATE_SOURCES, DEFAULT_DATE_SOURCES, IO_ORDERS, AUTO_WORKERS,
+    IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+)
+from imagerenamer.watch import watch_folder, DEFAULT_SETTLE_TIME
+from imagerenamer.daemon import serve, submit_job
+from imagerenamer.metrics import Metrics, MetricsExporter, DEFAULT_INTERVAL
+from imagerenamer.catalog import catalog_folder, CATALOG_FORMATS, CATALOG_BATCH_SIZE, DEFAULT_CATALOG_WORKERS
 from imagerenamer import __version__
 
+def parse_date_sources(value):
+    """Parse a comma separated list of date sources for argparse."""
+    sources = tuple(source.strip().lower() for source in value.split(",") if source.strip())
+    unknown = [source for source in sources if source not in DATE_SOURCES]
+    if not sources or unknown:
+        raise argparse.ArgumentTypeError(
+            f"invalid date sources '{value}' (choose from: {', '.join(DATE_SOURCES)})"
+        )
+    return sources
+
+def parse_workers(value):
+    """Parse a worker count, or "auto" for a count tuned while running, for argparse."""
+    if value.strip().lower() == AUTO_WORKERS:
+        return AUTO_WORKERS
+    try:
+        count = int(value)
+    except ValueError:
+        count = 0
+    if count < 1:
+        raise argparse.ArgumentTypeError(f"invalid worker count '{value}' (a positive number or 'auto')")
+    return count
+
+def collect_folders(patterns, from_file=None):
+    """
+    Expand the folder arguments into a list of folders.
+    
+    Args:
+        patterns (list): Folder paths or glob patterns, e.g. "/photos/2021-*"
+        from_file (str): Optional file listing one folder per line; blank lines
+                         and lines starting with "#" are ignored
+    
+    Returns:
+        list: Folder paths in the order given, without repetitions
+    """
+    patterns = list(patterns)
+    if from_file:
+        with open(from_file, encoding="utf-8") as f:
+            patterns.extend(line.strip() for line in f
+                            if line.strip() and not line.lstrip().startswith("#"))
+    
+    folders = []
+    for pattern in patterns:
+        if glob.escape(pattern) != pattern:
+            matches = sorted(path for path in glob.glob(pattern) if os.path.isdir(path))
+            # A pattern matching nothing is reported as a missing folder
+            folders.extend(matches or [pattern])
+        else:
+            folders.append(pattern)
+    return list(dict.fromkeys(folders))
+
+def print_summary(stats, title="Summary"):
+    """Print the counts of a rename run."""
+    print(f"\n--- {title} ---")
+    print(f"Total image files: {stats['total']}")
+    if "bytes_copied" in stats:
+        print(f"Files copied: {stats['renamed']} ({stats['bytes_copied'] / 1e6:.1f} MB)")
+    else:
+        print(f"Files renamed: {stats['renamed']}")
+    print(f"Files skipped: {stats['skipped']}")
+    
+    if 'removed_duplicates' in stats and stats['removed_duplicates'] > 0:
+        print(f"Duplicates removed: {stats['removed_duplicates']}")
+    
+    if stats.get('quarantined'):
+        print(f"Files quarantined (unreadable metadata): {stats['quarantined']}")
+
+def catalog_main(argv):
+    """Entry point of the catalog subcommand: write metadata rows, change nothing."""
+    parser = argparse.ArgumentParser(
+        prog="imagerenamer catalog",
+        description="Write a catalog of the images and videos below a folder (path, size, inode, "
+                    "creation date and its source, camera, optional hash) without changing any file."
+    )
+    parser.add_argument("folder", help="Folder to catalog, including its subfolders")
+    parser.add_argument(
+        "-o", "--output",
+        required=True,
+        help="File to write; the format follows its extension (.csv, .jsonl, .parquet)"
+    )
+    parser.add_argument(
+        "--format",
+        choices=CATALOG_FORMATS,
+        help="Output format, if the extension does not tell (Parquet needs pyarrow)"
+    )
+    parser.add_argument(
+        "-d", "--date-sources",
+        type=parse_date_sources,
+        default=DEFAULT_DATE_SOURCES,
+        help=f"Comma separated date sources to try in order, from: {', '.join(DATE_SOURCES)} "
+             f"(default: {','.join(DEFAULT_DATE_SOURCES)})"
+    )
+    parser.add_argument(
+        "--hash",
+        action="store_true",
+        help="Add the SHA-256 of every file (reads each file completely)"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=DEFAULT_CATALOG_WORKERS,
+        metavar="N",
+        help=f"Number of threads reading metadata (default: {DEFAULT_CATALOG_WORKERS})"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=CATALOG_BATCH_SIZE,
+        metavar="ROWS",
+        help=f"Rows per write and per Parquet row group (default: {CATALOG_BATCH_SIZE})"
+    )
+    args = parser.parse_args(argv)
+    
+    if not os.path.isdir(args.folder):
+        print(f"Error: Folder '{args.folder}' does not exist")
+        return 1
+    try:
+        stats = catalog_folder(args.folder, args.output, output_format=args.format,
+                               date_sources=args.date_sources, hash_files=args.hash,
+                               workers=args.workers, batch_size=args.batch_size)
+    except (ValueError, RuntimeError, OSError) as e:
+        print(f"Error: {e}")
+        return 1
+    
+    print("\n--- Catalog ---")
+    print(f"Files cataloged: {stats['total']}")
+    if stats["errors"]:
+        print(f"Files with errors: {stats['errors']}")
+    print(f"Written to: {args.output}")
+    return 0
+
 def main():
     """Main entry point for the CLI application."""
+    # "imagerenamer catalog FOLDER ..." is a mode of its own; a folder named
+    # catalog can still be renamed as ./catalog
+    if len(sys.argv) > 1 and sys.argv[1] == "catalog":
+        return catalog_main(sys.argv[2:])
+    
     parser = argparse.ArgumentParser(
-        description="Rename image and video files based on their creation date from metadata."
+        description="Rename image and video files based on their creation date from metadata.",
+        epilog="To catalog a library without renaming anything, see 'imagerenamer catalog --help'."
     )
     
     parser.add_argument(
         "folder",
-        help="Path to the folder containing images and videos to rename"
+        nargs="*",
+        help="Path to the folder containing images and videos to rename; several folders "
+             "and glob patterns (e.g. '/photos/2021-*') are processed in one run"
+    )
+    
+    parser.add_argument(
+        "--from-file",
+        metavar="FILE",
+        help="Also process the folders listed in FILE, one per line"
     )
     
     parser.add_argument(
         "-f", "--format",
         default="%Y-%m-%d_%H-%M-%S",
-        help="Format string for the new filenames (default: '%%Y-%%m-%%d_%%H-%%M-%%S')"
+        help="Format string for the new filenames (default: '%%Y-%%m-%%d_%%H-%%M-%%S'); "
+             "%%L adds the milliseconds"
+    )
+    
+    parser.add_argument(
+        "--organize",
+        metavar="TEMPLATE",
+        help="Move files into a date tree while renaming them, e.g. '%%Y/%%m/%%d' "
+             "(relative to the folder, or an absolute path)"
+    )
+    
+    parser.add_argument(
+        "--ingest",
+        metavar="DESTINATION",
+        help="Copy the files to DESTINATION under their new names (e.g. off a memory card), "
+             "hashing them during the copy; the source folder is left unchanged"
+    )
+    
+    parser.add_argument(
+        "--verify-copies",
+        action="store_true",
+        help="With --ingest, read every copy back and compare it with the original"
+    )
+    
+    parser.add_argument(
+        "--utc",
+        action="store_true",
+        help="Build names from the capture time converted to UTC"
     )
     
     parser.add_argument(
@@ -32,6 +211,20 @@ def main():
         help="Create backups of the original files"
     )
     
+    parser.add_argument(
+        "--dedup-backup",
+        action="store_true",
+        help="Keep backups in a content-addressed store holding identical files once (implies --backup)"
+    )
+    
+    parser.add_argument(
+        "--backup-archive",
+        choices=("tar", "zip"),
+        help="Stream backups into one uncompressed archive (backup/backup.tar or .zip) instead of "
+             "a copy per file; faster on NAS and other file systems with slow file creation "
+             "(implies --backup)"
+    )
+    
     parser.add_argument(
         "-r", "--remove-duplicates",
         action="store_true",
@@ -44,6 +237,138 @@ def main():
         help="Include video files (mp4, mov, avi, etc.) in addition to images"
     )
     
+    parser.add_argument(
+        "-d", "--date-sources",
+        type=parse_date_sources,
+        default=DEFAULT_DATE_SOURCES,
+        help="Comma separated date sources to try in order, cheapest first "
+             f"(choose from: {', '.join(DATE_SOURCES)}; default: {','.join(DEFAULT_DATE_SOURCES)})"
+    )
+    
+    parser.add_argument(
+        "--verify",
+        action="store_true",
+        help="Re-check files whose names already match the format instead of skipping them"
+    )
+    
+    parser.add_argument(
+        "--no-grouping",
+        action="store_true",
+        help="Rename RAW+JPEG pairs and sidecar files (.xmp, .thm, .aae) independently"
+    )
+    
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Process files while scanning, with memory use independent of the folder size"
+    )
+    
+    parser.add_argument(
+        "--report",
+        metavar="FILE",
+        help="Write a JSON lines result per file to FILE"
+    )
+    
+    parser.add_argument(
+        "--extract-workers",
+        type=parse_workers,
+        default=1,
+        metavar="N",
+        help="Number of threads reading creation dates, or 'auto' to tune it from the "
+             "throughput while running (default: 1)"
+    )
+    
+    parser.add_argument(
+        "--apply-workers",
+        type=parse_workers,
+        metavar="N",
+        help="Number of threads backing up and renaming files, or 'auto' (default: 1; with "
+             "--ingest, as many copies as the source and destination devices handle well)"
+    )
+    
+    parser.add_argument(
+        "--io-order",
+        choices=IO_ORDERS,
+        default="scan",
+        help="Order of the metadata reads: as listed, by inode, or by physical location on disk "
+             "(extent, falls back to inode order); helps hard disks and card readers (default: scan)"
+    )
+    
+    parser.add_argument(
+        "--fadvise",
+        action="store_true",
+        help="Prefetch file headers in batches and drop them from the page cache once read, "
+             "to leave other services' cached data alone on shared servers"
+    )
+    
+    parser.add_argument(
+        "--network",
+        action="store_true",
+        help="Optimize for folders on network storage (NFS, SMB) by keeping many header reads "
+             "in flight, adapted to the observed latency"
+    )
+    
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="Seconds allowed for reading the metadata of one file; slower files are "
+             "quarantined (skipped and reported) instead of stalling the run"
+    )
+    
+    parser.add_argument(
+        "-w", "--watch",
+        action="store_true",
+        help="Keep running and rename new files as they land in the folder (Linux only)"
+    )
+    
+    parser.add_argument(
+        "--settle",
+        type=float,
+        default=DEFAULT_SETTLE_TIME,
+        metavar="SECONDS",
+        help=f"In watch mode, wait until a file was not written for SECONDS (default: {DEFAULT_SETTLE_TIME})"
+    )
+    
+    parser.add_argument(
+        "--serve",
+        action="store_true",
+        help="Run as a daemon accepting rename jobs on a Unix domain socket"
+    )
+    
+    parser.add_argument(
+        "--use-daemon",
+        action="store_true",
+        help="Submit the job to a running daemon instead of renaming in this process"
+    )
+    
+    parser.add_argument(
+        "--socket",
+        metavar="PATH",
+        help="Unix domain socket of the daemon (default: per-user socket in the runtime directory)"
+    )
+    
+    parser.add_argument(
+        "--metrics-file",
+        metavar="FILE",
+        help="Write Prometheus metrics to FILE (e.g. for node-exporter's textfile collector)"
+    )
+    
+    parser.add_argument(
+        "--metrics-port",
+        type=int,
+        metavar="PORT",
+        help="Serve Prometheus metrics on http://127.0.0.1:PORT/metrics"
+    )
+    
+    parser.add_argument(
+        "--metrics-interval",
+        type=float,
+        default=DEFAULT_INTERVAL,
+        metavar="SECONDS",
+        help=f"Seconds between two metrics file updates (default: {DEFAULT_INTERVAL:g})"
+    )
+    
     parser.add_argument(
         "-v", "--version", 
         action="version", 
@@ -52,43 +377,136 @@ def main():
     
     args = parser.parse_args()
     
+    # Optionally export metrics while running, for unattended runs
+    exporter = None
+    if args.metrics_file or args.metrics_port is not None:
+        exporter = MetricsExporter(Metrics(), args.metrics_file, args.metrics_port,
+                                   args.metrics_interval).start()
+    try:
+        return run(parser, args, exporter.metrics if exporter else None)
+    finally:
+        if exporter:
+            exporter.stop()
+
+def run(parser, args, metrics=None):
+    """Run the mode selected on the command line and return the exit code."""
+    
+    if args.serve:
+        try:
+            serve(args.socket, metrics=metrics)
+        except OSError as e:
+            print(f"Error: Cannot start daemon: {e}")
+            return 1
+        return 0
+    
+    try:
+        folders = collect_folders(args.folder, args.from_file)
+    except OSError as e:
+        parser.error(f"cannot read folder list: {e}")
+    if not folders:
+        parser.error("the following arguments are required: folder")
+    if len(folders) > 1 and (args.watch or args.use_daemon):
+        parser.error("several folders cannot be combined with --watch or --use-daemon")
+    
+    if args.ingest and (len(folders) > 1 or args.watch or args.use_daemon):
+        parser.error("--ingest takes a single folder and cannot be combined with --watch or --use-daemon")
+    if args.verify_copies and not args.ingest:
+        parser.error("--verify-copies requires --ingest")
+    
+    if args.dedup_backup and args.backup_archive:
+        parser.error("--dedup-backup cannot be combined with --backup-archive")
+    
+    if args.watch and args.report:
+        parser.error("--report cannot be combined with --watch")
+    if args.watch and args.use_daemon:
+        parser.error("--use-daemon cannot be combined with --watch")
+    
     # Check if folder exists
-    if not os.path.isdir(args.folder):
-        print(f"Error: Folder '{args.folder}' does not exist")
+    if len(folders) == 1 and not os.path.isdir(folders[0]):
+        print(f"Error: Folder '{folders[0]}' does not exist")
         return 1
     
     # Set up file extensions filter based on options
-    image_extensions = (".jpg", ".jpeg", ".png", ".nef", ".cr2", ".arw")
-    video_extensions = (".mp4", ".mov", ".avi", ".mkv", ".wmv", ".m4v", ".3gp", ".webm", ".flv")
-    
     if args.include_videos:
-        media_extensions = image_extensions + video_extensions
+        media_extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
     else:
-        media_extensions = image_extensions
+        media_extensions = IMAGE_EXTENSIONS
     
     # Create a filter function
     def file_filter(filename):
         return filename.lower().endswith(media_extensions)
     
-    # Run the renaming process
-    stats = rename_images(
-        args.folder,
-        args.backup,
-        args.format,
+    options = dict(
+        create_backup=args.backup or args.dedup_backup or bool(args.backup_archive),
+        dedup_backup=args.dedup_backup,
+        backup_archive=args.backup_archive,
+        format_string=args.format,
         remove_duplicates=args.remove_duplicates,
-        file_filter=file_filter
+        file_filter=file_filter,
+        date_sources=args.date_sources,
+        verify=args.verify,
+        group_related=not args.no_grouping,
+        streaming=args.streaming,
+        workers={"extract": args.extract_workers, "apply": args.apply_workers or 1},
+        io_order=args.io_order,
+        fadvise=args.fadvise,
+        network=args.network,
+        timeout=args.timeout,
+        utc=args.utc,
+        target_format=args.organize,
+        metrics=metrics
     )
     
+    if args.ingest:
+        # Copy instead of renaming; options about changing the source do not apply.
+        # Without --apply-workers the number of parallel copies follows the devices
+        workers = {"extract": args.extract_workers}
+        if args.apply_workers:
+            workers["apply"] = args.apply_workers
+        stats = ingest_images(
+            folders[0], args.ingest, format_string=args.format, target_format=args.organize,
+            remove_duplicates=args.remove_duplicates, file_filter=file_filter,
+            date_sources=args.date_sources, group_related=not args.no_grouping,
+            report_path=args.report, io_order=args.io_order, timeout=args.timeout, utc=args.utc,
+            verify_copies=args.verify_copies, metrics=metrics, workers=workers
+        )
+    elif len(folders) > 1:
+        # One shared pipeline for all folders; missing ones are reported and skipped
+        results = rename_folders(folders, report_path=args.report, **options)
+        for folder, stats in results["folders"].items():
+            if not stats["error"]:
+                print_summary(stats, folder)
+        stats = results["total"]
+        print_summary(stats, f"Total of {len(folders)} folders")
+    elif args.watch:
+        # Rename what is there, then keep renaming new arrivals until interrupted
+        try:
+            stats = watch_folder(folders[0], settle_time=args.settle, **options)
+        except OSError as e:
+            print(f"Error: Cannot watch '{folders[0]}': {e}")
+            return 1
+    elif args.use_daemon:
+        # Let the daemon do the work; it filters on extensions instead of a function
+        options.pop("file_filter")
+        options.pop("metrics")
+        try:
+            stats = submit_job(folders[0], socket_path=args.socket, extensions=media_extensions,
+                               report_path=args.report and os.path.abspath(args.report), **options)
+        except (OSError, RuntimeError) as e:
+            print(f"Error: Daemon job failed: {e}")
+            return 1
+    else:
+        # Run the renaming process
+        stats = rename_images(folders[0], report_path=args.report, **options)
+    
     # Print summary
     if not stats["error"]:
-        print("\n--- Summary ---")
-        print(f"Total image files: {stats['total']}")
-        print(f"Files renamed: {stats['renamed']}")
-        print(f"Files skipped: {stats['skipped']}")
+        if len(folders) == 1:
+            print_summary(stats)
+        
+        for stage, level in stats.get("concurrency", {}).items():
+            print(f"Concurrency chosen for {stage}: {level}")
         
-        if 'removed_duplicates' in stats and stats['removed_duplicates'] > 0:
-            print(f"Duplicates removed: {stats['removed_duplicates']}")
-            
         if stats["renamed"] > 0:
             print("\n✅ Renaming completed successfully!")
         else:
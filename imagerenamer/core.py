@@ -2,184 +2,2056 @@
 Core functionality for renaming images based on EXIF metadata.
 """
 
+import errno
+import hashlib
+import itertools
+import json
 import os
+import queue
+import re
 import shutil
-from datetime import datetime
-from pathlib import Path
+import struct
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
 from PIL import Image
 from PIL.ExifTags import TAGS
 
-def get_exif_creation_date(image_path):
+from imagerenamer.backup import BackupStore, BackupArchive, ARCHIVE_FORMATS
+from imagerenamer.metadata import (
+    HeaderFile, prefetch_headers, read_header, read_exif_date, read_xmp_date, exif_datetime,
+    exif_format, FINAL_EXIF_FORMATS, ProcessSandbox, MetadataLimitError, HANDLES, PREFETCH_BATCH,
+    hash_file, advise
+)
+
+try:
+    import fcntl
+except ImportError:
+    # Not available on Windows; extent ordering then falls back to inode order
+    fcntl = None
+
+# Date sources in cost order: the filename needs no file I/O at all, metadata
+# reads the file header, xmp reads an XMP sidecar or the packet embedded in the
+# file and stat falls back to the file system timestamp.
+DATE_SOURCES = ("filename", "metadata", "xmp", "stat")
+DEFAULT_DATE_SOURCES = ("metadata", "stat")
+
+# A single pattern covering the common camera and phone naming schemes, e.g.
+# IMG_20220510_143045, PXL_20230101_101010123, VID-20220510-WA0003 and
+# 2022-05-10_14-30-45. Date-only names resolve to midnight.
+FILENAME_DATE_PATTERN = re.compile(
+    r"(?<!\d)"
+    r"(?P<year>(?:19|20)\d{2})(?P<sep>[-_.]?)(?P<month>\d{2})(?P=sep)(?P<day>\d{2})"
+    r"(?:[ _T-](?:at )?"
+    r"(?P<hour>\d{2})[-_.:h]?(?P<minute>\d{2})[-_.:m]?(?P<second>\d{2})s?"
+    r"(?P<millis>\d{3})?)?"
+    r"(?!\d)"
+)
+
+def _pillow_exif_date(reader):
+    """
+    Read DateTimeOriginal with Pillow from an open file.
+    
+    Some Pillow plugins decode the whole image to find its EXIF data, so
+    running into the reader's byte limit here means no date within reach,
+    not a hostile file.
+    """
+    try:
+        image = Image.open(reader)
+        try:
+            exif_data = image._getexif()
+        finally:
+            # Never leave releasing the image to the garbage collector
+            image.close()
+    except MetadataLimitError:
+        return None
+    if exif_data:
+        tags = {TAGS.get(tag, tag): value for tag, value in exif_data.items()}
+        if "DateTimeOriginal" in tags:
+            return exif_datetime(tags["DateTimeOriginal"], tags.get("SubsecTimeOriginal"),
+                                 tags.get("OffsetTimeOriginal"))
+    return None
+
+def _isolated_exif_date(image_path, drop_cache):
+    """Run the Pillow fallback in a ProcessSandbox worker; returns (date, bytes read)."""
+    with HeaderFile(image_path, drop_cache=drop_cache) as reader:
+        return _pillow_exif_date(reader), reader.bytes_read
+
+def get_exif_creation_date(image_path, io_stats=None, drop_cache=False, header=None, sandbox=None,
+                           tags=None):
     """
     Extract the creation date from image EXIF metadata.
     Returns a datetime object or None if no date found.
     
+    Only the file header is read, unless the metadata reaches beyond it.
+    JPEG, TIFF-based, HEIF and PNG files are read with a bounded walker first.
+    Pillow is the fallback for the other formats it has a plugin for and for
+    JPEG and TIFF files the walker finds no date in; HEIF and PNG files are
+    never handed to Pillow, which would decode the whole image, and neither
+    are files Pillow cannot open, e.g. videos.
+    
     Args:
         image_path (str): Path to the image file
-        
+        io_stats (dict): Optional dict whose "bytes_read" entry is increased by the bytes read
+        drop_cache (bool): Whether to drop the bytes read from the page cache afterwards
+        header (bytes): Start of the file if it was read already
+        sandbox (ProcessSandbox): Optional worker processes running the Pillow fallback
+                                  with a deadline
+        tags (dict): Optional dict receiving the camera "Make" and "Model", read by
+                     the bounded walker in the same pass as the date
+    
     Returns:
         datetime: Creation date as datetime object or None
+    
+    Raises:
+        MetadataLimitError: If the file exceeds the read limits or the sandbox deadline
     """
+    reader = None
     try:
-        image = Image.open(image_path)
-        exif_data = image._getexif()
-        if exif_data:
-            for tag, value in exif_data.items():
-                tag_name = TAGS.get(tag, tag)
-                if tag_name == "DateTimeOriginal":
-                    return datetime.strptime(value, "%Y:%m:%d %H:%M:%S")
+        with HeaderFile(image_path, drop_cache=drop_cache, header=header) as reader:
+            creation_date = read_exif_date(reader, tags=tags)
+            file_format = exif_format(reader.header)
+            if creation_date or file_format in FINAL_EXIF_FORMATS:
+                return creation_date
+            # Saves a round trip to the sandbox for every video
+            extension = os.path.splitext(image_path)[1].lower()
+            if file_format is None and extension not in Image.registered_extensions():
+                return None
+            if sandbox is None:
+                reader.seek(0)
+                return _pillow_exif_date(reader)
+        # Pillow has no bounds of its own, so run it where it can be stopped
+        creation_date, bytes_read = sandbox.call(_isolated_exif_date, image_path, drop_cache)
+        reader.bytes_read += bytes_read
+        return creation_date
+    except MetadataLimitError:
+        raise
     except Exception as e:
         print(f"Error reading EXIF data from {image_path}: {e}")
+    finally:
+        if io_stats is not None and reader is not None:
+            io_stats["bytes_read"] = io_stats.get("bytes_read", 0) + reader.bytes_read
     return None
 
-def rename_images(folder_path, create_backup=False, format_string="%Y-%m-%d_%H-%M-%S", callback=None, 
-                 remove_duplicates=False, file_filter=None):
+def get_xmp_creation_date(file_path, sidecar_path=None, io_stats=None, drop_cache=False, header=None):
     """
-    Rename all image and video files in the folder based on their creation date.
+    Extract the creation date from XMP metadata.
+    Returns a datetime object or None if no date found.
+    
+    An XMP sidecar, as written by Lightroom and other editors, wins over the
+    packet embedded in the file itself.
     
     Args:
-        folder_path (str): Path to the folder containing images and videos
-        create_backup (bool): Whether to create a backup of the original files
+        file_path (str): Path to the media file
+        sidecar_path (str): Optional path of the file's XMP sidecar
+        io_stats (dict): Optional dict whose "bytes_read" entry is increased by the bytes read
+        drop_cache (bool): Whether to drop the bytes read from the page cache afterwards
+        header (bytes): Start of the media file if it was read already
+    
+    Returns:
+        datetime: Creation date as datetime object or None
+    
+    Raises:
+        MetadataLimitError: If a file exceeds the read limits
+    """
+    for path, path_header in ((sidecar_path, None), (file_path, header)):
+        if not path:
+            continue
+        reader = None
+        try:
+            with HeaderFile(path, drop_cache=drop_cache, header=path_header) as reader:
+                creation_date = read_xmp_date(reader)
+            if creation_date:
+                return creation_date
+        except MetadataLimitError:
+            raise
+        except Exception as e:
+            print(f"Error reading XMP data from {path}: {e}")
+        finally:
+            if io_stats is not None and reader is not None:
+                io_stats["bytes_read"] = io_stats.get("bytes_read", 0) + reader.bytes_read
+    return None
+
+def index_xmp_sidecars(names):
+    """
+    Index the XMP sidecars among the names of a folder.
+    
+    Sidecars are named after the stem of their file (IMG_001.xmp, Lightroom)
+    or after its full name (IMG_001.CR2.xmp, darktable).
+    
+    Args:
+        names (iterable): Names of the entries of one folder
+    
+    Returns:
+        dict: Sidecar names keyed by the lowercased name they belong to
+    """
+    return {name[:-len(".xmp")].lower(): name for name in names if name.lower().endswith(".xmp")}
+
+# Regular expressions for the strftime directives that can appear in a format
+# string, plus %L for milliseconds; unknown directives match any non-empty text.
+FORMAT_DIRECTIVE_PATTERNS = {
+    "Y": r"\d{4}", "y": r"\d{2}", "m": r"\d{2}", "d": r"\d{2}", "j": r"\d{3}",
+    "H": r"\d{2}", "I": r"\d{2}", "M": r"\d{2}", "S": r"\d{2}", "f": r"\d{6}", "L": r"\d{3}",
+    "U": r"\d{2}", "W": r"\d{2}", "w": r"\d", "u": r"\d", "G": r"\d{4}", "V": r"\d{2}",
+    "a": r"[^\W\d_]+", "A": r"[^\W\d_]+", "b": r"[^\W\d_]+", "B": r"[^\W\d_]+",
+    "p": r"[^\W\d_]+", "z": r"(?:[+-]\d{4})?", "Z": r"\w*", "%": "%",
+}
+
+# Number of scanned names written to the spool at once, and bytes read back
+# from it at once, in streaming mode
+STREAM_BATCH_SIZE = 256
+STREAM_READ_SIZE = 16 * 1024
+
+# Capacity of the queue in front of each pipeline stage, and the default
+# number of worker threads per stage. Resolving names always runs on a single
+# worker so that collision suffixes are assigned in scan order.
+PIPELINE_QUEUE_SIZE = 64
+DEFAULT_STAGE_WORKERS = {"extract": 1, "resolve": 1, "apply": 1}
+
+# Marks the end of the input for a pipeline stage worker
+PIPELINE_END = object()
+
+# Bounds of the number of header reads in flight on network storage
+NETWORK_MIN_IN_FLIGHT = 4
+NETWORK_MAX_IN_FLIGHT = 64
+
+# Worker count of a stage whose concurrency is tuned from its throughput, and
+# the upper bound of the tuning
+AUTO_WORKERS = "auto"
+AUTO_MAX_WORKERS = 32
+
+# Files processed when no file filter is given
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".avif", ".nef", ".cr2", ".arw")
+VIDEO_EXTENSIONS = (".mp4", ".mov", ".avi", ".mkv", ".wmv", ".m4v", ".3gp", ".webm", ".flv")
+
+# Sidecar files that are renamed together with the media file they belong to
+SIDECAR_EXTENSIONS = (".xmp", ".thm", ".aae")
+
+# Preferred members to read metadata from when a shot was saved in several
+# formats, cheapest first; anything else (raw formats, videos) comes last.
+METADATA_READ_ORDER = (".jpg", ".jpeg", ".png", ".heic", ".heif", ".avif")
+
+# Orders in which file headers can be read: as listed by the folder scan, by
+# inode number, or by the physical location of the first extent on disk.
+# Renames are always applied in scan order whichever order reads happen in.
+IO_ORDERS = ("scan", "inode", "extent")
+
+# FS_IOC_FIEMAP from <linux/fs.h>, with struct fiemap and struct fiemap_extent
+# from <linux/fiemap.h>
+FS_IOC_FIEMAP = 0xC020660B
+FIEMAP_HEADER = struct.Struct("=QQIIII")
+FIEMAP_EXTENT = struct.Struct("=QQQQQIIII")
+FIEMAP_MAX_OFFSET = 0xFFFFFFFFFFFFFFFF
+
+# Errors of copy_file_range and sendfile on kernels or file systems that do not
+# support the copy, which is then done by the next method
+KERNEL_COPY_UNSUPPORTED = (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK)
+
+# Errors of link() on file systems without hard links (FAT, exFAT, some network
+# shares), where a rename that refuses to replace falls back to a check first
+LINK_UNSUPPORTED = (errno.EPERM, errno.EOPNOTSUPP, errno.ENOSYS, errno.EMLINK)
+
+# Hash computed while ingesting files, the size of each read of the copy, and
+# the number of files copied at a time from or to a device that does not seek
+INGEST_HASH = "sha256"
+COPY_CHUNK_SIZE = 1024 * 1024
+INGEST_COPY_WORKERS = 4
+
+def get_first_extent(file_path):
+    """
+    Return the physical location of the start of a file on its device.
+    
+    Uses the Linux FIEMAP ioctl, which only reads the file's extent map and
+    none of its data.
+    
+    Args:
+        file_path (str): Path to the file
+    
+    Returns:
+        int: Physical byte offset of the first extent, or None if the file
+             system cannot tell (or the file is empty)
+    """
+    if fcntl is None:
+        return None
+    buffer = bytearray(FIEMAP_HEADER.size + FIEMAP_EXTENT.size)
+    # Map the whole file, but return the first extent only
+    FIEMAP_HEADER.pack_into(buffer, 0, 0, FIEMAP_MAX_OFFSET, 0, 0, 1, 0)
+    try:
+        with HANDLES.held(), open(file_path, "rb") as f:
+            fcntl.ioctl(f.fileno(), FS_IOC_FIEMAP, buffer)
+    except (OSError, ValueError):
+        return None
+    mapped_extents = FIEMAP_HEADER.unpack_from(buffer)[3]
+    if not mapped_extents:
+        return None
+    return FIEMAP_EXTENT.unpack_from(buffer, FIEMAP_HEADER.size)[1]
+
+def sort_for_io(paths, io_order, inodes=None):
+    """
+    Return the order in which to read files so the disk head moves forward.
+    
+    Args:
+        paths (list): Paths of the files to read
+        io_order (str): One of IO_ORDERS
+        inodes (dict): Optional inode numbers by path, e.g. from os.scandir,
+                       to save a stat call per file
+    
+    Returns:
+        list: Indexes into paths in read order; ties keep the scan order
+    """
+    if io_order not in IO_ORDERS:
+        raise ValueError(f"Unknown I/O order: {io_order}")
+    if io_order == "scan":
+        return list(range(len(paths)))
+    
+    def inode(path):
+        if inodes and path in inodes:
+            return inodes[path]
+        try:
+            return os.stat(path).st_ino
+        except OSError:
+            return 0
+    
+    keys = []
+    for path in paths:
+        offset = get_first_extent(path) if io_order == "extent" else None
+        # Files without extent information follow in inode order
+        keys.append((0, offset) if offset is not None else (1, inode(path)))
+    return sorted(range(len(paths)), key=lambda index: (keys[index], index))
+
+def format_date(date, format_string, utc=False):
+    """
+    Format a creation date for a new filename.
+    
+    Besides the strftime directives, %L stands for the milliseconds, so burst
+    shots taken within the same second get distinct names.
+    
+    Args:
+        date (datetime): Creation date; naive dates are taken as local time
         format_string (str): Format string for the new filename (strftime format)
-        callback (function): Optional callback function for progress updates
-        remove_duplicates (bool): Whether to remove duplicate files instead of renaming with suffixes
-        file_filter (function): Optional function to filter which files to process
+        utc (bool): Whether to convert the date to UTC first
+    
+    Returns:
+        str: Formatted name
+    """
+    if utc:
+        date = date.astimezone(timezone.utc)
+    milliseconds = f"{date.microsecond // 1000:03d}"
+    format_string = re.sub(r"%(%|L)", lambda match: milliseconds if match.group(1) == "L" else "%%",
+                           format_string)
+    return date.strftime(format_string)
+
+def compile_format_pattern(format_string):
+    """
+    Turn a strftime format string into a regex matching the names it produces.
+    
+    The pattern also accepts the "_N" counter suffix added for duplicates, so it
+    can be matched against the stem of an already renamed file.
+    
+    Args:
+        format_string (str): Format string for the new filename (strftime format)
+    
+    Returns:
+        re.Pattern: Compiled pattern to use with fullmatch on a filename stem
+    """
+    parts = []
+    index = 0
+    while index < len(format_string):
+        char = format_string[index]
+        if char == "%" and index + 1 < len(format_string):
+            directive = format_string[index + 1]
+            if directive == "-" and index + 2 < len(format_string):
+                # Non-padded variant such as %-d
+                parts.append(r"\d+")
+                index += 3
+                continue
+            parts.append(FORMAT_DIRECTIVE_PATTERNS.get(directive, ".+?"))
+            index += 2
+        else:
+            parts.append(re.escape(char))
+            index += 1
+    return re.compile("".join(parts) + r"(?:_\d+)?")
+
+def is_conforming_name(filename, format_pattern):
+    """
+    Check whether a filename already looks like the output of rename_images.
+    
+    Args:
+        filename (str): Name of the file
+        format_pattern (re.Pattern): Pattern from compile_format_pattern
+    
+    Returns:
+        bool: True if the stem matches the format and the extension is lowercase
+    """
+    stem, extension = os.path.splitext(filename)
+    return extension == extension.lower() and format_pattern.fullmatch(stem) is not None
+
+def get_filename_date(filename):
+    """
+    Extract a timestamp embedded in a filename without touching the file.
+    
+    Args:
+        filename (str): Name (or path) of the file
+    
+    Returns:
+        datetime: Timestamp found in the name or None
+    """
+    name = os.path.basename(filename)
+    for match in FILENAME_DATE_PATTERN.finditer(name):
+        parts = match.groupdict()
+        try:
+            return datetime(
+                int(parts["year"]), int(parts["month"]), int(parts["day"]),
+                int(parts["hour"] or 0), int(parts["minute"] or 0), int(parts["second"] or 0),
+                int(parts["millis"] or 0) * 1000
+            )
+        except ValueError:
+            # Digits that only look like a date (e.g. month 13), keep looking
+            continue
+    return None
+
+def get_creation_date(file_path, date_sources=DEFAULT_DATE_SOURCES, io_stats=None, drop_cache=False,
+                      header=None, stat_result=None, sandbox=None, sidecar_path=None, tags=None):
+    """
+    Resolve the creation date of a file by trying each date source in order.
+    
+    Args:
+        file_path (str): Path to the file
+        date_sources (tuple): Names from DATE_SOURCES, cheapest first
+        io_stats (dict): Optional dict collecting I/O counters of the metadata readers
+        drop_cache (bool): Whether metadata readers drop what they read from the page cache
+        header (bytes): Start of the file if it was read already
+        stat_result (os.stat_result): Status of the file if it was fetched already
+        sandbox (ProcessSandbox): Optional worker processes for parsers without bounds
+        sidecar_path (str): Optional path of the file's XMP sidecar
+        tags (dict): Optional dict receiving the camera make and model when the
+                     metadata source is tried, see get_exif_creation_date
+    
+    Returns:
+        tuple: (datetime, source name) or (None, None) if no source matched
+    
+    Raises:
+        MetadataLimitError: If reading the metadata exceeded a limit
+    """
+    for source in date_sources:
+        if source == "filename":
+            creation_date = get_filename_date(file_path)
+        elif source == "metadata":
+            creation_date = get_exif_creation_date(file_path, io_stats=io_stats, drop_cache=drop_cache,
+                                                   header=header, sandbox=sandbox, tags=tags)
+        elif source == "xmp":
+            creation_date = get_xmp_creation_date(file_path, sidecar_path, io_stats=io_stats,
+                                                  drop_cache=drop_cache, header=header)
+        elif source == "stat":
+            ctime = stat_result.st_ctime if stat_result else os.path.getctime(file_path)
+            creation_date = datetime.fromtimestamp(ctime)
+        else:
+            raise ValueError(f"Unknown date source: {source}")
+        if creation_date:
+            return creation_date, source
+    return None, None
+
+def group_related_files(media_files, sidecar_files=()):
+    """
+    Group files that belong to the same shot, e.g. DSC_0001.NEF, DSC_0001.JPG
+    and their sidecars (DSC_0001.xmp or DSC_0001.NEF.xmp).
+    
+    Args:
+        media_files (list): Names of the media files, in processing order
+        sidecar_files (list): Names of candidate sidecar files
+    
+    Returns:
+        list: (stem, media members, sidecars) tuples; the members are ordered
+              with the cheapest file to read metadata from first
+    """
+    groups = {}
+    for file in media_files:
+        stem = os.path.splitext(file)[0]
+        groups.setdefault(stem, ([], []))[0].append(file)
+    
+    for file in sidecar_files:
+        stem = os.path.splitext(file)[0]
+        if stem not in groups:
+            # Sidecars named after the full filename, e.g. DSC_0001.NEF.xmp
+            stem = os.path.splitext(stem)[0]
+        if stem in groups:
+            groups[stem][1].append(file)
+    
+    def read_cost(filename):
+        extension = os.path.splitext(filename)[1].lower()
+        if extension in METADATA_READ_ORDER:
+            return METADATA_READ_ORDER.index(extension)
+        return len(METADATA_READ_ORDER)
+    
+    return [(stem, sorted(members, key=read_cost), sidecars)
+            for stem, (members, sidecars) in groups.items()]
+
+def stream_media_files(folder_path, file_filter, scanned=None, batch_size=STREAM_BATCH_SIZE):
+    """
+    Lazily yield the names of matching files in a folder.
+    
+    The folder is read with os.scandir on a background thread that spools the
+    names to a temporary file, so memory use does not grow with the number of
+    entries and scanning overlaps with processing. The scan never waits for
+    the consumer, so renames in the folder can be held back until it set
+    scanned, and files renamed by the consumer never show up as new names.
+    
+    Args:
+        folder_path (str): Path to the folder to scan
+        file_filter (function): Function deciding which filenames to yield
+        scanned (threading.Event): Optional event set once the whole folder was read
+        batch_size (int): Number of names written to the spool at once
+    
+    Yields:
+        str: Name of each matching file
+    """
+    spool = tempfile.TemporaryFile()
+    ready = threading.Condition()
+    state = {"written": 0, "done": False, "error": None}
+    stopped = threading.Event()
+    
+    def write(batch):
+        # Names never contain NUL, so it separates them in the spool
+        data = b"".join(os.fsencode(name) + b"\0" for name in batch)
+        with ready:
+            spool.seek(state["written"])
+            spool.write(data)
+            state["written"] += len(data)
+            ready.notify()
+    
+    def scan():
+        batch = []
+        try:
+            with os.scandir(folder_path) as iterator:
+                for entry in iterator:
+                    # Give up when the consumer went away
+                    if stopped.is_set():
+                        return
+                    if not entry.is_dir() and file_filter(entry.name):
+                        batch.append(entry.name)
+                        if len(batch) == batch_size:
+                            write(batch)
+                            batch = []
+            write(batch)
+        except Exception as e:
+            state["error"] = e
+        finally:
+            with ready:
+                state["done"] = True
+                ready.notify()
+            if scanned is not None:
+                scanned.set()
+    
+    scanner = threading.Thread(target=scan, daemon=True)
+    scanner.start()
+    position = 0
+    rest = b""
+    try:
+        while True:
+            with ready:
+                while position == state["written"] and not state["done"]:
+                    ready.wait()
+                if position == state["written"]:
+                    break
+                spool.seek(position)
+                data = spool.read(min(state["written"] - position, STREAM_READ_SIZE))
+            position += len(data)
+            *names, rest = (rest + data).split(b"\0")
+            for name in names:
+                yield os.fsdecode(name)
+        if state["error"]:
+            raise state["error"]
+    finally:
+        stopped.set()
+        with ready:
+            spool.close()
+
+def _kernel_copy(source_fd, target_fd):
+    """Copy a whole file between descriptors, without the data passing through Python."""
+    size = os.fstat(source_fd).st_size
+    methods = []
+    if hasattr(os, "copy_file_range"):
+        methods.append(lambda offset: os.copy_file_range(source_fd, target_fd, size - offset, offset))
+    if hasattr(os, "sendfile"):
+        methods.append(lambda offset: os.sendfile(target_fd, source_fd, offset, size - offset))
+    offset = 0
+    while offset < size and methods:
+        try:
+            sent = methods[0](offset)
+        except OSError as e:
+            # Only give up on a method before it copied anything
+            if offset or e.errno not in KERNEL_COPY_UNSUPPORTED:
+                raise
+            methods.pop(0)
+            continue
+        if not sent:
+            # The file was truncated while copying
+            break
+        offset += sent
+    while offset < size and not methods:
+        # Neither system call exists here
+        os.lseek(source_fd, offset, os.SEEK_SET)
+        data = os.read(source_fd, min(size - offset, 1024 * 1024))
+        if not data:
+            break
+        offset += os.write(target_fd, data)
+
+def rename_no_replace(source, target):
+    """
+    Rename a file, refusing to replace an existing one.
+    
+    os.rename silently replaces the target on POSIX systems, so the new name is
+    made a hard link first, which fails if the name exists, and the old name
+    is removed after. On file systems without hard links the target is checked
+    just before the rename instead. Windows never replaces on rename.
+    
+    Args:
+        source (str): Path of the file to rename
+        target (str): New path of the file
+    
+    Raises:
+        FileExistsError: If another file already has the target path
+    """
+    if os.name == "nt":
+        os.rename(source, target)
+        return
+    try:
+        os.link(source, target, follow_symlinks=False)
+    except FileExistsError:
+        if not os.path.samestat(os.lstat(source), os.lstat(target)):
+            raise
+        # Only the case of the name changes on a case-insensitive file system
+        os.rename(source, target)
+        return
+    except OSError as e:
+        if e.errno not in LINK_UNSUPPORTED:
+            raise
+        if os.path.lexists(target):
+            raise FileExistsError(errno.EEXIST, os.strerror(errno.EEXIST), target) from e
+        os.rename(source, target)
+        return
+    os.unlink(source)
+
+def move_file(source, target):
+    """
+    Move a file to a new path, which may be on another device.
+    
+    Within one file system this is a rename that never replaces an existing
+    file (see rename_no_replace). Across devices the data is copied inside the
+    kernel (copy_file_range, else sendfile) into a new file that never
+    replaces an existing one either, timestamps and permissions are copied and
+    the source is unlinked once the copy is complete.
+    
+    Args:
+        source (str): Path of the file to move
+        target (str): New path of the file
+    
+    Returns:
+        bool: True if the file was copied across devices, False if it was renamed
+    """
+    try:
+        rename_no_replace(source, target)
+        return False
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+    
+    with HANDLES.held(2), open(source, "rb") as source_file, open(target, "xb") as target_file:
+        try:
+            _kernel_copy(source_file.fileno(), target_file.fileno())
+            shutil.copystat(source, target)
+        except BaseException:
+            os.remove(target)
+            raise
+    os.remove(source)
+    return True
+
+def copy_with_hash(source, target, algorithm=INGEST_HASH):
+    """
+    Copy a file into a new file, hashing the data on the way.
+    
+    The data is read once, so the hash costs no extra pass over the source.
+    The target is never replaced if it exists and is removed if the copy fails.
+    
+    Args:
+        source (str): Path of the file to copy
+        target (str): Path of the new file
+        algorithm (str): hashlib name of the hash
+    
+    Returns:
+        tuple: (hex digest of the data, number of bytes copied)
+    """
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(COPY_CHUNK_SIZE)
+    view = memoryview(buffer)
+    size = 0
+    with HANDLES.held(2), open(source, "rb", buffering=0) as source_file, \
+            open(target, "xb", buffering=0) as target_file:
+        advise(source_file.fileno(), 0, 0, "POSIX_FADV_SEQUENTIAL")
+        try:
+            while True:
+                count = source_file.readinto(buffer)
+                if not count:
+                    break
+                digest.update(view[:count])
+                written = 0
+                while written < count:
+                    written += target_file.write(view[written:count])
+                size += count
+            shutil.copystat(source, target)
+        except BaseException:
+            os.remove(target)
+            raise
+    return digest.hexdigest(), size
+
+def device_copy_workers(path):
+    """
+    Return how many files to copy at a time from or to the device holding path.
+    
+    Rotating disks lose more to seeking than they gain from parallel requests,
+    so they get one copy at a time; flash media and unknown devices (network
+    shares, other platforms) get INGEST_COPY_WORKERS.
+    
+    Args:
+        path (str): Path of a file or folder on the device
+    
+    Returns:
+        int: Number of parallel copies
+    """
+    try:
+        device = os.stat(path).st_dev
+        block = os.path.realpath(f"/sys/dev/block/{os.major(device)}:{os.minor(device)}")
+        # Partitions keep the queue settings in their disk's directory
+        for directory in (block, os.path.dirname(block)):
+            rotational = os.path.join(directory, "queue", "rotational")
+            if os.path.exists(rotational):
+                with open(rotational) as f:
+                    return 1 if f.read().strip() == "1" else INGEST_COPY_WORKERS
+    except (OSError, AttributeError):
+        # No sysfs, or no os.major on this platform
+        pass
+    return INGEST_COPY_WORKERS
+
+class TargetDirectories:
+    """
+    Directories of a date tree that files are moved into, e.g. "%Y/%m/%d".
+    
+    Each directory is listed once, when the first file is headed for it, and
+    the names in it are kept in an index that also holds the names claimed by
+    moves still in flight, so collisions are found without touching the disk.
+    Directories are created once each instead of once per file. One instance
+    may be shared by all folders of a run.
+    
+    Args:
+        template (str): strftime template of the directory, relative to the
+                        folder being renamed or absolute
+        utc (bool): Whether to fill in the template from the date in UTC
+    """
+    
+    def __init__(self, template, utc=False):
+        self.template = template
+        self.utc = utc
+        self.created = 0
+        self._names = {}
+        self._existing = set()
+        self._lock = threading.Lock()
+    
+    def directory(self, folder, date):
+        """Return the target directory of a file from folder with the given date."""
+        return os.path.normpath(os.path.join(folder, format_date(date, self.template, self.utc)))
+    
+    def _index(self, directory):
+        names = self._names.get(directory)
+        if names is None:
+            try:
+                names = set(os.listdir(directory))
+                self._existing.add(directory)
+            except FileNotFoundError:
+                names = set()
+            self._names[directory] = names
+        return names
+    
+    def claim(self, paths):
+        """
+        Claim target paths for files about to be moved there.
+        
+        Args:
+            paths (list): Target paths, all of them claimed or none
+        
+        Returns:
+            bool: True if the paths were free and are now claimed
+        """
+        with self._lock:
+            entries = [(self._index(os.path.dirname(path)), os.path.basename(path)) for path in paths]
+            if any(name in names for names, name in entries):
+                return False
+            for names, name in entries:
+                names.add(name)
+            return True
+    
+    def release(self, path):
+        """Give up a claimed path whose move failed."""
+        with self._lock:
+            self._names.get(os.path.dirname(path), set()).discard(os.path.basename(path))
+    
+    def makedirs(self, directory):
+        """Create a target directory unless it is known to exist."""
+        with self._lock:
+            if directory in self._existing:
+                return
+        os.makedirs(directory, exist_ok=True)
+        with self._lock:
+            if directory not in self._existing:
+                self._existing.add(directory)
+                self.created += 1
+
+class ConcurrencyLimit:
+    """
+    Limit on the number of calls in flight that adapts while a pipeline runs.
+    
+    Subclasses move self.limit between minimum and maximum in _update, which
+    is called with the lock held after every finished call. The base class
+    keeps the limit fixed at its starting value.
+    
+    Args:
+        initial (int): Starting limit
+        minimum (int): Lowest limit
+        maximum (int): Highest limit
+    """
+    
+    def __init__(self, initial, minimum, maximum):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self._in_flight = 0
+        self._saturated = False
+        self._condition = threading.Condition()
+    
+    def acquire(self):
+        """Wait until a call may start."""
+        with self._condition:
+            while self._in_flight >= self.limit:
+                self._condition.wait()
+            self._in_flight += 1
+            if self._in_flight >= self.limit:
+                self._saturated = True
+    
+    def release(self, latency, now=None):
+        """Record the latency of a finished call and adjust the limit."""
+        with self._condition:
+            self._in_flight -= 1
+            self._update(latency, time.monotonic() if now is None else now)
+            self._condition.notify_all()
+    
+    def _update(self, latency, now):
+        pass
+    
+    def call(self, function, item):
+        """Call function(item) within the limit and record its latency."""
+        self.acquire()
+        started = time.monotonic()
+        try:
+            return function(item)
+        finally:
+            self.release(time.monotonic() - started)
+
+class LatencyLimit(ConcurrencyLimit):
+    """
+    Concurrency limit that adapts to the observed latency, like TCP Vegas.
+    
+    The lowest latency seen approximates the latency of an idle server. Once
+    a window of calls has completed, the number of calls queueing at the
+    server is estimated as limit * (1 - lowest / average latency): below
+    alpha, more calls could be in flight and the limit grows; above beta,
+    calls wait on each other and the limit shrinks.
+    
+    Args:
+        initial (int): Starting limit
+        minimum (int): Lowest limit
+        maximum (int): Highest limit
+        alpha (float): Estimated queue length below which the limit grows
+        beta (float): Estimated queue length above which the limit shrinks
+    """
+    
+    # Windows after which the idle latency is taken again from the fastest call
+    # of the last window, in case the server has become slower for good
+    PROBE_WINDOWS = 50
+    
+    def __init__(self, initial=NETWORK_MIN_IN_FLIGHT, minimum=1, maximum=NETWORK_MAX_IN_FLIGHT,
+                 alpha=2, beta=4):
+        super().__init__(initial, minimum, maximum)
+        self.alpha = alpha
+        self.beta = beta
+        self.min_latency = None
+        self._window = []
+        self._windows = 0
+    
+    def _update(self, latency, now):
+        self._window.append(latency)
+        if self.min_latency is None or latency < self.min_latency:
+            self.min_latency = latency
+        if len(self._window) < self.limit:
+            return
+        
+        average = sum(self._window) / len(self._window)
+        queued = self.limit * (1 - self.min_latency / average) if average > 0 else 0
+        if queued > self.beta:
+            self.limit = max(self.minimum, self.limit - 1)
+        elif queued < self.alpha and self._saturated:
+            # Only grow while the limit is what holds calls back
+            self.limit = min(self.maximum, self.limit + 1)
+        self._windows += 1
+        if self._windows % self.PROBE_WINDOWS == 0:
+            self.min_latency = min(self._window)
+        self._window = []
+        self._saturated = False
+
+class ThroughputLimit(ConcurrencyLimit):
+    """
+    Concurrency limit that climbs towards the highest throughput.
+    
+    Finished calls are counted over windows of at least interval seconds.
+    While a window completes more files per second than the one before, the
+    limit keeps moving in the same direction; when throughput drops it turns
+    around. When throughput stays flat but latency rises, the extra workers
+    only queue behind each other, so the limit goes down.
+    
+    Args:
+        initial (int): Starting limit
+        minimum (int): Lowest limit
+        maximum (int): Highest limit
+        interval (float): Minimum length of a measuring window, in seconds
+        tolerance (float): Relative change below which throughput counts as flat
+    """
+    
+    def __init__(self, initial=1, minimum=1, maximum=AUTO_MAX_WORKERS, interval=0.25, tolerance=0.05):
+        super().__init__(initial, minimum, maximum)
+        self.interval = interval
+        self.tolerance = tolerance
+        self.direction = 1
+        self._window_start = None
+        self._completed = 0
+        self._latency = 0.0
+        self._previous = None
+    
+    def _update(self, latency, now):
+        if self._window_start is None:
+            self._window_start = now
+        self._completed += 1
+        self._latency += latency
+        elapsed = now - self._window_start
+        if elapsed < self.interval or self._completed < self.limit:
+            return
         
+        throughput = self._completed / elapsed
+        average_latency = self._latency / self._completed
+        if self._saturated:
+            # Only a window in which the limit held calls back says anything about it
+            if self._previous is not None:
+                previous_throughput, previous_latency = self._previous
+                gain = throughput / previous_throughput - 1
+                if gain < -self.tolerance:
+                    self.direction = -self.direction
+                elif gain <= self.tolerance and average_latency > previous_latency * (1 + self.tolerance):
+                    self.direction = -1
+            # Steps of about a quarter of the limit, so large pools are reached quickly
+            step = max(1, self.limit // 4) * self.direction
+            self.limit = max(self.minimum, min(self.maximum, self.limit + step))
+        self._previous = (throughput, average_latency)
+        self._window_start = now
+        self._completed = 0
+        self._latency = 0.0
+        self._saturated = False
+
+class Pipeline:
+    """
+    Run items through a chain of stages connected by bounded queues.
+    
+    Items come from a source iterable, which is consumed on its own "scan"
+    thread, and pass through every stage in turn. Each stage has its own worker
+    threads. A full queue blocks the stage in front of it, so a slow stage
+    applies backpressure instead of letting work pile up in memory.
+    
+    Several sources can be run side by side as lanes, e.g. one per storage
+    device: each lane has its own scan thread and its own queues, workers and
+    concurrency limits for the stages in front of the first ordered stage, so
+    a stalled lane never takes workers away from the others. The lanes merge
+    into the ordered stage and everything after it.
+    
+    Args:
+        stages (list): (name, function, workers) tuples. The function receives
+                       an item and returns the item to pass on, or None to drop it
+        queue_size (int): Capacity of the queue in front of each stage
+        ordered (tuple): Names of stages that must see items in source order;
+                         these always run with a single worker
+        limits (dict): Optional concurrency limit factories by stage name, e.g.
+                       LatencyLimit. A limited stage runs limit.maximum workers,
+                       of which only limit.limit work at a time; stages in
+                       front of the first ordered stage get a limit per lane
+    """
+    
+    def __init__(self, stages, queue_size=PIPELINE_QUEUE_SIZE, ordered=(), limits=None):
+        self.limits = limits or {}
+        # Limited stages get their worker count from the limit
+        self.stages = [(name, function, 1 if name in ordered or name in self.limits else max(1, workers))
+                       for name, function, workers in stages]
+        self.ordered = ordered
+        self.queue_size = queue_size
+        # Stages in front of the first ordered stage run once per lane
+        self.split = next((index for index, (name, _, _) in enumerate(self.stages) if name in ordered),
+                          len(self.stages))
+        self.queues = {index: queue.Queue(maxsize=queue_size)
+                       for index in range(self.split, len(self.stages))}
+        self.lanes = {}
+        self.lane_limits = {}
+        self.shared_limits = {name: self.limits[name]() for name, _, _ in self.stages[self.split:]
+                              if name in self.limits and name not in ordered}
+        self.peaks = [0] * len(self.stages)
+        self.stopped = threading.Event()
+        self.errors = []
+        self._running = {}
+        self._lanes_running = 0
+        self._lock = threading.Lock()
+    
+    def _add_lane(self, lane):
+        self.lanes[lane] = [queue.Queue(maxsize=self.queue_size) for _ in range(self.split)]
+        self.lane_limits[lane] = {name: self.limits[name]()
+                                  for name, _, _ in self.stages[:self.split] if name in self.limits}
+    
+    def _limit(self, lane, index):
+        name = self.stages[index][0]
+        if index < self.split:
+            return self.lane_limits[lane].get(name)
+        return self.shared_limits.get(name)
+    
+    def _workers(self, lane, index):
+        limit = self._limit(lane, index)
+        return limit.maximum if limit else self.stages[index][2]
+    
+    def _queue(self, lane, index):
+        return self.lanes[lane][index] if index < self.split else self.queues[index]
+    
+    def _all_queues(self):
+        for lane_queues in self.lanes.values():
+            yield from enumerate(lane_queues)
+        yield from self.queues.items()
+    
+    def queue_depths(self):
+        """Return the current number of items waiting in front of each stage."""
+        depths = {name: 0 for name, _, _ in self.stages}
+        for index, work_queue in self._all_queues():
+            depths[self.stages[index][0]] += work_queue.qsize()
+        return depths
+    
+    def peak_queue_depths(self):
+        """Return the highest number of items seen waiting in front of each stage."""
+        return {name: peak for (name, _, _), peak in zip(self.stages, self.peaks)}
+    
+    def concurrency(self):
+        """Return the current concurrency limit of each limited stage, summed over lanes."""
+        levels = {name: limit.limit for name, limit in self.shared_limits.items()}
+        for limits in self.lane_limits.values():
+            for name, limit in limits.items():
+                levels[name] = levels.get(name, 0) + limit.limit
+        return levels
+    
+    def lane_concurrency(self):
+        """Return the current concurrency limit of each limited stage by lane."""
+        return {lane: {name: limit.limit for name, limit in limits.items()}
+                for lane, limits in self.lane_limits.items()}
+    
+    def _put(self, lane, index, item):
+        work_queue = self._queue(lane, index)
+        while not self.stopped.is_set():
+            try:
+                work_queue.put(item, timeout=0.1)
+            except queue.Full:
+                continue
+            self.peaks[index] = max(self.peaks[index], work_queue.qsize())
+            return True
+        return False
+    
+    def _get(self, lane, index):
+        work_queue = self._queue(lane, index)
+        while not self.stopped.is_set():
+            try:
+                return work_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return PIPELINE_END
+    
+    def _fail(self, error):
+        with self._lock:
+            self.errors.append(error)
+        self.stopped.set()
+    
+    def _finish(self, lane, index):
+        """Signal the end of input to every worker of stage index."""
+        if index == self.split:
+            # The shared stages end once every lane has
+            with self._lock:
+                self._lanes_running -= 1
+                if self._lanes_running:
+                    return
+        if index < len(self.stages):
+            for _ in range(self._workers(lane, index)):
+                self._put(lane, index, PIPELINE_END)
+    
+    def _scan(self, lane, source):
+        try:
+            for sequence, item in source:
+                if not self._put(lane, 0, (sequence, item)):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            self._finish(lane, 0)
+    
+    def _work(self, lane, index):
+        name, function, _ = self.stages[index]
+        is_ordered = name in self.ordered
+        limit = self._limit(lane, index)
+        waiting = {}
+        next_numbers = {}
+        try:
+            while True:
+                entry = self._get(lane, index)
+                if entry is PIPELINE_END:
+                    break
+                
+                if is_ordered:
+                    # Hold items back until every earlier item of the same
+                    # partition has been handled; (partition, number) sequences
+                    # are ordered per partition, plain numbers all together
+                    sequence, item = entry
+                    partition, number = sequence if isinstance(sequence, tuple) else (None, sequence)
+                    waiting[partition, number] = entry
+                    ready = []
+                    next_number = next_numbers.get(partition, 0)
+                    while (partition, next_number) in waiting:
+                        ready.append(waiting.pop((partition, next_number)))
+                        next_number += 1
+                    next_numbers[partition] = next_number
+                else:
+                    ready = [entry]
+                
+                # Dropped items still travel on as None so ordered stages can advance
+                for sequence, item in ready:
+                    if item is not None:
+                        item = limit.call(function, item) if limit else function(item)
+                    if index + 1 < len(self.stages):
+                        self._put(lane, index + 1, (sequence, item))
+        except Exception as e:
+            self._fail(e)
+        finally:
+            key = (lane, index) if index < self.split else index
+            with self._lock:
+                self._running[key] -= 1
+                is_last = self._running[key] == 0
+            if is_last:
+                self._finish(lane, index + 1)
+    
+    def run(self, source, sequenced=False):
+        """
+        Feed all items from source through the stages and wait until done.
+        
+        Args:
+            source (iterable): Items for the first stage
+            sequenced (bool): Whether source yields (sequence, item) pairs, so
+                              items can be fed in a different order than the
+                              one ordered stages see them in. Sequence numbers
+                              must cover 0..n-1 exactly once, or do so per
+                              partition for (partition, number) sequences
+        
+        Raises:
+            Exception: The first error raised by the source or any stage
+        """
+        self.run_lanes({None: source}, sequenced)
+    
+    def run_lanes(self, sources, sequenced=False):
+        """
+        Feed the items of several sources through the stages, one lane each.
+        
+        Args:
+            sources (dict): Source iterables by lane key, e.g. a device number
+            sequenced (bool): Whether the sources yield (sequence, item) pairs;
+                              otherwise the items of each lane are numbered as
+                              a partition of their own
+        
+        Raises:
+            Exception: The first error raised by a source or any stage
+        """
+        if not sequenced:
+            def numbered(lane, source):
+                for number, item in enumerate(source):
+                    yield (number if len(sources) == 1 else (lane, number)), item
+            
+            sources = {lane: numbered(lane, source) for lane, source in sources.items()}
+        
+        threads = []
+        self._lanes_running = len(sources)
+        for lane, source in sources.items():
+            self._add_lane(lane)
+            threads.append(threading.Thread(target=self._scan, args=(lane, source), daemon=True))
+            for index in range(self.split):
+                workers = self._workers(lane, index)
+                self._running[lane, index] = workers
+                threads.extend(threading.Thread(target=self._work, args=(lane, index), daemon=True)
+                               for _ in range(workers))
+        for index in range(self.split, len(self.stages)):
+            workers = self._workers(None, index)
+            self._running[index] = workers
+            threads.extend(threading.Thread(target=self._work, args=(None, index), daemon=True)
+                           for _ in range(workers))
+        
+        for thread in threads:
+            thread.start()
+        if not sources:
+            self._lanes_running = 1
+            self._finish(None, self.split)
+        for thread in threads:
+            thread.join()
+        if self.errors:
+            raise self.errors[0]
+
+def combine_stats(total, stats):
+    """
+    Add the counts of one rename_images run to a running total.
+    
+    Args:
+        total (dict): Statistics to add to (updated in place)
+        stats (dict): Statistics returned by rename_images
+    
     Returns:
-        dict: Statistics about the operation
+        dict: The updated total
+    """
+    for key in ("total", "renamed", "skipped", "removed_duplicates", "quarantined"):
+        total[key] = total.get(key, 0) + stats.get(key, 0)
+    total["error"] = total.get("error", False) or stats.get("error", False)
+    return total
+
+def _device_name(device):
+    """Return a readable name for a device number, e.g. "8:1"."""
+    if hasattr(os, "major"):
+        return f"{os.major(device)}:{os.minor(device)}"
+    return str(device)
+
+def _notify(message, callback=None):
+    """Send a progress message to the callback, or print it if there is none."""
+    if callback:
+        callback(message)
+    else:
+        print(message)
+
+def _plan_folder(folder_path, files, name_index, partition, stopped, write_result, callback,
+                 create_backup, format_string, remove_duplicates, file_filter, date_sources, verify,
+                 group_related, streaming, date_cache, metrics, io_order, fadvise, sandbox, utc,
+                 targets, copy_files=False, verify_copies=False, dedup_backup=False,
+                 backup_archive=None):
+    """
+    List one folder and build the stage functions renaming its files.
+    
+    Args:
+        folder_path (str): Path to the folder containing images and videos
+        files (list): Optional names of the files to process instead of scanning the folder
+        name_index (set): Optional set of all names in the folder
+        partition (int): Folder number in a multi-folder run, or None for a single folder
+        stopped (threading.Event): Set when the pipeline stops after an error
+        write_result (function): Called with the folder and a per-file result for the report
+        callback (function): Optional callback function for progress updates
+        sandbox (ProcessSandbox): Optional sandbox running the Pillow fallback
+        targets (TargetDirectories): Optional date tree to move the files into
+        copy_files (bool): Copy the files into the date tree instead of moving them
+        verify_copies (bool): Read each copy back and compare its hash with the original's
+        dedup_backup (bool): Keep backups in a content-addressed BackupStore
+        backup_archive (str): Stream backups into a BackupArchive of this format
+        Other arguments: See rename_images
+    
+    Returns:
+        dict: Plan with the folder's statistics, job sources per device lane and a
+              function per pipeline stage, or None if the folder does not exist
     """
     # Validate folder exists
     if not os.path.isdir(folder_path):
-        message = f"Error: Folder '{folder_path}' does not exist"
-        if callback:
-            callback(message)
-        else:
-            print(message)
-        return {"total": 0, "renamed": 0, "skipped": 0, "removed_duplicates": 0, "error": True}
+        _notify(f"Error: Folder '{folder_path}' does not exist", callback)
+        return None
     
     # Create backup folder if needed
     backup_folder = None
+    backup_store = None
+    archive = None
     if create_backup:
         backup_folder = os.path.join(folder_path, "backup")
-        os.makedirs(backup_folder, exist_ok=True)
-        message = f"Created backup folder: {backup_folder}"
-        if callback:
-            callback(message)
+        if dedup_backup:
+            backup_store = BackupStore(backup_folder)
         else:
-            print(message)
+            os.makedirs(backup_folder, exist_ok=True)
+        _notify(f"Created backup folder: {backup_folder}", callback)
+        if backup_archive:
+            archive = BackupArchive(os.path.join(backup_folder, f"backup.{backup_archive}"), backup_archive)
     
     # Track statistics
-    total_files = 0
-    renamed_files = 0
-    skipped_files = 0
-    removed_duplicates = 0
+    stats = {
+        "total": 0,
+        "renamed": 0,
+        "skipped": 0,
+        "removed_duplicates": 0,
+        "quarantined": 0,
+        "error": False
+    }
+    if copy_files:
+        stats["bytes_copied"] = 0
+    stats_lock = threading.Lock()
     
     # Get image and video files
     if file_filter is None:
         # Default extensions if no filter is provided
-        image_extensions = (".jpg", ".jpeg", ".png", ".nef", ".cr2", ".arw")
-        video_extensions = (".mp4", ".mov", ".avi", ".mkv", ".wmv", ".m4v", ".3gp", ".webm", ".flv")
-        media_extensions = image_extensions + video_extensions
+        media_extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
         
         # Create a default filter function
         def file_filter(filename):
             return filename.lower().endswith(media_extensions)
     
-    media_files = []
+    inodes = {}
+    xmp_names = []
+    # Set once a streaming scan has read the whole folder
+    scanned = None
+    if files is not None:
+        # Only the given files, e.g. new arrivals in a watched folder
+        media_files = [file for file in files if file_filter(file)]
+        symlinks = {file for file in media_files if os.path.islink(os.path.join(folder_path, file))}
+        sidecar_files = [file for file in files if group_related and not file_filter(file)
+                         and file.lower().endswith(SIDECAR_EXTENSIONS)]
+        xmp_names = name_index if name_index is not None else files
+        message = f"Found {len(media_files)} media files to process"
+        
+        if group_related:
+            groups = group_related_files(media_files, sidecar_files)
+        else:
+            groups = [(os.path.splitext(file)[0], [file], []) for file in media_files]
+    elif streaming:
+        # Files are handed over one by one while the folder is still being scanned
+        message = f"Streaming media files from {folder_path}"
+        scanned = threading.Event()
+        groups = ((os.path.splitext(file)[0], [file], [])
+                  for file in stream_media_files(folder_path, file_filter, scanned))
+        if "xmp" in date_sources:
+            # One listing pass keeping only the sidecar names
+            with os.scandir(folder_path) as entries:
+                xmp_names = [entry.name for entry in entries if entry.name.lower().endswith(".xmp")]
+    else:
+        media_files = []
+        sidecar_files = []
+        symlinks = set()
+        
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                file = entry.name
+                # Skip directories and files that don't match the filter
+                if entry.is_dir():
+                    continue
+                if file_filter(file):
+                    media_files.append(file)
+                    if entry.is_symlink():
+                        symlinks.add(file)
+                    if io_order != "scan":
+                        # Free with the directory entry on most file systems
+                        inodes[entry.path] = entry.inode()
+                else:
+                    if group_related and file.lower().endswith(SIDECAR_EXTENSIONS):
+                        sidecar_files.append(file)
+                    if file.lower().endswith(".xmp"):
+                        xmp_names.append(file)
+        
+        message = f"Found {len(media_files)} media files to process"
+        
+        if group_related:
+            groups = group_related_files(media_files, sidecar_files)
+        else:
+            groups = [(os.path.splitext(file)[0], [file], []) for file in media_files]
+    
+    _notify(message, callback)
     
-    for file in os.listdir(folder_path):
-        file_path = os.path.join(folder_path, file)
-        # Skip directories and files that don't match the filter
-        if os.path.isdir(file_path) or not file_filter(file):
-            continue
-        media_files.append(file)
+    # Sidecars are found in the listing, without a stat per file
+    xmp_sidecars = index_xmp_sidecars(xmp_names) if "xmp" in date_sources else {}
     
-    total_files = len(media_files)
-    message = f"Found {total_files} media files to process"
-    if callback:
-        callback(message)
+    def find_sidecar(file):
+        name = xmp_sidecars.get(file.lower()) or xmp_sidecars.get(os.path.splitext(file)[0].lower())
+        return os.path.join(folder_path, name) if name else None
+    
+    def job(group):
+        stem, members, sidecars = group
+        return {"folder": folder_path, "stem": stem, "members": members, "files": members + sidecars,
+                "plan": plan}
+    
+    folder_device = os.stat(folder_path).st_dev
+    if not isinstance(groups, list):
+        if io_order != "scan":
+            _notify(f"I/O order '{io_order}' is not available in streaming mode, reading in scan order",
+                    callback)
+        sources = {folder_device: enumerate(job(group) for group in groups)}
     else:
-        print(message)
+        # Headers may be read in disk order; the sequence numbers still make
+        # names get picked and applied in scan order
+        read_order = sort_for_io([os.path.join(folder_path, members[0]) for _, members, _ in groups],
+                                 io_order, inodes)
+        
+        # Each device gets a lane with its own queues and workers, so a slow
+        # device never holds up reads from the others. Only symlinks can point
+        # to another device than the folder's.
+        lanes = {}
+        for index in read_order:
+            first = groups[index][1][0]
+            device = folder_device
+            if first in symlinks:
+                try:
+                    device = os.stat(os.path.join(folder_path, first)).st_dev
+                except OSError:
+                    pass
+            lanes.setdefault(device, []).append(index)
+        sources = {device: ((index, job(groups[index])) for index in indexes)
+                   for device, indexes in lanes.items()}
     
-    # Process all files in the folder
-    for file in media_files:
-        file_path = os.path.join(folder_path, file)
+    # Names that already match the format are skipped without opening the file,
+    # unless they still have to be moved into the date tree
+    format_pattern = None if verify or targets else compile_format_pattern(format_string)
+    
+    def is_already_named(job):
+        stem = job["stem"]
+        return bool(format_pattern and format_pattern.fullmatch(stem) and all(
+            name[len(stem):] == name[len(stem):].lower() for name in job["files"]))
+    
+    def prefetch(batch):
+        prefetch_headers(os.path.join(folder_path, job["members"][0])
+                         for _, job in batch if not is_already_named(job))
+        return batch
+    
+    def prefetched(entries):
+        """Queue the header reads of each batch of jobs before handing it on."""
+        batch = []
+        for entry in entries:
+            batch.append(entry)
+            if len(batch) == PREFETCH_BATCH:
+                yield from prefetch(batch)
+                batch = []
+        yield from prefetch(batch)
+    
+    if fadvise and "metadata" in date_sources:
+        sources = {lane: prefetched(source) for lane, source in sources.items()}
+    if partition is not None:
+        # Number the jobs within this folder only, so its names are resolved
+        # in scan order without waiting for other folders
+        sources = {lane: (((partition, sequence), job) for sequence, job in source)
+                   for lane, source in sources.items()}
+    
+    def record(name, status, new_name=None, reason=None, digest=None, **counts):
+        """Update the statistics and write a per-file result to the report."""
+        if metrics:
+            metrics.inc("imagerenamer_files_processed_total", result=status)
+        with stats_lock:
+            for key, count in counts.items():
+                stats[key] += count
+        result = {"file": name, "status": status, "new_name": new_name}
+        if reason:
+            result["reason"] = reason
+        if digest:
+            result[INGEST_HASH] = digest
+        write_result(folder_path, result)
+    
+    # Target paths planned but not renamed yet, and paths that planned renames
+    # will free up; both only hold files that are still in flight
+    reserved = set()
+    vacating = {}
+    plan_lock = threading.Lock()
+    
+    def is_taken(path, own_path):
+        if path == own_path:
+            return False
+        with plan_lock:
+            if path in reserved:
+                return True
+            vacated = vacating.get(path)
+        if vacated is not None:
+            # An earlier group moves this file away; wait until it has, so names
+            # are picked exactly as if files were processed one by one
+            while not vacated.wait(0.1):
+                if stopped.is_set():
+                    return True
+        if name_index is not None:
+            with plan_lock:
+                return os.path.basename(path) in name_index
+        return os.path.exists(path)
+    
+    def fetch(job):
+        """Read the header and status of the file metadata will be taken from."""
+        file = job["members"][0]
+        if is_already_named(job) or (date_sources[0] == "filename" and get_filename_date(file)):
+            return job
+        file_path = os.path.join(job["folder"], file)
+        try:
+            if "metadata" in date_sources:
+                job["header"], job["stat"] = read_header(file_path, drop_cache=fadvise)
+            else:
+                job["stat"] = os.stat(file_path)
+        except OSError:
+            # The extract stage tries again and reports the error
+            pass
+        return job
+    
+    def extract(job):
+        members = job["members"]
+        with stats_lock:
+            stats["total"] += len(members)
+        
+        if is_already_named(job):
+            for member in members:
+                _notify(f"Skipping {member} (already has correct name)", callback)
+                record(member, "skipped", member, skipped=1)
+            return None
+        
+        # Metadata is only read from the cheapest member of the group
+        file = members[0]
+        file_path = os.path.join(job["folder"], file)
+        cache_key = None
+        cached = None
+        # Headers fetched ahead of time are not needed past this stage
+        header = job.pop("header", None)
+        sidecar_path = find_sidecar(file)
+        # A sidecar may be edited without touching the file, so its date is never cached
+        if date_cache is not None and not sidecar_path:
+            stat = job.get("stat") or os.stat(file_path)
+            # Jobs trying other sources, or in another order, may find another date
+            cache_key = (stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime_ns, date_sources)
+            cached = date_cache.get(cache_key)
         
-        # Try to get creation date from EXIF metadata
-        creation_date = get_exif_creation_date(file_path)
+        if cached:
+            creation_date, date_source = cached
+        else:
+            io_stats = {"bytes_read": len(header or b"")}
+            started = time.monotonic()
+            try:
+                creation_date, date_source = get_creation_date(file_path, date_sources, io_stats, fadvise,
+                                                               header, job.get("stat"), sandbox,
+                                                               sidecar_path)
+            except MetadataLimitError as e:
+                # Leave the file alone and carry on with the rest of the batch
+                if metrics:
+                    metrics.inc("imagerenamer_errors_total", type=type(e).__name__)
+                _notify(f"Quarantined {file}: {e}", callback)
+                for member in members:
+                    record(member, "quarantined", reason=str(e), skipped=1, quarantined=1)
+                return None
+            if metrics:
+                file_format = os.path.splitext(file)[1].lstrip(".").lower() or "none"
+                metrics.observe("imagerenamer_extraction_seconds", time.monotonic() - started,
+                                format=file_format)
+                metrics.inc("imagerenamer_bytes_read_total", io_stats.get("bytes_read", 0))
+            # File times change with every rename, and names are parsed without any I/O,
+            # so only dates read from metadata are kept
+            if cache_key and date_source == "metadata":
+                date_cache[cache_key] = (creation_date, date_source)
         
-        # If no EXIF data, fallback to file creation timestamp
         if not creation_date:
-            creation_time = os.path.getctime(file_path)
-            creation_date = datetime.fromtimestamp(creation_time)
-            message = f"No EXIF data for {file}, using file creation time"
-            if callback:
-                callback(message)
-            else:
-                print(message)
+            _notify(f"No date found for {file}, skipping", callback)
+            for member in members:
+                record(member, "no_date", skipped=1)
+            return None
+        
+        # Report when we had to fall back to the file creation timestamp
+        if date_source == "stat":
+            _notify(f"No EXIF data for {file}, using file creation time", callback)
         
-        # Generate new filename
-        file_extension = Path(file).suffix.lower()
-        new_filename = creation_date.strftime(format_string) + file_extension
-        new_path = os.path.join(folder_path, new_filename)
+        job["date"] = creation_date
+        return job
+    
+    def resolve(job):
+        folder, stem, members, files = job["folder"], job["stem"], job["members"], job["files"]
+        
+        # Generate new filenames, keeping each member's (lowercased) extension
+        base_name = format_date(job["date"], format_string, utc)
+        new_filenames = [base_name + name[len(stem):].lower() for name in files]
+        
+        # In organize mode names are relative to the folder, or absolute if the
+        # date tree lies outside of it
+        directory = targets.directory(folder, job["date"]) if targets else folder
+        prefix = "" if directory == os.path.normpath(folder) else os.path.relpath(directory, folder)
+        if prefix.startswith(os.pardir):
+            prefix = directory
+        
+        def conflicts(new_filenames):
+            if prefix:
+                # Names in the date tree are claimed as they are picked
+                return not targets.claim([os.path.join(directory, name) for name in new_filenames])
+            return any(is_taken(os.path.join(folder, new_filename), os.path.join(folder, name))
+                       for name, new_filename in zip(files, new_filenames))
         
-        # Avoid overwriting existing files
+        # Avoid overwriting existing files; the whole group shares one counter suffix
         counter = 1
-        while os.path.exists(new_path) and new_path != file_path:
-            # If removing duplicates is enabled, skip this file
+        job["duplicate"] = False
+        while conflicts(new_filenames):
+            # If removing duplicates is enabled, drop this group
             if remove_duplicates:
-                message = f"Skipping duplicate {file} (same creation date as existing {new_filename})"
-                if callback:
-                    callback(message)
-                else:
-                    print(message)
-                skipped_files += 1
-                removed_duplicates += 1
+                job["duplicate"] = True
                 break
             
-            # Otherwise, add a suffix to the filename
-            new_filename = creation_date.strftime(format_string) + f"_{counter}" + file_extension
-            new_path = os.path.join(folder_path, new_filename)
+            # Otherwise, add a suffix to the filenames
+            new_filenames = [base_name + f"_{counter}" + name[len(stem):].lower() for name in files]
             counter += 1
+        new_filenames = [os.path.join(prefix, name) for name in new_filenames]
         
-        # If the new filename is the same as the old one, skip
-        if new_path == file_path:
-            message = f"Skipping {file} (already has correct name)"
-            if callback:
-                callback(message)
-            else:
-                print(message)
-            skipped_files += 1
-            continue
-            
-        # Create backup if requested
-        if create_backup:
-            shutil.copy2(file_path, os.path.join(backup_folder, file))
+        if counter > 1 and not job["duplicate"] and metrics:
+            metrics.inc("imagerenamer_collisions_resolved_total")
+        
+        if job["duplicate"]:
+            _notify(f"Skipping duplicate {members[0]} (same creation date as existing {new_filenames[0]})",
+                    callback)
+            with stats_lock:
+                stats["skipped"] += len(members)
+                stats["removed_duplicates"] += len(members)
+            job["renames"] = [(name, None) for name in files]
+        elif new_filenames == files:
+            # If the new filenames are the same as the old ones, skip
+            _notify(f"Skipping {members[0]} (already has correct name)", callback)
+            for member in members:
+                record(member, "skipped", member, skipped=1)
+            return None
+        else:
+            job["renames"] = [(name, new_filename) for name, new_filename in zip(files, new_filenames)
+                              if name != new_filename]
         
-        # Rename the file
+        with plan_lock:
+            for name, new_filename in job["renames"]:
+                vacating[os.path.join(folder, name)] = threading.Event()
+                if new_filename:
+                    reserved.add(os.path.join(folder, new_filename))
+        return job
+    
+    def apply(job):
+        folder, members = job["folder"], job["members"]
+        if scanned is not None:
+            # A streaming scan would come across renamed files once more
+            # under their new names, so nothing is renamed until it is done
+            while not scanned.wait(0.1):
+                if stopped.is_set():
+                    return None
+        for name, new_filename in job["renames"]:
+            file_path = os.path.join(folder, name)
+            new_path = os.path.join(folder, new_filename) if new_filename else None
+            is_media = name in members
+            try:
+                # Create backup if requested
+                if backup_store:
+                    # Content stored before is not copied again
+                    backup_store.add(file_path, name)
+                elif archive:
+                    # The archive writer reads the file after it was renamed
+                    archive.add(file_path, name)
+                elif create_backup:
+                    # The copy holds two descriptors, source and target
+                    with HANDLES.held(2):
+                        shutil.copy2(file_path, os.path.join(backup_folder, name))
+                
+                if new_path is None and copy_files:
+                    # Duplicates are left out of the copy; the originals stay
+                    record(name, "duplicate")
+                    continue
+                
+                if new_path is None:
+                    # Duplicates are removed instead of renamed
+                    try:
+                        os.remove(file_path)
+                        if name_index is not None:
+                            with plan_lock:
+                                name_index.discard(name)
+                        record(name, "duplicate")
+                    except Exception as e:
+                        if metrics:
+                            metrics.inc("imagerenamer_errors_total", type=type(e).__name__)
+                        _notify(f"Error removing {name}: {e}", callback)
+                        record(name, "error")
+                    continue
+                
+                if copy_files:
+                    # The data is hashed during the copy, so it is read only once
+                    try:
+                        targets.makedirs(os.path.dirname(new_path))
+                        digest, size = copy_with_hash(file_path, new_path)
+                        if verify_copies and hash_file(new_path, INGEST_HASH, from_device=True) != digest:
+                            os.remove(new_path)
+                            raise OSError(f"Copy of {name} does not match the original")
+                        _notify(f"Copied: {name} → {new_filename}", callback)
+                        record(name, "copied", new_filename, digest=digest,
+                               renamed=1 if is_media else 0, bytes_copied=size)
+                    except Exception as e:
+                        targets.release(new_path)
+                        if metrics:
+                            metrics.inc("imagerenamer_errors_total", type=type(e).__name__)
+                        _notify(f"Error copying {name}: {e}", callback)
+                        record(name, "error", skipped=1 if is_media else 0)
+                    continue
+                
+                # Rename the file, or move it into the date tree
+                in_place = os.path.dirname(new_filename) == ""
+                try:
+                    if in_place:
+                        # The index may miss a file that arrived since it was taken
+                        rename_no_replace(file_path, new_path)
+                    else:
+                        targets.makedirs(os.path.dirname(new_path))
+                        move_file(file_path, new_path)
+                    if name_index is not None:
+                        with plan_lock:
+                            name_index.discard(name)
+                            if in_place:
+                                name_index.add(new_filename)
+                    _notify(f"Renamed: {name} → {new_filename}", callback)
+                    record(name, "renamed", new_filename, renamed=1 if is_media else 0)
+                except Exception as e:
+                    if not in_place:
+                        targets.release(new_path)
+                    if metrics:
+                        metrics.inc("imagerenamer_errors_total", type=type(e).__name__)
+                    _notify(f"Error renaming {name}: {e}", callback)
+                    record(name, "error", skipped=1 if is_media else 0)
+            finally:
+                with plan_lock:
+                    reserved.discard(new_path)
+                    vacating.pop(file_path).set()
+        return None
+    
+    def close():
+        """Finish what is left after the pipeline ran, i.e. the backup archive."""
+        if archive:
+            try:
+                archive.close()
+            except Exception as e:
+                _notify(f"Error writing backup archive {archive.path}: {e}", callback)
+                stats["error"] = True
+    
+    plan = {"folder": folder_path, "stats": stats, "sources": sources,
+            "fetch": fetch, "extract": extract, "resolve": resolve, "apply": apply, "close": close}
+    return plan
+
+def _run_folders(folders, callback=None, workers=None, date_sources=None, io_order="scan",
+                 network=False, report_path=None, timeout=None, target_format=None, sandbox=None,
+                 **options):
+    """
+    Rename the files of several folders through one shared pipeline.
+    
+    Folders on the same device share a lane, so the worker pool and the
+    concurrency limits are shared rather than duplicated per folder. Names
+    are still resolved in scan order within each folder.
+    
+    Args:
+        folders (list): (folder_path, files, name_index) tuples
+        callback (function): Optional callback function for progress updates
+        workers (dict): Worker threads per stage, see rename_images
+        date_sources (tuple): Date sources to try in order
+        io_order (str): Order of the metadata reads, one of IO_ORDERS
+        network (bool): Whether to add the network fetch stage
+        report_path (str): Optional path of a JSON lines file receiving a result per file
+        timeout (float): Optional seconds allowed for the metadata of one file
+        target_format (str): Optional template of the date tree to move files into
+        sandbox (ProcessSandbox): Optional running sandbox to use instead of starting one
+        **options: Further keyword arguments of rename_images
+    
+    Returns:
+        tuple: (statistics per folder, in the order given, or None for a missing
+                folder; the Pipeline that ran; whether files were read in several lanes)
+    """
+    if date_sources is None:
+        date_sources = DEFAULT_DATE_SOURCES
+    for source in date_sources:
+        if source not in DATE_SOURCES:
+            raise ValueError(f"Unknown date source: {source}")
+    if io_order not in IO_ORDERS:
+        raise ValueError(f"Unknown I/O order: {io_order}")
+    if options.get("backup_archive"):
+        if options["backup_archive"] not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown backup archive format: {options['backup_archive']}")
+        if options.get("dedup_backup"):
+            raise ValueError("A backup cannot be both deduplicated and archived")
+    
+    stage_workers = dict(DEFAULT_STAGE_WORKERS)
+    for stage, count in (workers or {}).items():
+        if stage not in stage_workers:
+            raise ValueError(f"Unknown pipeline stage: {stage}")
+        if count != AUTO_WORKERS and not isinstance(count, int):
+            raise ValueError(f"Invalid worker count for {stage}: {count}")
+        stage_workers[stage] = count
+    
+    def dispatch(name):
+        """Return a stage function running the stage of the job's own folder."""
+        return lambda job: job["plan"][name](job)
+    
+    stages = [
+        ("extract", dispatch("extract"), stage_workers["extract"]),
+        ("resolve", dispatch("resolve"), stage_workers["resolve"]),
+        ("apply", dispatch("apply"), stage_workers["apply"]),
+    ]
+    # Stages tuned while running; resolve is ordered and stays on one worker
+    limits = {stage: ThroughputLimit for stage, count in stage_workers.items()
+              if count == AUTO_WORKERS and stage != "resolve"}
+    if network:
+        # Round trips dominate on network storage: hide their latency with many
+        # requests in flight, separate from the CPU-bound extract workers
+        stages.insert(0, ("fetch", dispatch("fetch"), NETWORK_MAX_IN_FLIGHT))
+        limits["fetch"] = LatencyLimit
+    
+    pipeline = Pipeline(stages, ordered=("resolve",), limits=limits)
+    
+    # Per-file results go to the report file instead of being kept in memory
+    report_file = None
+    report_lock = threading.Lock()
+    
+    def write_result(folder, result):
+        if not report_file:
+            return
+        if len(folders) > 1:
+            result = dict(result, folder=folder)
+        with report_lock:
+            report_file.write(json.dumps(result) + "\n")
+    
+    # Parsers without bounds of their own run in worker processes killed at the
+    # deadline. A sandbox passed in belongs to the caller and stays up.
+    own_sandbox = None
+    if sandbox is None and timeout is not None and "metadata" in date_sources:
+        sandbox = own_sandbox = ProcessSandbox(timeout)
+    
+    # The date tree is shared, so folders moving files into the same
+    # directories see each other's names
+    targets = None
+    if target_format:
+        targets = TargetDirectories(target_format, options.get("utc", False))
+    
+    plans = []
+    for partition, (folder_path, files, name_index) in enumerate(folders):
+        plans.append(_plan_folder(
+            folder_path, files, name_index, partition if len(folders) > 1 else None,
+            pipeline.stopped, write_result, callback, date_sources=date_sources,
+            io_order=io_order, sandbox=sandbox, targets=targets, **options
+        ))
+    
+    # Folders on the same device are read one after the other in its lane
+    lanes = {}
+    for plan in plans:
+        if plan:
+            for device, source in plan["sources"].items():
+                lanes.setdefault(device, []).append(source)
+    sources = {device: itertools.chain.from_iterable(folder_sources)
+               for device, folder_sources in lanes.items()}
+    
+    if any(plans):
+        if report_path:
+            report_file = open(report_path, "w", encoding="utf-8")
         try:
-            os.rename(file_path, new_path)
-            message = f"Renamed: {file} → {new_filename}"
-            if callback:
-                callback(message)
-            else:
-                print(message)
-            renamed_files += 1
-        except Exception as e:
-            message = f"Error renaming {file}: {e}"
-            if callback:
-                callback(message)
-            else:
-                print(message)
-            skipped_files += 1
+            pipeline.run_lanes(sources, sequenced=True)
+        finally:
+            if report_file:
+                report_file.close()
+            if own_sandbox:
+                own_sandbox.close()
+            for plan in plans:
+                if plan:
+                    plan["close"]()
+    
+    results = [plan["stats"] if plan else None for plan in plans]
+    return results, pipeline, len(sources) > 1 and bool(limits)
+
+def _pipeline_stats(stats, pipeline, multiple_lanes):
+    """Add the pipeline's queue peaks and concurrency levels to statistics."""
+    stats["queue_peaks"] = pipeline.peak_queue_depths()
+    stats["concurrency"] = pipeline.concurrency()
+    if multiple_lanes:
+        stats["device_concurrency"] = {_device_name(device): levels
+                                       for device, levels in pipeline.lane_concurrency().items()}
+    return stats
+
+def rename_images(folder_path, create_backup=False, format_string="%Y-%m-%d_%H-%M-%S", callback=None, 
+                 remove_duplicates=False, file_filter=None, date_sources=None,
+                 verify=False, group_related=True, streaming=False, report_path=None,
+                 workers=None, files=None, name_index=None, date_cache=None, metrics=None,
+                 io_order="scan", fadvise=False, network=False, timeout=None,
+                 utc=False, target_format=None, dedup_backup=False, backup_archive=None,
+                 sandbox=None):
+    """
+    Rename all image and video files in the folder based on their creation date.
+    
+    Files are processed by a pipeline of stages connected by bounded queues:
+    scan, extract (read the creation date), resolve (pick collision-free names
+    in scan order) and apply (backup and rename). With io_order, headers are
+    read in the order of the files' location on disk, while names are still
+    picked and applied in scan order. In network mode a fetch stage in front
+    of extract reads file headers and status with many requests in flight.
+    Files on different devices are read in separate pipeline lanes, each with
+    its own queues, workers and concurrency limits.
+    
+    Args:
+        folder_path (str): Path to the folder containing images and videos
+        create_backup (bool): Whether to create a backup of the original files
+        format_string (str): Format string for the new filename (strftime format, plus %L
+                             for milliseconds)
+        callback (function): Optional callback function for progress updates
+        remove_duplicates (bool): Whether to remove duplicate files instead of renaming with suffixes
+        file_filter (function): Optional function to filter which files to process
+        date_sources (tuple): Date sources to try in order (default: metadata, then stat)
+        verify (bool): Re-check files whose names already match the format instead of skipping them
+        group_related (bool): Rename files sharing a stem (RAW+JPEG pairs, sidecars) as one group
+        streaming (bool): Process files while the folder is being scanned, with memory use
+                          independent of the folder size (files are not grouped in this mode,
+                          and renames wait until the scan is done)
+        report_path (str): Optional path of a JSON lines file receiving a result per file
+        workers (dict): Worker threads per stage, e.g. {"extract": 4, "apply": 2}; "auto" lets
+                        a ThroughputLimit tune the count during the run
+        files (list): Optional names of the files to process instead of scanning the folder
+        name_index (set): Optional set of all names in the folder, used instead of checking the
+                          disk for collisions and kept up to date with the renames
+        date_cache (dict): Optional mapping reused across runs to remember the dates read from
+                           metadata, keyed by inode, size, modification time and date
+                           sources so that entries survive renames
+        metrics (Metrics): Optional imagerenamer.metrics.Metrics to record counters and timings in
+        io_order (str): Order of the metadata reads, one of IO_ORDERS: "scan", "inode" or
+                        "extent" (first physical extent, falling back to inode order).
+                        Ignored in streaming mode
+        fadvise (bool): Prefetch file headers in batches and drop them from the page cache
+                        once read (posix_fadvise), so scans of large libraries leave the
+                        cached data of other workloads alone
+        network (bool): Keep many header reads in flight for folders on network storage
+                        (NFS, SMB), adapting their number to the observed latency
+        timeout (float): Seconds allowed for reading the metadata of one file; the Pillow
+                         fallback then runs in worker processes that are killed at the
+                         deadline. Files over this or the read limits are quarantined:
+                         left alone, counted and reported with the reason
+        utc (bool): Format names from the creation date converted to UTC, using the
+                    offset recorded with the date (local time for dates without one)
+        target_format (str): Optional strftime template of a date tree, e.g. "%Y/%m/%d",
+                             to move the files into while renaming them; relative
+                             templates start from folder_path. Files are renamed where
+                             possible and copied by the kernel, then unlinked, when the
+                             tree is on another device
+        dedup_backup (bool): With create_backup, keep the backups in a content-addressed
+                             store (see imagerenamer.backup) holding identical files once
+                             and skipping files backed up before without reading them
+        backup_archive (str): With create_backup, stream the backups into one archive,
+                              backup/backup.tar (uncompressed) or backup/backup.zip
+                              (stored), written sequentially by its own thread, with an
+                              index for restoring single files
+                              (see imagerenamer.backup.restore_from_archive)
+        sandbox (ProcessSandbox): Optional sandbox, kept running by the caller, to run the
+                                  Pillow fallback in instead of starting one for this run
+                                  (with timeout); its own timeout applies
+    
+    Returns:
+        dict: Statistics about the operation
+    """
+    results, pipeline, multiple_lanes = _run_folders(
+        [(folder_path, files, name_index)], callback=callback, workers=workers,
+        date_sources=date_sources, io_order=io_order, network=network, report_path=report_path,
+        create_backup=create_backup, format_string=format_string,
+        remove_duplicates=remove_duplicates, file_filter=file_filter, verify=verify,
+        group_related=group_related, streaming=streaming, date_cache=date_cache,
+        metrics=metrics, fadvise=fadvise, timeout=timeout, utc=utc,
+        target_format=target_format, dedup_backup=dedup_backup, backup_archive=backup_archive,
+        sandbox=sandbox
+    )
+    if results[0] is None:
+        return {"total": 0, "renamed": 0, "skipped": 0, "removed_duplicates": 0, "quarantined": 0,
+                "error": True}
     
     # Return statistics
-    stats = {
-        "total": total_files,
-        "renamed": renamed_files,
-        "skipped": skipped_files,
-        "removed_duplicates": removed_duplicates,
-        "error": False
-    }
+    return _pipeline_stats(results[0], pipeline, multiple_lanes)
+
+def rename_folders(folder_paths, create_backup=False, format_string="%Y-%m-%d_%H-%M-%S", callback=None,
+                   remove_duplicates=False, file_filter=None, date_sources=None,
+                   verify=False, group_related=True, streaming=False, report_path=None,
+                   workers=None, date_cache=None, metrics=None,
+                   io_order="scan", fadvise=False, network=False, timeout=None,
+                   utc=False, target_format=None, dedup_backup=False, backup_archive=None):
+    """
+    Rename the image and video files of several folders in one run.
+    
+    All folders share one pipeline, so worker threads and concurrency limits
+    are set up once instead of per folder, and folders on different devices
+    are read in parallel. A missing folder is reported and counted as an
+    error without stopping the others.
+    
+    Args:
+        folder_paths (list): Paths to the folders containing images and videos;
+                             a folder given twice is processed once
+        Other arguments: See rename_images. Report lines carry a "folder" key.
+    
+    Returns:
+        dict: {"folders": statistics per folder, "total": combined statistics}
+    """
+    folder_paths = list(dict.fromkeys(folder_paths))
+    results, pipeline, multiple_lanes = _run_folders(
+        [(folder_path, None, None) for folder_path in folder_paths], callback=callback,
+        workers=workers, date_sources=date_sources, io_order=io_order, network=network,
+        report_path=report_path, create_backup=create_backup, format_string=format_string,
+        remove_duplicates=remove_duplicates, file_filter=file_filter, verify=verify,
+        group_related=group_related, streaming=streaming, date_cache=date_cache,
+        metrics=metrics, fadvise=fadvise, timeout=timeout, utc=utc,
+        target_format=target_format, dedup_backup=dedup_backup, backup_archive=backup_archive
+    )
+    
+    folders = {}
+    total = {"total": 0, "renamed": 0, "skipped": 0, "removed_duplicates": 0, "quarantined": 0,
+             "error": False}
+    for folder_path, stats in zip(folder_paths, results):
+        folders[folder_path] = stats or {"total": 0, "renamed": 0, "skipped": 0, "removed_duplicates": 0,
+                                         "quarantined": 0, "error": True}
+        combine_stats(total, folders[folder_path])
+    return {"folders": folders, "total": _pipeline_stats(total, pipeline, multiple_lanes)}
+
+def ingest_images(source_path, destination_path, format_string="%Y-%m-%d_%H-%M-%S", target_format=None,
+                  callback=None, remove_duplicates=False, file_filter=None, date_sources=None,
+                  group_related=True, report_path=None, workers=None, metrics=None,
+                  io_order="scan", timeout=None, utc=False, verify_copies=False):
+    """
+    Copy the image and video files of a folder, e.g. a memory card, to a
+    destination under their new names.
+    
+    Each file is read once: the data is hashed while it is copied, and the
+    hash goes to the report. Only with verify_copies is every copy read back
+    from the destination device and compared. Copies run in parallel, by
+    default as many as the slower of the two devices handles well (see
+    device_copy_workers). The source folder is left unchanged.
+    
+    Args:
+        source_path (str): Folder to copy from
+        destination_path (str): Folder to copy to; created if needed
+        target_format (str): Optional strftime template of a date tree under
+                             destination_path, e.g. "%Y/%m/%d"
+        verify_copies (bool): Read each copy back and compare its hash with the
+                              original's; mismatching copies are removed and reported
+        workers (dict): Worker threads per stage; "apply" is the number of parallel copies
+        Other arguments: See rename_images. Duplicates are not copied when
+                         remove_duplicates is set.
+    
+    Returns:
+        dict: Statistics about the operation; "renamed" counts the copied files
+    """
+    destination_path = os.path.abspath(destination_path)
+    workers = dict(workers or {})
+    if "apply" not in workers:
+        # The destination may not exist yet; its nearest existing parent is on the same device
+        existing = destination_path
+        while not os.path.exists(existing) and os.path.dirname(existing) != existing:
+            existing = os.path.dirname(existing)
+        workers["apply"] = min(device_copy_workers(source_path), device_copy_workers(existing))
     
-    return stats 
\ No newline at end of file
+    # The destination is part of the template, so its own % signs must not be taken as directives
+    template = os.path.join(destination_path.replace("%", "%%"), target_format or "")
+    results, pipeline, multiple_lanes = _run_folders(
+        [(source_path, None, None)], callback=callback, workers=workers,
+        date_sources=date_sources, io_order=io_order, report_path=report_path, timeout=timeout,
+        target_format=template, create_backup=False, format_string=format_string,
+        remove_duplicates=remove_duplicates, file_filter=file_filter, verify=False,
+        group_related=group_related, streaming=False, date_cache=None, metrics=metrics,
+        fadvise=False, utc=utc, copy_files=True, verify_copies=verify_copies
+    )
+    if results[0] is None:
+        return {"total": 0, "renamed": 0, "skipped": 0, "removed_duplicates": 0, "quarantined": 0,
+                "bytes_copied": 0, "error": True}
+    return _pipeline_stats(results[0], pipeline, multiple_lanes)
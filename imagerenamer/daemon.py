@@ -0,0 +1,305 @@
+"""
+Long-running renamer daemon with a local Unix domain socket job API.
+
+The daemon keeps metadata dates, folder name indexes and the worker processes
+of timed jobs warm between jobs, so repeated runs skip the interpreter and
+Pillow start-up as well as work that was already done. The pipeline threads
+are cheap to start and are set up per job. Jobs and replies are JSON objects,
+one per line:
+
+    request:  {"folder": "...", "options": {"format_string": "...", ...}}
+    replies:  {"type": "progress", "message": "..."}
+              {"type": "done", "stats": {...}}
+              {"type": "error", "message": "..."}
+"""
+
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+from collections import OrderedDict
+
+from imagerenamer.core import rename_images
+from imagerenamer.metadata import ProcessSandbox
+
+# Options a client may pass on to rename_images; the file filter is sent as a
+# list of extensions since functions cannot cross the socket
+JOB_OPTIONS = (
+    "create_backup", "format_string", "remove_duplicates", "date_sources", "verify",
+    "group_related", "streaming", "report_path", "workers",
+    "io_order", "fadvise", "network", "timeout", "utc", "target_format",
+    "dedup_backup", "backup_archive",
+)
+
+# Number of metadata dates remembered between jobs
+DEFAULT_CACHE_SIZE = 100000
+
+# Unix domain sockets are missing on Windows. The module still imports there,
+# so that the CLI and GUI load and daemon_available() can tell, but the daemon
+# neither starts nor takes jobs.
+UNIX_SOCKETS = hasattr(socket, "AF_UNIX") and hasattr(socketserver, "UnixStreamServer")
+_ServerBase = socketserver.UnixStreamServer if UNIX_SOCKETS else socketserver.BaseServer
+
+def default_socket_path():
+    """Return the default socket path for the current user."""
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(runtime_dir, f"imagerenamer-{os.getuid()}.sock")
+
+def _require_unix_sockets():
+    """Raise OSError if this platform cannot run the daemon."""
+    if not UNIX_SOCKETS:
+        raise OSError("The daemon needs Unix domain sockets, which this platform lacks")
+
+def daemon_available(socket_path=None):
+    """Return True if this platform supports the daemon and its socket exists."""
+    if not UNIX_SOCKETS or not hasattr(os, "getuid"):
+        return False
+    return os.path.exists(socket_path or default_socket_path())
+
+class LRUCache:
+    """
+    Thread-safe mapping that forgets the least recently used entries.
+    
+    Args:
+        max_size (int): Maximum number of entries to keep
+    """
+    
+    def __init__(self, max_size=DEFAULT_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+            self._entries.move_to_end(key)
+            return self._entries[key]
+    
+    def __setitem__(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+    
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+class RenamerDaemon(socketserver.ThreadingMixIn, _ServerBase):
+    """
+    Unix socket server running rename jobs with state shared between jobs.
+    
+    Args:
+        socket_path (str): Path of the Unix domain socket to listen on
+        cache_size (int): Number of metadata dates to remember between jobs
+        metrics (Metrics): Optional imagerenamer.metrics.Metrics recording all jobs
+    
+    Raises:
+        OSError: If the platform has no Unix domain sockets or another daemon
+                 listens on the socket
+    """
+    
+    daemon_threads = True
+    
+    def __init__(self, socket_path, cache_size=DEFAULT_CACHE_SIZE, metrics=None):
+        _require_unix_sockets()
+        if os.path.exists(socket_path):
+            # Remove a socket left behind by a daemon that is no longer running
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                    probe.connect(socket_path)
+                raise OSError(f"A daemon is already listening on {socket_path}")
+            except ConnectionRefusedError:
+                os.remove(socket_path)
+        
+        self.socket_path = socket_path
+        self.date_cache = LRUCache(cache_size)
+        self.metrics = metrics
+        # Name index per folder, reused while the folder has not changed
+        self.name_indexes = {}
+        # Worker processes of jobs with a timeout, per timeout
+        self.sandboxes = {}
+        self.folder_locks = {}
+        self.lock = threading.Lock()
+        
+        # Only the current user may submit jobs
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, JobHandler)
+        finally:
+            os.umask(old_umask)
+    
+    def folder_lock(self, folder):
+        """Return the lock serializing jobs on one folder."""
+        with self.lock:
+            return self.folder_locks.setdefault(folder, threading.Lock())
+    
+    def sandbox(self, timeout):
+        """Return the running sandbox for jobs with the given timeout, starting it if needed."""
+        with self.lock:
+            if timeout not in self.sandboxes:
+                self.sandboxes[timeout] = ProcessSandbox(timeout)
+            return self.sandboxes[timeout]
+    
+    def run_job(self, folder, options, callback):
+        """Run one rename job with the daemon's warm caches."""
+        folder = os.path.abspath(folder)
+        extensions = options.pop("extensions", None)
+        if extensions:
+            extensions = tuple(extension.lower() for extension in extensions)
+            options["file_filter"] = lambda filename: filename.lower().endswith(extensions)
+        if options.get("date_sources"):
+            options["date_sources"] = tuple(options["date_sources"])
+        if options.get("timeout") is not None:
+            options["sandbox"] = self.sandbox(float(options["timeout"]))
+        
+        with self.folder_lock(folder):
+            # The folder's modification time changes whenever an entry is added,
+            # removed or renamed. The index is kept under the time read before
+            # the job: a file arriving while the job runs changes the time, as
+            # do the job's own renames, so the index is only reused while the
+            # folder has not changed at all since it was taken.
+            try:
+                modified = os.stat(folder).st_mtime_ns
+                cached = self.name_indexes.get(folder)
+                if cached and cached[0] == modified:
+                    name_index = cached[1]
+                else:
+                    name_index = set(os.listdir(folder))
+            except OSError:
+                # Missing folders are reported by rename_images itself
+                name_index = None
+            
+            stats = rename_images(folder, callback=callback, name_index=name_index,
+                                  date_cache=self.date_cache, metrics=self.metrics, **options)
+            
+            if name_index is not None and not stats.get("error"):
+                self.name_indexes[folder] = (modified, name_index)
+        return stats
+    
+    def server_close(self):
+        super().server_close()
+        with self.lock:
+            sandboxes, self.sandboxes = list(self.sandboxes.values()), {}
+        for sandbox in sandboxes:
+            sandbox.close()
+        try:
+            os.remove(self.socket_path)
+        except OSError:
+            pass
+
+class JobHandler(socketserver.StreamRequestHandler):
+    """Read one job from the client and stream progress back."""
+    
+    def setup(self):
+        super().setup()
+        # Progress arrives from several pipeline threads at once
+        self.send_lock = threading.Lock()
+    
+    def send(self, reply):
+        with self.send_lock:
+            self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+            self.wfile.flush()
+    
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            job = json.loads(line.decode("utf-8"))
+            folder = job["folder"]
+            options = {key: value for key, value in job.get("options", {}).items()
+                       if key in JOB_OPTIONS or key == "extensions"}
+        except (ValueError, KeyError, TypeError, AttributeError) as e:
+            self.send({"type": "error", "message": f"Invalid job: {e}"})
+            return
+        
+        try:
+            stats = self.server.run_job(
+                folder, options,
+                lambda message: self.send({"type": "progress", "message": message})
+            )
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away; nothing left to report to
+            return
+        except Exception as e:
+            self.send({"type": "error", "message": f"{type(e).__name__}: {e}"})
+            return
+        self.send({"type": "done", "stats": stats})
+
+def serve(socket_path=None, callback=None, cache_size=DEFAULT_CACHE_SIZE, metrics=None):
+    """
+    Run the daemon until interrupted.
+    
+    Args:
+        socket_path (str): Path of the Unix domain socket (default: per-user path)
+        callback (function): Optional callback function for status messages
+        cache_size (int): Number of metadata dates to remember between jobs
+        metrics (Metrics): Optional imagerenamer.metrics.Metrics recording all jobs
+    
+    Raises:
+        OSError: If the daemon cannot listen on the socket
+    """
+    _require_unix_sockets()
+    socket_path = socket_path or default_socket_path()
+    server = RenamerDaemon(socket_path, cache_size, metrics)
+    message = f"Image Renamer daemon listening on {socket_path}"
+    if callback:
+        callback(message)
+    else:
+        print(message)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def submit_job(folder, socket_path=None, callback=None, extensions=None, **options):
+    """
+    Run a rename job on a running daemon and wait for it to finish.
+    
+    Args:
+        folder (str): Path to the folder containing images and videos
+        socket_path (str): Path of the daemon's socket (default: per-user path)
+        callback (function): Optional callback function for progress updates
+        extensions (tuple): File extensions to process (default: the daemon's defaults)
+        **options: Keyword arguments for rename_images, see JOB_OPTIONS
+    
+    Returns:
+        dict: Statistics about the operation
+    
+    Raises:
+        OSError: If no daemon is listening on the socket or the platform has no
+                 Unix domain sockets
+        RuntimeError: If the daemon reports an error for the job
+    """
+    _require_unix_sockets()
+    unknown = [key for key in options if key not in JOB_OPTIONS]
+    if unknown:
+        raise ValueError(f"Options not supported by the daemon: {', '.join(unknown)}")
+    if extensions:
+        options["extensions"] = list(extensions)
+    
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.connect(socket_path or default_socket_path())
+        job = {"folder": os.path.abspath(folder), "options": options}
+        connection.sendall((json.dumps(job) + "\n").encode("utf-8"))
+        
+        with connection.makefile("r", encoding="utf-8") as replies:
+            for line in replies:
+                reply = json.loads(line)
+                if reply["type"] == "progress":
+                    if callback:
+                        callback(reply["message"])
+                    else:
+                        print(reply["message"])
+                elif reply["type"] == "done":
+                    return reply["stats"]
+                else:
+                    raise RuntimeError(reply["message"])
+    raise ConnectionError("The daemon closed the connection before the job finished")
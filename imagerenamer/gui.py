@@ -14,12 +14,12 @@ from PyQt6.QtWidgets import (
 from PyQt6.QtCore import Qt, QThread, pyqtSignal, QSettings
 from PyQt6.QtGui import QIcon, QFont, QPixmap, QColor, QPalette
 
-from imagerenamer.core import rename_images
+from imagerenamer.core import rename_images, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS
+from imagerenamer.daemon import daemon_available, submit_job
 from imagerenamer import __version__
 
-# Define file extension constants
-image_extensions = (".jpg", ".jpeg", ".png", ".nef", ".cr2", ".arw")
-video_extensions = (".mp4", ".mov", ".avi", ".mkv", ".wmv", ".m4v", ".3gp", ".webm", ".flv")
+# Maximum number of lines kept in the log view; older lines are dropped
+MAX_LOG_LINES = 10000
 
 # Find the application resource path
 def resource_path(relative_path):
@@ -37,15 +37,17 @@ class RenamerWorker(QThread):
     progress_update = pyqtSignal(str)
     completed = pyqtSignal(dict)
     
-    def __init__(self, folder_path, create_backup, format_string, remove_duplicates=False):
+    def __init__(self, folder_path, create_backup, format_string, remove_duplicates=False,
+                 date_sources=None):
         super().__init__()
         self.folder_path = folder_path
         self.create_backup = create_backup
         self.format_string = format_string
         self.remove_duplicates = remove_duplicates
+        self.date_sources = date_sources
         
         # Default to both image and video extensions
-        self.media_extensions = image_extensions + video_extensions
+        self.media_extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
         
     def run(self):
         """Run the renaming process in a separate thread."""
@@ -58,15 +60,37 @@ class RenamerWorker(QThread):
         def file_filter(filename):
             return filename.lower().endswith(self.media_extensions)
         
+        # Hand the job to a running daemon, which has its caches warm already
+        stats = None
+        if daemon_available():
+            try:
+                stats = submit_job(
+                    self.folder_path,
+                    callback=update_callback,
+                    extensions=self.media_extensions,
+                    create_backup=self.create_backup,
+                    format_string=self.format_string,
+                    remove_duplicates=self.remove_duplicates,
+                    date_sources=self.date_sources
+                )
+            except OSError:
+                # Daemon not reachable, rename in this process instead
+                stats = None
+            except RuntimeError as e:
+                update_callback(f"Error: {e}")
+                stats = {"total": 0, "renamed": 0, "skipped": 0, "removed_duplicates": 0, "error": True}
+        
         # Run the renaming process
-        stats = rename_images(
-            self.folder_path,
-            self.create_backup,
-            self.format_string,
-            update_callback,
-            self.remove_duplicates,
-            file_filter
-        )
+        if stats is None:
+            stats = rename_images(
+                self.folder_path,
+                self.create_backup,
+                self.format_string,
+                update_callback,
+                self.remove_duplicates,
+                file_filter,
+                self.date_sources
+            )
         
         # Emit completion signal with statistics
         self.completed.emit(stats)
@@ -274,6 +298,17 @@ class ImageRenamerApp(QMainWindow):
         self.custom_format = QLineEdit()
         self.custom_format.setPlaceholderText("Custom format (e.g. %Y_%m_%d)")
         
+        # Date source selection, cheapest source first
+        self.date_source_dropdown = QComboBox()
+        date_source_options = [
+            (("metadata", "stat"), "Metadata, then file time (Default)"),
+            (("filename", "metadata", "stat"), "Filename, then metadata, then file time"),
+            (("filename", "stat"), "Filename, then file time (no metadata reads)"),
+        ]
+        
+        for date_sources, description in date_source_options:
+            self.date_source_dropdown.addItem(description, date_sources)
+        
         # Backup checkbox
         self.backup_checkbox = QCheckBox("Create backups of original files")
         self.backup_checkbox.setChecked(True)
@@ -288,6 +323,7 @@ class ImageRenamerApp(QMainWindow):
         
         options_layout.addRow("Format:", self.format_dropdown)
         options_layout.addRow("Custom format:", self.custom_format)
+        options_layout.addRow("Date source:", self.date_source_dropdown)
         options_layout.addRow(self.backup_checkbox)
         options_layout.addRow(self.remove_duplicates_checkbox)
         options_layout.addRow(self.include_videos_checkbox)
@@ -306,6 +342,7 @@ class ImageRenamerApp(QMainWindow):
         # Log output
         self.log_output = QTextEdit()
         self.log_output.setReadOnly(True)
+        self.log_output.document().setMaximumBlockCount(MAX_LOG_LINES)
         self.log_output.setMinimumHeight(200)
         
         progress_layout.addWidget(self.progress_bar)
@@ -358,9 +395,9 @@ class ImageRenamerApp(QMainWindow):
         """Count the number of image and video files in a directory."""
         # Only include video extensions if the checkbox is checked
         if hasattr(self, 'include_videos_checkbox') and self.include_videos_checkbox.isChecked():
-            media_extensions = image_extensions + video_extensions
+            media_extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
         else:
-            media_extensions = image_extensions
+            media_extensions = IMAGE_EXTENSIONS
             
         count = 0
         
@@ -388,6 +425,7 @@ class ImageRenamerApp(QMainWindow):
         create_backup = self.backup_checkbox.isChecked()
         remove_duplicates = self.remove_duplicates_checkbox.isChecked()
         include_videos = self.include_videos_checkbox.isChecked()
+        date_sources = self.date_source_dropdown.currentData()
         
         # Clear log and show progress bar
         self.log_output.clear()
@@ -398,13 +436,14 @@ class ImageRenamerApp(QMainWindow):
         self.toggle_inputs(False)
         
         # Create and start worker thread
-        self.worker = RenamerWorker(directory, create_backup, format_string, remove_duplicates)
+        self.worker = RenamerWorker(directory, create_backup, format_string, remove_duplicates,
+                                    date_sources)
         
         # Set the file extensions to use
         if include_videos:
-            self.worker.media_extensions = image_extensions + video_extensions
+            self.worker.media_extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
         else:
-            self.worker.media_extensions = image_extensions
+            self.worker.media_extensions = IMAGE_EXTENSIONS
             
         self.worker.progress_update.connect(self.update_log)
         self.worker.completed.connect(self.process_completed)
@@ -464,6 +503,7 @@ class ImageRenamerApp(QMainWindow):
         self.dir_input.setEnabled(enabled)
         self.format_dropdown.setEnabled(enabled)
         self.custom_format.setEnabled(enabled)
+        self.date_source_dropdown.setEnabled(enabled)
         self.backup_checkbox.setEnabled(enabled)
         self.remove_duplicates_checkbox.setEnabled(enabled)
         self.include_videos_checkbox.setEnabled(enabled)
@@ -475,6 +515,7 @@ class ImageRenamerApp(QMainWindow):
         self.settings.setValue("directory", self.dir_input.text())
         self.settings.setValue("format_index", self.format_dropdown.currentIndex())
         self.settings.setValue("custom_format", self.custom_format.text())
+        self.settings.setValue("date_source_index", self.date_source_dropdown.currentIndex())
         self.settings.setValue("create_backup", self.backup_checkbox.isChecked())
         self.settings.setValue("remove_duplicates", self.remove_duplicates_checkbox.isChecked())
         self.settings.setValue("include_videos", self.include_videos_checkbox.isChecked())
@@ -484,6 +525,7 @@ class ImageRenamerApp(QMainWindow):
         directory = self.settings.value("directory", "")
         format_index = int(self.settings.value("format_index", 0))
         custom_format = self.settings.value("custom_format", "")
+        date_source_index = int(self.settings.value("date_source_index", 0))
         create_backup = self.settings.value("create_backup", True, type=bool)
         remove_duplicates = self.settings.value("remove_duplicates", False, type=bool)
         include_videos = self.settings.value("include_videos", True, type=bool)
@@ -491,6 +533,7 @@ class ImageRenamerApp(QMainWindow):
         self.dir_input.setText(directory)
         self.format_dropdown.setCurrentIndex(format_index)
         self.custom_format.setText(custom_format)
+        self.date_source_dropdown.setCurrentIndex(date_source_index)
         self.backup_checkbox.setChecked(create_backup)
         self.remove_duplicates_checkbox.setChecked(remove_duplicates)
         self.include_videos_checkbox.setChecked(include_videos)
@@ -0,0 +1,1038 @@
+"""
+Header-only reads of media files, with page cache hints.
+
+Creation dates live in the first kilobytes of a file. Metadata parsers read
+through a HeaderFile, which fetches a fixed header range in one read and
+serves the parser from memory; anything beyond it is read on demand. With
+posix_fadvise, headers can be prefetched in batches and dropped from the page
+cache afterwards, so a library-scale scan does not evict other workloads'
+cached data.
+
+Corrupt or hostile files must not stall a batch: every read is capped at
+MAX_READ_BYTES, the EXIF walker gives up after MAX_IFD_ENTRIES entries, and
+parsers without such bounds can run in a ProcessSandbox that kills them at a
+deadline.
+
+Descriptors are opened through HANDLES, a pool capping how many are held at
+once, so even hundreds of parallel readers stay below RLIMIT_NOFILE.
+"""
+
+import contextlib
+import email.utils
+import hashlib
+import multiprocessing
+import os
+import re
+import struct
+import threading
+import zlib
+from datetime import datetime, timedelta, timezone
+from xml.parsers import expat
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; the handle pool then uses a fixed size
+    resource = None
+
+# Bytes read up front from each file; enough for the EXIF block of JPEG and
+# TIFF-based raw files
+HEADER_SIZE = 64 * 1024
+
+# Number of file headers prefetched together
+PREFETCH_BATCH = 64
+
+# Most bytes read from one file to find its metadata
+MAX_READ_BYTES = 8 * 1024 * 1024
+
+# Most IFD entries (and JPEG segments) walked in one file; cameras write a
+# few hundred at most
+MAX_IFD_ENTRIES = 4096
+
+# TIFF tags leading to the capture date, with its fraction of a second and
+# its offset from UTC
+EXIF_IFD_POINTER = 0x8769
+DATE_TIME_ORIGINAL = 0x9003
+SUB_SEC_TIME_ORIGINAL = 0x9291
+OFFSET_TIME_ORIGINAL = 0x9011
+TIFF_ASCII = 2
+
+# Text fields of the first IFD passed on the way to the date, by tag
+IFD0_TEXT_TAGS = {0x010F: "Make", 0x0110: "Model"}
+
+# UTC offset as written in EXIF and ISO 8601, e.g. "+01:00", "-0530" or "Z"
+UTC_OFFSET_PATTERN = re.compile(r"(?:Z|([+-])(\d{2}):?(\d{2}))")
+
+# ISO-BMFF brands of HEIF images (HEIC, AVIF and the generic image brands)
+HEIF_BRANDS = (b"heic", b"heix", b"heim", b"heis", b"hevc", b"hevx", b"mif1", b"msf1",
+               b"avif", b"avis")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+# Chunks after which a PNG holds no more metadata worth reading
+PNG_DATA_CHUNKS = (b"IDAT", b"IEND")
+
+# Formats whose walk by read_exif_date is final: when it finds no date,
+# Pillow would only find none either, after decoding the whole image
+FINAL_EXIF_FORMATS = ("heif", "png")
+
+# Text chunk keywords holding a creation date or an XMP packet
+PNG_CREATION_TIME = b"Creation Time"
+PNG_XMP_KEYWORD = b"XML:com.adobe.xmp"
+
+# XMP properties holding the capture date, most authoritative first, as
+# namespace URI and name separated by a space
+XMP_DATE_PROPERTIES = (
+    "http://ns.adobe.com/exif/1.0/ DateTimeOriginal",
+    "http://ns.adobe.com/photoshop/1.0/ DateCreated",
+    "http://ns.adobe.com/xap/1.0/ CreateDate",
+)
+
+# Most bytes of a file scanned for an embedded XMP packet
+XMP_SCAN_BYTES = 1024 * 1024
+
+# Start of an XMP packet, and of the JPEG APP1 segment carrying one
+XMP_PACKET_START = re.compile(rb"<(?:x:xmpmeta|x:xapmeta|rdf:RDF)\b")
+XMP_APP1_PREFIX = b"http://ns.adobe.com/xap/1.0/\0"
+
+# Descriptors left to everything but file reads: the report file, sockets,
+# pipes to worker processes and directory listings
+RESERVED_HANDLES = 32
+
+# Handle pool size when the descriptor limit is unknown or unlimited
+DEFAULT_HANDLE_LIMIT = 1024
+
+# Hash of whole files (backup objects, ingest copies, catalogs), and the size
+# of each read while hashing
+HASH_ALGORITHM = "sha256"
+HASH_CHUNK_SIZE = 1024 * 1024
+
+def default_handle_limit():
+    """Return a handle pool size that fits the process's RLIMIT_NOFILE."""
+    if resource is None:
+        return DEFAULT_HANDLE_LIMIT
+    soft, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft == resource.RLIM_INFINITY:
+        return DEFAULT_HANDLE_LIMIT
+    return max(1, min(soft // 2, soft - RESERVED_HANDLES))
+
+class HandlePool:
+    """
+    Counting semaphore capping the file descriptors held open at once.
+    
+    Every file opened to read metadata or back up a file takes its handles
+    from the pool and gives them back when closed; readers beyond the cap
+    wait instead of failing with EMFILE.
+    
+    Args:
+        size (int): Most handles held at once (default: derived from RLIMIT_NOFILE)
+    """
+    
+    def __init__(self, size=None):
+        self.size = size or default_handle_limit()
+        self.in_use = 0
+        self.peak = 0
+        self._available = threading.Condition()
+    
+    def resize(self, size=None):
+        """Change the cap, e.g. after RLIMIT_NOFILE was changed; None derives it again."""
+        with self._available:
+            self.size = size or default_handle_limit()
+            self.peak = self.in_use
+            self._available.notify_all()
+    
+    def acquire(self, count=1):
+        """Wait until count handles are free and take them."""
+        with self._available:
+            # A request larger than the pool only waits for the pool to drain
+            while self.in_use and self.in_use + count > self.size:
+                self._available.wait()
+            self.in_use += count
+            self.peak = max(self.peak, self.in_use)
+    
+    def release(self, count=1):
+        """Give count handles back."""
+        with self._available:
+            self.in_use -= count
+            self._available.notify_all()
+    
+    @contextlib.contextmanager
+    def held(self, count=1):
+        """Context manager holding count handles, e.g. around a file copy."""
+        self.acquire(count)
+        try:
+            yield
+        finally:
+            self.release(count)
+
+# Handle pool shared by all metadata reads of the process
+HANDLES = HandlePool()
+
+def _utc_offset(text):
+    """Return the timezone for a UTC offset text, or None if there is none."""
+    match = UTC_OFFSET_PATTERN.fullmatch((text or "").strip())
+    if not match:
+        return None
+    if not match.group(1):
+        return timezone.utc
+    offset = timedelta(hours=int(match.group(2)), minutes=int(match.group(3)))
+    return timezone(-offset if match.group(1) == "-" else offset)
+
+def exif_datetime(text, subsec=None, offset=None):
+    """
+    Combine the EXIF date, sub-second and offset fields of a capture.
+    
+    Args:
+        text (str): DateTimeOriginal, e.g. "2021:03:04 05:06:07"
+        subsec (str): Optional SubSecTimeOriginal, the digits of the fraction
+                      of a second, e.g. "25" for 0.25 seconds
+        offset (str): Optional OffsetTimeOriginal, e.g. "+01:00"
+    
+    Returns:
+        datetime: The capture time, aware if the offset is known
+    
+    Raises:
+        ValueError: If text is not an EXIF date
+    """
+    date = datetime.strptime(text.strip(), "%Y:%m:%d %H:%M:%S")
+    digits = (subsec or "").strip()
+    if digits.isdigit():
+        date = date.replace(microsecond=int(digits[:6].ljust(6, "0")))
+    return date.replace(tzinfo=_utc_offset(offset))
+
+class MetadataLimitError(Exception):
+    """A file exceeded a limit set on reading its metadata."""
+
+class MetadataTimeout(MetadataLimitError):
+    """Reading the metadata of a file took longer than its deadline."""
+
+def advise(fd, offset, length, advice_name):
+    """
+    Give the kernel a page cache hint, where the platform supports it.
+    
+    Args:
+        fd (int): Descriptor of the file
+        offset (int): Start of the range
+        length (int): Length of the range; 0 means up to the end of the file
+        advice_name (str): Name of the os.POSIX_FADV_* constant, e.g. "POSIX_FADV_DONTNEED"
+    """
+    advice = getattr(os, advice_name, None)
+    if advice is None or not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        os.posix_fadvise(fd, offset, length, advice)
+    except OSError:
+        # Hints are best effort, e.g. not supported on pipes or some file systems
+        pass
+
+def hash_file(path, algorithm=HASH_ALGORITHM, from_device=False):
+    """
+    Return the hex digest of a file's data.
+    
+    Args:
+        path (str): Path of the file
+        algorithm (str): hashlib name of the hash
+        from_device (bool): Flush the file and drop it from the page cache first, so
+                            the data is read back from the device rather than from
+                            memory, e.g. to verify a copy
+    
+    Returns:
+        str: Hex digest of the file's data
+    """
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(HASH_CHUNK_SIZE)
+    view = memoryview(buffer)
+    with HANDLES.held(), open(path, "rb", buffering=0) as f:
+        if from_device:
+            os.fsync(f.fileno())
+            advise(f.fileno(), 0, 0, "POSIX_FADV_DONTNEED")
+        while True:
+            count = f.readinto(buffer)
+            if not count:
+                break
+            digest.update(view[:count])
+    return digest.hexdigest()
+
+def prefetch_headers(paths, header_size=HEADER_SIZE):
+    """
+    Ask the kernel to start reading the headers of several files in the background.
+    
+    The reads are queued with POSIX_FADV_WILLNEED, which lets the disk serve
+    them in one sweep while earlier files are still being parsed.
+    
+    Each file is opened just for the advice and closed again. The advice fills
+    the file's page cache, not the descriptor's, so the later read through
+    its own open finds the data all the same, and that open is answered from
+    the inode cache warmed by the folder scan. Keeping the descriptors open
+    until the reads instead would hold a batch of them out of HANDLES, and
+    every file skipped on the way would have to give its descriptor back.
+    
+    Args:
+        paths (iterable): Paths of the files about to be read
+        header_size (int): Bytes to prefetch from the start of each file
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in paths:
+        with HANDLES.held():
+            try:
+                fd = os.open(path, os.O_RDONLY)
+            except OSError:
+                continue
+            try:
+                advise(fd, 0, header_size, "POSIX_FADV_WILLNEED")
+            finally:
+                os.close(fd)
+
+def read_header(path, header_size=HEADER_SIZE, drop_cache=False):
+    """
+    Read the header of a file together with its status, using a single open.
+    
+    On network file systems opening a file already fetches its attributes, so
+    the fstat costs no extra round trip.
+    
+    Args:
+        path (str): Path to the file
+        header_size (int): Bytes to read from the start of the file
+        drop_cache (bool): Whether to drop the bytes read from the page cache
+    
+    Returns:
+        tuple: (header bytes, os.stat_result)
+    """
+    with HeaderFile(path, header_size, drop_cache) as reader:
+        return reader.header, os.fstat(reader.fileno())
+
+class HeaderFile:
+    """
+    Read-only file object that serves the start of a file from memory.
+    
+    With drop_cache, kernel readahead is turned off for the file as well, so
+    only the ranges actually read are fetched from disk and later dropped.
+    The descriptor is taken from HANDLES and given back on close. Use as a
+    context manager.
+    
+    Args:
+        path (str): Path to the file
+        header_size (int): Bytes to read up front
+        drop_cache (bool): Whether to drop the ranges read from the page cache
+                           when the file is closed
+        header (bytes): Header read earlier, e.g. by read_header; the file is
+                        then only opened if a read goes past it
+        max_bytes (int): Most bytes to read from the file; reading more raises
+                         MetadataLimitError
+    """
+    
+    def __init__(self, path, header_size=HEADER_SIZE, drop_cache=False, header=None,
+                 max_bytes=MAX_READ_BYTES):
+        self.name = path
+        self.drop_cache = drop_cache
+        self.max_bytes = max_bytes
+        self.bytes_read = 0
+        self.position = 0
+        self._file = None
+        self._size = None
+        self._ranges = []
+        if header is None:
+            self._open()
+            header = self._read_at(0, header_size)
+        self.header = header
+        # A short header holds the whole file
+        self.complete = len(header) < header_size
+        if self.complete:
+            self._size = len(header)
+    
+    def _open(self):
+        if self._file is None:
+            HANDLES.acquire()
+            try:
+                self._file = open(self.name, "rb", buffering=0)
+            except BaseException:
+                HANDLES.release()
+                raise
+            if self.drop_cache:
+                advise(self._file.fileno(), 0, 0, "POSIX_FADV_RANDOM")
+        return self._file
+    
+    def _read_at(self, offset, size):
+        if self.bytes_read + size > self.max_bytes:
+            raise MetadataLimitError(f"Reading more than {self.max_bytes} bytes of metadata")
+        file = self._open()
+        file.seek(offset)
+        chunks = []
+        remaining = size
+        while remaining > 0:
+            chunk = file.read(remaining)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            remaining -= len(chunk)
+        data = b"".join(chunks)
+        if data:
+            self.bytes_read += len(data)
+            self._ranges.append((offset, len(data)))
+        return data
+    
+    def fileno(self):
+        return self._open().fileno()
+    
+    def size(self):
+        """Return the size of the file in bytes."""
+        if self._size is None:
+            self._size = os.fstat(self.fileno()).st_size
+        return self._size
+    
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = max(self.size() - self.position, 0)
+        start = self.position
+        end = start + size
+        data = self.header[start:end]
+        if end > len(self.header) and not self.complete:
+            # Past the header: fetch the rest from the file
+            offset = max(start, len(self.header))
+            data += self._read_at(offset, end - offset)
+        self.position = start + len(data)
+        return data
+    
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self.position
+        elif whence == os.SEEK_END:
+            offset += self.size()
+        if offset < 0:
+            raise ValueError(f"Negative seek position {offset}")
+        self.position = offset
+        return self.position
+    
+    def tell(self):
+        return self.position
+    
+    def readable(self):
+        return True
+    
+    def seekable(self):
+        return True
+    
+    def close(self):
+        if self._file is None or self._file.closed:
+            return
+        try:
+            if self.drop_cache:
+                for offset, length in self._ranges:
+                    advise(self._file.fileno(), offset, length, "POSIX_FADV_DONTNEED")
+            self._file.close()
+        finally:
+            HANDLES.release()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def _tiff_date(read_at, max_entries, tags=None):
+    """
+    Find DateTimeOriginal in a TIFF structure, reading through read_at(offset, size).
+    
+    The IFD0_TEXT_TAGS found on the way are stored in tags, if given.
+    """
+    byte_order = {b"II": "<", b"MM": ">"}.get(read_at(0, 2))
+    if byte_order is None:
+        return None
+    magic, offset = struct.unpack(byte_order + "HI", read_at(2, 6))
+    if magic != 42:
+        return None
+    
+    walked = 0
+    
+    def entries(offset):
+        nonlocal walked
+        count, = struct.unpack(byte_order + "H", read_at(offset, 2))
+        walked += count
+        if walked > max_entries:
+            raise MetadataLimitError(f"More than {max_entries} IFD entries")
+        data = read_at(offset + 2, count * 12)
+        for index in range(len(data) // 12):
+            yield struct.unpack_from(byte_order + "HHI4s", data, index * 12)
+    
+    def text(count, value):
+        if count > 4:
+            value = read_at(struct.unpack(byte_order + "I", value)[0], count)
+        return value[:count].split(b"\0")[0].decode("ascii", "replace")
+    
+    exif_offset = None
+    for tag, value_type, count, value in entries(offset):
+        if tag == EXIF_IFD_POINTER:
+            exif_offset, = struct.unpack(byte_order + "I", value)
+        elif tags is not None and tag in IFD0_TEXT_TAGS and value_type == TIFF_ASCII:
+            tags[IFD0_TEXT_TAGS[tag]] = text(count, value).strip()
+    if exif_offset is None:
+        return None
+    # The fraction and offset sit next to the date, so they cost no extra read
+    fields = {}
+    for tag, value_type, count, value in entries(exif_offset):
+        if tag in (DATE_TIME_ORIGINAL, SUB_SEC_TIME_ORIGINAL, OFFSET_TIME_ORIGINAL) \
+                and value_type == TIFF_ASCII:
+            fields[tag] = text(count, value)
+    if DATE_TIME_ORIGINAL not in fields:
+        return None
+    return exif_datetime(fields[DATE_TIME_ORIGINAL], fields.get(SUB_SEC_TIME_ORIGINAL),
+                         fields.get(OFFSET_TIME_ORIGINAL))
+
+def _jpeg_segment(reader, max_entries, prefix):
+    """Return the payload of the first JPEG APP1 segment starting with prefix, or None."""
+    reader.seek(2)
+    for _ in range(max_entries):
+        segment = reader.read(4)
+        if len(segment) < 4 or segment[0] != 0xFF:
+            return None
+        marker = segment[1]
+        length, = struct.unpack(">H", segment[2:])
+        if marker in (0xD9, 0xDA):
+            # End of image or start of the compressed data: no metadata follows
+            return None
+        if marker == 0xE1:
+            data = reader.read(length - 2)
+            if data.startswith(prefix):
+                return data[len(prefix):]
+        else:
+            reader.seek(length - 2, os.SEEK_CUR)
+    raise MetadataLimitError(f"More than {max_entries} JPEG segments before the image data")
+
+def _jpeg_exif(reader, max_entries):
+    """Return the TIFF structure of a JPEG's Exif segment, or None if it has none."""
+    return _jpeg_segment(reader, max_entries, b"Exif\0\0")
+
+def _uint(data, position, size):
+    """Read a big-endian unsigned integer of 0, 2, 4 or 8 bytes; returns (value, next position)."""
+    if size == 0:
+        return 0, position
+    if position + size > len(data):
+        raise ValueError("Truncated box")
+    return int.from_bytes(data[position:position + size], "big"), position + size
+
+def _heif_exif(reader, max_entries):
+    """
+    Return the TIFF structure of a HEIF image's Exif item, or None if it has none.
+    
+    The item is found through the meta box: iinf gives its ID, iloc the byte
+    ranges holding it. Only those ranges are read, never the image data.
+    """
+    walked = 0
+    
+    def boxes(start, end):
+        """Yield (type, payload offset, end offset) of the boxes between start and end."""
+        nonlocal walked
+        offset = start
+        while offset + 8 <= end:
+            walked += 1
+            if walked > max_entries:
+                raise MetadataLimitError(f"More than {max_entries} boxes")
+            reader.seek(offset)
+            header = reader.read(16)
+            if len(header) < 8:
+                return
+            size, box_type = struct.unpack(">I4s", header[:8])
+            payload = offset + 8
+            if size == 1:
+                size, _ = _uint(header, 8, 8)
+                payload += 8
+            elif size == 0:
+                # The last box runs to the end of its parent
+                size = end - offset
+            if offset + size < payload:
+                raise ValueError(f"Invalid size of box {box_type!r}")
+            yield box_type, payload, offset + size
+            offset += size
+    
+    def read_payload(start, end):
+        reader.seek(start)
+        data = reader.read(end - start)
+        if len(data) < end - start:
+            raise ValueError("Truncated box")
+        return data
+    
+    meta = next(((start, end) for box_type, start, end in boxes(0, reader.size())
+                 if box_type == b"meta"), None)
+    if meta is None:
+        return None
+    # meta is a full box: version and flags come first
+    children = {box_type: (start, end) for box_type, start, end in boxes(meta[0] + 4, meta[1])}
+    if b"iinf" not in children or b"iloc" not in children:
+        return None
+    
+    # Find the ID of the Exif item in the item information
+    start, end = children[b"iinf"]
+    version = read_payload(start, start + 1)[0]
+    first = start + 4 + (2 if version == 0 else 4)
+    exif_id = None
+    for box_type, entry_start, entry_end in boxes(first, end):
+        if box_type != b"infe":
+            continue
+        entry = read_payload(entry_start, min(entry_end, entry_start + 16))
+        if entry[0] < 2:
+            # Item types only exist from version 2 on
+            continue
+        item_id, position = _uint(entry, 4, 2 if entry[0] == 2 else 4)
+        item_type = entry[position + 2:position + 6]
+        if item_type == b"Exif":
+            exif_id = item_id
+            break
+    if exif_id is None:
+        return None
+    
+    # Find the byte ranges of the item in the item locations
+    data = read_payload(*children[b"iloc"])
+    version = data[0]
+    offset_size, length_size = data[4] >> 4, data[4] & 0x0F
+    base_offset_size, index_size = data[5] >> 4, (data[5] & 0x0F if version in (1, 2) else 0)
+    item_count, position = _uint(data, 6, 2 if version < 2 else 4)
+    for _ in range(item_count):
+        walked += 1
+        if walked > max_entries:
+            raise MetadataLimitError(f"More than {max_entries} item locations")
+        item_id, position = _uint(data, position, 2 if version < 2 else 4)
+        construction_method = 0
+        if version in (1, 2):
+            construction_method, position = _uint(data, position, 2)
+            construction_method &= 0x0F
+        _, position = _uint(data, position, 2)
+        base_offset, position = _uint(data, position, base_offset_size)
+        extent_count, position = _uint(data, position, 2)
+        extents = []
+        for _ in range(extent_count):
+            _, position = _uint(data, position, index_size)
+            extent_offset, position = _uint(data, position, offset_size)
+            extent_length, position = _uint(data, position, length_size)
+            extents.append((base_offset + extent_offset, extent_length))
+        if item_id == exif_id:
+            break
+    else:
+        return None
+    
+    if construction_method == 1:
+        # Offsets into the item data box of meta
+        if b"idat" not in children:
+            return None
+        extents = [(children[b"idat"][0] + offset, length) for offset, length in extents]
+    elif construction_method != 0:
+        return None
+    if not extents or any(length == 0 for _, length in extents):
+        return None
+    exif = b"".join(read_payload(offset, offset + length) for offset, length in extents)
+    
+    # The item starts with the offset of the TIFF header, past an optional "Exif\0\0"
+    tiff_offset, _ = _uint(exif, 0, 4)
+    return exif[4 + tiff_offset:]
+
+def parse_date_text(text):
+    """
+    Parse a date written as text, as found in PNG text chunks and XMP.
+    
+    ISO 8601 and EXIF style dates keep their wall clock time, like EXIF
+    DateTimeOriginal, with fractions of a second and the offset if given.
+    RFC 2822 dates, which tools write from a UTC clock, are converted to
+    local time.
+    
+    Args:
+        text (str): Date text, e.g. "2021-03-04T05:06:07.25+01:00"
+    
+    Returns:
+        datetime: Date, aware if it has an offset, or None if the text is not a date
+    """
+    text = text.strip()
+    match = re.match(r"(\d{4})[-:](\d{2})[-:](\d{2})"
+                     r"(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d+))?)?(\S*))?", text)
+    if match:
+        fraction, offset = match.group(7), match.group(8)
+        try:
+            date = datetime(*(int(part or 0) for part in match.groups()[:6]))
+        except ValueError:
+            return None
+        if fraction:
+            date = date.replace(microsecond=int(fraction[:6].ljust(6, "0")))
+        return date.replace(tzinfo=_utc_offset(offset))
+    try:
+        date = email.utils.parsedate_to_datetime(text)
+    except (TypeError, ValueError, IndexError):
+        return None
+    if date is None:
+        return None
+    if date.tzinfo is not None:
+        date = date.astimezone().replace(tzinfo=None)
+    return date
+
+class _XmpDone(Exception):
+    """Raised from the parser callbacks to stop parsing."""
+
+class XmpDateParser:
+    """
+    Streaming XMP parser that keeps nothing but the capture date properties.
+    
+    Feed the packet in pieces of any size; parsing stops as soon as the most
+    authoritative property was seen, or at the first XML error, keeping what
+    was found until then. No document tree is built.
+    """
+    
+    def __init__(self):
+        self.dates = {}
+        self.done = False
+        self._property = None
+        self._text = []
+        self._parser = expat.ParserCreate(namespace_separator=" ")
+        self._parser.StartElementHandler = self._start
+        self._parser.EndElementHandler = self._end
+        self._parser.CharacterDataHandler = self._characters
+        # XMP never declares entities; refusing them rules out expansion bombs
+        self._parser.EntityDeclHandler = self._refuse
+    
+    @property
+    def date(self):
+        """The date of the most authoritative property found, or None."""
+        for name in XMP_DATE_PROPERTIES:
+            if name in self.dates:
+                return self.dates[name]
+        return None
+    
+    def _found(self, name, text):
+        date = parse_date_text(text)
+        if date and name not in self.dates:
+            self.dates[name] = date
+            if name == XMP_DATE_PROPERTIES[0]:
+                raise _XmpDone()
+    
+    def _start(self, name, attributes):
+        # A property is either an attribute or an element of its description
+        for key, value in attributes.items():
+            if key in XMP_DATE_PROPERTIES:
+                self._found(key, value)
+        if name in XMP_DATE_PROPERTIES:
+            self._property = name
+            self._text = []
+    
+    def _characters(self, data):
+        if self._property and len(self._text) < 64:
+            self._text.append(data)
+    
+    def _end(self, name):
+        if name == self._property:
+            self._property = None
+            self._found(name, "".join(self._text))
+    
+    def _refuse(self, *args):
+        raise _XmpDone()
+    
+    def feed(self, data, final=False):
+        """
+        Parse the next piece of the packet.
+        
+        Args:
+            data (bytes): Next bytes of the packet
+            final (bool): Whether this is the last piece
+        """
+        if self.done:
+            return
+        try:
+            self._parser.Parse(data, final)
+        except (_XmpDone, expat.ExpatError):
+            self.done = True
+        if final:
+            self.done = True
+
+def parse_xmp_date(packet):
+    """
+    Find the capture date in an XMP packet.
+    
+    Args:
+        packet (bytes): XMP packet
+    
+    Returns:
+        datetime: Date of the first of XMP_DATE_PROPERTIES present, or None
+    """
+    parser = XmpDateParser()
+    parser.feed(packet, final=True)
+    return parser.date
+
+def read_xmp_date(reader, max_bytes=XMP_SCAN_BYTES, chunk_size=HEADER_SIZE):
+    """
+    Find the capture date in the XMP packet of a file or XMP sidecar.
+    
+    JPEGs carry the packet in an APP1 segment. Anything else is scanned for
+    the start of a packet, reading at most max_bytes, and the packet is
+    parsed while it is being read.
+    
+    Args:
+        reader (HeaderFile): File to read
+        max_bytes (int): Most bytes to scan
+        chunk_size (int): Bytes read at a time
+    
+    Returns:
+        datetime: Capture date, or None if the file has no XMP date
+    
+    Raises:
+        MetadataLimitError: If the file exceeds the reader's byte limit
+    """
+    start = reader.read(2)
+    if start == b"\xff\xd8":
+        try:
+            packet = _jpeg_segment(reader, MAX_IFD_ENTRIES, XMP_APP1_PREFIX)
+        except (ValueError, struct.error):
+            return None
+        return parse_xmp_date(packet) if packet else None
+    
+    parser = XmpDateParser()
+    reader.seek(0)
+    # Keep the end of the previous chunk, in case the start marker straddles two
+    carry = b""
+    scanned = 0
+    found = False
+    while scanned < max_bytes and not parser.done:
+        chunk = reader.read(min(chunk_size, max_bytes - scanned))
+        if not chunk:
+            break
+        scanned += len(chunk)
+        if found:
+            parser.feed(chunk)
+            continue
+        data = carry + chunk
+        match = XMP_PACKET_START.search(data)
+        if match:
+            found = True
+            parser.feed(data[match.start():])
+        else:
+            carry = data[-16:]
+    return parser.date
+
+def _inflate(data, limit):
+    """Decompress zlib data, refusing output beyond limit bytes."""
+    decompressor = zlib.decompressobj()
+    text = decompressor.decompress(data, limit)
+    if decompressor.unconsumed_tail:
+        raise MetadataLimitError(f"Compressed text larger than {limit} bytes")
+    return text
+
+def _png_date(reader, max_entries):
+    """
+    Find the capture date of a PNG in its chunks before the image data.
+    
+    An eXIf DateTimeOriginal wins over a "Creation Time" text, which wins over
+    an XMP date; the tIME chunk (last modification, in UTC) comes last.
+    """
+    found = {}
+    reader.seek(len(PNG_SIGNATURE))
+    for _ in range(max_entries):
+        header = reader.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in PNG_DATA_CHUNKS:
+            break
+        if chunk_type not in (b"eXIf", b"tIME", b"tEXt", b"iTXt", b"zTXt"):
+            reader.seek(length + 4, os.SEEK_CUR)
+            continue
+        data = reader.read(length)
+        reader.seek(4, os.SEEK_CUR)
+        if len(data) < length:
+            raise ValueError(f"Truncated {chunk_type!r} chunk")
+        
+        if chunk_type == b"eXIf":
+            if data.startswith(b"Exif\0\0"):
+                data = data[6:]
+            found["exif"] = _tiff_date(lambda offset, size: data[offset:offset + size], max_entries)
+            if found["exif"]:
+                break
+        elif chunk_type == b"tIME" and length == 7:
+            modified = datetime(*struct.unpack(">HBBBBB", data), tzinfo=timezone.utc)
+            found["time"] = modified.astimezone().replace(tzinfo=None)
+        else:
+            keyword, _, text = data.partition(b"\0")
+            if keyword not in (PNG_CREATION_TIME, PNG_XMP_KEYWORD):
+                continue
+            if chunk_type == b"zTXt":
+                text = _inflate(text[1:], MAX_READ_BYTES)
+            elif chunk_type == b"iTXt":
+                compressed = text[:1] == b"\1"
+                # Skip the compression fields, language tag and translated keyword
+                text = text[2:].split(b"\0", 2)[-1]
+                if compressed:
+                    text = _inflate(text, MAX_READ_BYTES)
+            if keyword == PNG_CREATION_TIME:
+                encoding = "utf-8" if chunk_type == b"iTXt" else "latin-1"
+                found["text"] = parse_date_text(text.decode(encoding, "replace"))
+            else:
+                found["xmp"] = parse_xmp_date(text)
+    
+    for source in ("exif", "text", "xmp", "time"):
+        if found.get(source):
+            return found[source]
+    return None
+
+def exif_format(header):
+    """
+    Return the format read_exif_date walks for a file starting with header.
+    
+    Args:
+        header (bytes): At least the first 12 bytes of the file
+    
+    Returns:
+        str: "jpeg", "heif", "png" or "tiff", or None for other formats
+    """
+    if header[:2] == b"\xff\xd8":
+        return "jpeg"
+    if header[4:8] == b"ftyp" and header[8:12] in HEIF_BRANDS:
+        return "heif"
+    if header[:8] == PNG_SIGNATURE:
+        return "png"
+    if header[:2] in (b"II", b"MM"):
+        return "tiff"
+    return None
+
+def read_exif_date(reader, max_entries=MAX_IFD_ENTRIES, tags=None):
+    """
+    Find the EXIF DateTimeOriginal of a JPEG, TIFF-based (raw) or HEIF file.
+    
+    Only the IFDs on the way to the date are walked, and never more than
+    max_entries entries, so the work per file is bounded whatever its content.
+    PNGs are read chunk by chunk up to the image data, taking the date from
+    eXIf, a "Creation Time" text, XMP or tIME, in that order.
+    
+    Args:
+        reader (HeaderFile): File to read
+        max_entries (int): Most IFD entries, JPEG segments and PNG chunks to walk
+        tags (dict): Optional dict receiving the camera "Make" and "Model" of
+                     JPEG, TIFF and HEIF files, read in the same pass
+    
+    Returns:
+        datetime: DateTimeOriginal, or None if the file has no readable date or
+                  is in another format
+    
+    Raises:
+        MetadataLimitError: If the file exceeds max_entries or the reader's byte limit
+    """
+    file_format = exif_format(reader.read(12))
+    try:
+        if file_format == "jpeg":
+            tiff = _jpeg_exif(reader, max_entries)
+        elif file_format == "heif":
+            tiff = _heif_exif(reader, max_entries)
+        elif file_format == "png":
+            return _png_date(reader, max_entries)
+        elif file_format == "tiff":
+            def read_at(offset, size):
+                reader.seek(offset)
+                return reader.read(size)
+            return _tiff_date(read_at, max_entries, tags)
+        else:
+            return None
+        if tiff is None:
+            return None
+        return _tiff_date(lambda offset, size: tiff[offset:offset + size], max_entries, tags)
+    except (ValueError, struct.error):
+        # Truncated or malformed structures; another parser may still cope
+        return None
+    return None
+
+def _sandbox_worker(connection):
+    """Run calls received over a pipe until it is closed."""
+    while True:
+        try:
+            fn, args = connection.recv()
+        except EOFError:
+            return
+        try:
+            reply = (True, fn(*args))
+        except Exception as e:
+            reply = (False, e)
+        connection.send(reply)
+
+class ProcessSandbox:
+    """
+    Worker processes running calls with a deadline each.
+    
+    A call that overruns its deadline has its worker process killed, so a
+    parser spinning on a corrupt file costs at most the deadline and never
+    holds up other calls. Workers are started on demand and reused. Use as a
+    context manager.
+    
+    Args:
+        timeout (float): Seconds allowed per call
+        processes (int): Most worker processes running at once (default: CPU count)
+    """
+    
+    def __init__(self, timeout, processes=None):
+        self.timeout = timeout
+        # Fork is unsafe once the pipeline threads run
+        self._context = multiprocessing.get_context("spawn")
+        self._slots = threading.BoundedSemaphore(processes or os.cpu_count() or 1)
+        self._idle = []
+        self._lock = threading.Lock()
+    
+    def _start_worker(self):
+        parent, child = self._context.Pipe()
+        process = self._context.Process(target=_sandbox_worker, args=(child,), daemon=True)
+        process.start()
+        child.close()
+        return process, parent
+    
+    def call(self, fn, *args):
+        """
+        Run fn(*args) in a worker process and return its result.
+        
+        Args:
+            fn (function): Module-level function, so it can be sent to the worker
+            *args: Arguments for fn
+        
+        Returns:
+            The result of the call
+        
+        Raises:
+            MetadataTimeout: If the call did not finish within the timeout
+            Exception: Whatever fn raised
+        """
+        with self._slots:
+            with self._lock:
+                worker = self._idle.pop() if self._idle else None
+            process, connection = worker or self._start_worker()
+            finished = False
+            try:
+                connection.send((fn, args))
+                if not connection.poll(self.timeout):
+                    raise MetadataTimeout(f"No result within {self.timeout:g} seconds")
+                succeeded, result = connection.recv()
+                finished = True
+            except (EOFError, OSError) as e:
+                # The worker crashed, e.g. in a native decoder
+                raise MetadataLimitError("The worker process died") from e
+            finally:
+                # Only a worker that answered is reused; any other, e.g. one
+                # whose arguments could not be pickled, is stopped
+                if finished:
+                    with self._lock:
+                        self._idle.append((process, connection))
+                else:
+                    self._discard(process, connection)
+        if not succeeded:
+            raise result
+        return result
+    
+    def _discard(self, process, connection):
+        process.kill()
+        process.join()
+        connection.close()
+    
+    def close(self):
+        """Stop all worker processes."""
+        with self._lock:
+            workers, self._idle = self._idle, []
+        for process, connection in workers:
+            connection.close()
+            process.join(1)
+            if process.is_alive():
+                process.kill()
+                process.join()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,195 @@
+"""
+Prometheus text exposition of renamer metrics, for unattended runs.
+
+Metrics are written to a file for node-exporter's textfile collector and/or
+served over HTTP on a local port, refreshed on a fixed interval.
+"""
+
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Name, type and help text of every metric the renamer records
+METRICS = {
+    "imagerenamer_files_processed_total": ("counter", "Media and sidecar files processed, by result."),
+    "imagerenamer_bytes_read_total": ("counter", "Bytes read from files to extract metadata."),
+    "imagerenamer_extraction_seconds": ("histogram", "Time spent extracting a creation date, by file format."),
+    "imagerenamer_collisions_resolved_total": ("counter", "Name collisions resolved with a counter suffix."),
+    "imagerenamer_errors_total": ("counter", "Errors while processing files, by exception type."),
+}
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Seconds between two exports
+DEFAULT_INTERVAL = 15.0
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+               for _, value in pairs)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(pairs, escaped)) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class Metrics:
+    """
+    Thread-safe registry of counters and histograms.
+    
+    Args:
+        buckets (tuple): Upper bounds of the histogram buckets, in seconds
+    """
+    
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self._counters = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+    
+    def inc(self, name, amount=1, **labels):
+        """Increase a counter."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        """Record a value in a histogram."""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [[0] * len(self.buckets), 0.0, 0]
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+    
+    def get(self, name, **labels):
+        """Return the current value of a counter (0 if never increased)."""
+        with self._lock:
+            return self._counters.get((name, tuple(sorted(labels.items()))), 0)
+    
+    def render(self):
+        """
+        Render all metrics in the Prometheus text exposition format.
+        
+        Returns:
+            str: Exposition text
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (list(counts), total, count))
+                                for key, (counts, total, count) in self._histograms.items())
+        
+        lines = []
+        for name, (metric_type, help_text) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            if metric_type == "counter":
+                for (metric, labels), value in counters:
+                    if metric == name:
+                        lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            else:
+                for (metric, labels), (counts, total, count) in histograms:
+                    if metric != name:
+                        continue
+                    for bound, bucket_count in zip(self.buckets + (float("inf"),), counts + [count]):
+                        labels_text = _format_labels(labels, [("le", _format_value(bound))])
+                        lines.append(f"{name}_bucket{labels_text} {bucket_count}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(total)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {count}")
+        return "\n".join(lines) + "\n"
+
+class MetricsExporter:
+    """
+    Export metrics periodically to a textfile and/or over HTTP.
+    
+    Files are replaced atomically so a scraper never sees a partial file. Use
+    as a context manager; a final export is written when it exits.
+    
+    Args:
+        metrics (Metrics): Metrics to export
+        path (str): Optional file to write, e.g. in node-exporter's textfile directory
+        port (int): Optional local port serving the metrics at /metrics
+        interval (float): Seconds between two textfile writes
+        host (str): Address to bind the HTTP endpoint to
+    """
+    
+    def __init__(self, metrics, path=None, port=None, interval=DEFAULT_INTERVAL, host="127.0.0.1"):
+        self.metrics = metrics
+        self.path = path
+        self.port = port
+        self.interval = interval
+        self.host = host
+        self._stopped = threading.Event()
+        self._threads = []
+        self._server = None
+    
+    def write(self):
+        """Write the metrics file now."""
+        if not self.path:
+            return
+        temp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            f.write(self.metrics.render())
+        os.replace(temp_path, self.path)
+    
+    def _write_periodically(self):
+        while not self._stopped.wait(self.interval):
+            self.write()
+    
+    def start(self):
+        """Start exporting in background threads."""
+        if self.path:
+            self.write()
+            self._threads.append(threading.Thread(target=self._write_periodically, daemon=True))
+        if self.port is not None:
+            metrics = self.metrics
+            
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split("?")[0] not in ("/", "/metrics"):
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+                
+                def log_message(self, format, *args):
+                    # Keep scrapes out of the progress output
+                    pass
+            
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self._server.daemon_threads = True
+            self.port = self._server.server_address[1]
+            self._threads.append(threading.Thread(target=self._server.serve_forever, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        return self
+    
+    def stop(self):
+        """Stop exporting and write the final values."""
+        self._stopped.set()
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+        for thread in self._threads:
+            thread.join()
+        self.write()
+    
+    def __enter__(self):
+        return self.start()
+    
+    def __exit__(self, *exc_info):
+        self.stop()
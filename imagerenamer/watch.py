@@ -0,0 +1,228 @@
+"""
+Watch mode: rename files as they land in a folder, using Linux inotify.
+"""
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+from imagerenamer.core import (
+    rename_images, combine_stats, IMAGE_EXTENSIONS, VIDEO_EXTENSIONS, SIDECAR_EXTENSIONS
+)
+
+# inotify constants from <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+# struct inotify_event: int wd; uint32_t mask, cookie, len; char name[len]
+EVENT_HEADER = struct.Struct("iIII")
+
+# Seconds a file must stay untouched after being written before it is renamed
+DEFAULT_SETTLE_TIME = 0.5
+
+def _load_libc():
+    """Load the C library with the inotify functions, or raise OSError."""
+    if not hasattr(os, "uname") or os.uname().sysname != "Linux":
+        raise OSError("Watch mode requires Linux inotify")
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    libc.inotify_init1.argtypes = [ctypes.c_int]
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return libc
+
+def parse_events(data):
+    """
+    Parse a buffer read from an inotify file descriptor.
+    
+    Args:
+        data (bytes): Raw events
+    
+    Returns:
+        list: (mask, name) tuples
+    """
+    events = []
+    offset = 0
+    while offset + EVENT_HEADER.size <= len(data):
+        _, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+        offset += EVENT_HEADER.size
+        name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+        offset += length
+        events.append((mask, name))
+    return events
+
+class _NameIndex(set):
+    """
+    Names in the watched folder, remembering the names that renames added.
+    
+    rename_images adds the new name of each file it renames through add();
+    the watch loop records names announced by events with note(), so that the
+    events of its own renames can be told from files moved in from outside.
+    """
+    
+    def __init__(self, names=()):
+        super().__init__(names)
+        self.renamed = set()
+    
+    def add(self, name):
+        super().add(name)
+        self.renamed.add(name)
+    
+    def discard(self, name):
+        super().discard(name)
+        self.renamed.discard(name)
+    
+    def note(self, name):
+        super().add(name)
+
+def watch_folder(folder_path, callback=None, file_filter=None, settle_time=DEFAULT_SETTLE_TIME,
+                 initial_scan=True, stop_event=None, **rename_options):
+    """
+    Rename files as they are completely written to a folder.
+    
+    The folder is listed once; after that only inotify events (IN_CLOSE_WRITE
+    and IN_MOVED_TO) drive the renaming, with an in-memory index of the names
+    in the folder standing in for collision checks on disk. A file is renamed
+    once it has not been written for settle_time seconds.
+    
+    Sidecars (.xmp, .thm, .aae) are renamed together with their media file
+    when they are in the folder by the time it is renamed, whether they landed
+    before or after it. A sidecar landing after its media file was renamed
+    keeps its name, as the watch does not remember what the old names became.
+    
+    Args:
+        folder_path (str): Path to the folder to watch
+        callback (function): Optional callback function for progress updates
+        file_filter (function): Optional function to filter which files to process
+        settle_time (float): Seconds without writes before a new file is renamed
+        initial_scan (bool): Whether to rename the files already in the folder first
+        stop_event (threading.Event): Optional event that ends the watch when set
+        **rename_options: Further keyword arguments for rename_images
+    
+    Returns:
+        dict: Combined statistics of all renames done while watching
+    """
+    if not os.path.isdir(folder_path):
+        return rename_images(folder_path, callback=callback, file_filter=file_filter, **rename_options)
+    
+    if file_filter is None:
+        # Same defaults as rename_images
+        media_extensions = IMAGE_EXTENSIONS + VIDEO_EXTENSIONS
+        
+        def file_filter(filename):
+            return filename.lower().endswith(media_extensions)
+    
+    group_related = rename_options.get("group_related", True)
+    
+    def is_candidate(name):
+        return file_filter(name) or (group_related and name.lower().endswith(SIDECAR_EXTENSIONS))
+    
+    def sidecar_names(name):
+        """Names the sidecars of a media file may have, e.g. DSC_0001.xmp or DSC_0001.JPG.XMP."""
+        extensions = SIDECAR_EXTENSIONS + tuple(extension.upper() for extension in SIDECAR_EXTENSIONS)
+        return [stem + extension for stem in (os.path.splitext(name)[0], name) for extension in extensions]
+    
+    libc = _load_libc()
+    fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+    if fd < 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, os.strerror(errno))
+    
+    total = {"total": 0, "renamed": 0, "skipped": 0, "removed_duplicates": 0, "error": False}
+    try:
+        # Start watching before listing so no file slips through in between
+        if libc.inotify_add_watch(fd, os.fsencode(folder_path), WATCH_MASK) < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), folder_path)
+        
+        name_index = _NameIndex(os.listdir(folder_path))
+        if initial_scan:
+            combine_stats(total, rename_images(folder_path, callback=callback, file_filter=file_filter,
+                                               name_index=name_index, **rename_options))
+        
+        message = f"Watching {folder_path} for new files"
+        if callback:
+            callback(message)
+        else:
+            print(message)
+        
+        # Names waiting to settle, with the time they may be renamed at
+        pending = {}
+        poller = select.poll()
+        poller.register(fd, select.POLLIN)
+        
+        try:
+            while not (stop_event and stop_event.is_set()):
+                timeout = 0.2
+                if pending:
+                    timeout = max(0.0, min(min(pending.values()) - time.monotonic(), timeout))
+                
+                if poller.poll(timeout * 1000):
+                    try:
+                        data = os.read(fd, 64 * 1024)
+                    except BlockingIOError:
+                        data = b""
+                    for mask, name in parse_events(data):
+                        if mask & IN_Q_OVERFLOW:
+                            # Events were lost, fall back to a single listing; the
+                            # events of our renames may still be on their way
+                            renamed = name_index.renamed
+                            name_index = _NameIndex(os.listdir(folder_path))
+                            name_index.renamed = renamed & name_index
+                            pending.update((name, time.monotonic() + settle_time)
+                                           for name in name_index if is_candidate(name))
+                            continue
+                        if mask & IN_ISDIR or not name:
+                            continue
+                        if mask & (IN_DELETE | IN_MOVED_FROM):
+                            name_index.discard(name)
+                            pending.pop(name, None)
+                            continue
+                        if mask & IN_MOVED_TO and name in name_index.renamed:
+                            # One of our own renames; each is announced once
+                            name_index.renamed.discard(name)
+                            continue
+                        # Anything else written or moved in is new content, even
+                        # under a name the index already holds
+                        name_index.note(name)
+                        if mask & (IN_CLOSE_WRITE | IN_MOVED_TO) and is_candidate(name):
+                            # Every new write pushes the deadline back
+                            pending[name] = time.monotonic() + settle_time
+                
+                now = time.monotonic()
+                ready = [name for name, deadline in pending.items() if deadline <= now]
+                if not ready:
+                    continue
+                for name in ready:
+                    del pending[name]
+                ready = [name for name in ready if name in name_index]
+                if group_related:
+                    # Sidecars in the folder go along with their media file
+                    for name in [name for name in ready if file_filter(name)]:
+                        for sidecar in sidecar_names(name):
+                            if sidecar in name_index and sidecar not in ready:
+                                ready.append(sidecar)
+                                pending.pop(sidecar, None)
+                
+                combine_stats(total, rename_images(folder_path, callback=callback, file_filter=file_filter,
+                                                   files=ready, name_index=name_index, **rename_options))
+        except KeyboardInterrupt:
+            message = f"Stopped watching {folder_path}"
+            if callback:
+                callback(message)
+            else:
+                print(message)
+    finally:
+        os.close(fd)
+    
+    return total
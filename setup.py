@@ -33,6 +33,9 @@ setup(
         "Pillow>=9.0.0",
         "PyQt6>=6.4.0",
     ],
+    extras_require={
+        "parquet": ["pyarrow>=6.0.0"],
+    },
     entry_points={
         'console_scripts': [
             'imagerenamer=imagerenamer.cli:main',
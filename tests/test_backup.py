@@ -0,0 +1,132 @@
+"""
+Tests for the content-addressed backup store of the Image Renamer.
+"""
+
+import hashlib
+import json
+import os
+import tarfile
+import zipfile
+from datetime import datetime
+from unittest.mock import patch
+import pytest
+from imagerenamer.backup import BackupStore, BackupArchive, restore_from_archive
+from imagerenamer.core import rename_images
+from imagerenamer.metadata import HANDLES
+
+def test_backup_store_deduplicates(temp_dir):
+    """Test that identical files are stored once and unchanged files are not read again."""
+    folder = os.path.join(temp_dir, "backup")
+    for name, data in (("a.jpg", b"same"), ("b.jpg", b"same"), ("c.jpg", b"other")):
+        with open(os.path.join(temp_dir, name), "wb") as f:
+            f.write(data)
+    
+    store = BackupStore(folder)
+    assert store.add(os.path.join(temp_dir, "a.jpg")) is True
+    assert store.add(os.path.join(temp_dir, "b.jpg")) is False
+    assert store.add(os.path.join(temp_dir, "c.jpg")) is True
+    assert store.bytes_written == len(b"same") + len(b"other")
+    assert os.path.exists(store.object_path(hashlib.sha256(b"same").hexdigest()))
+    
+    # A new store picks the manifest up and skips the files without hashing them
+    store = BackupStore(folder)
+    with patch('imagerenamer.backup.hash_file') as mock_hash:
+        for name in ("a.jpg", "b.jpg", "c.jpg"):
+            assert store.add(os.path.join(temp_dir, name)) is False
+    mock_hash.assert_not_called()
+    assert store.bytes_written == 0
+    
+    with open(os.path.join(folder, "manifest.jsonl"), encoding="utf-8") as f:
+        entries = [json.loads(line) for line in f]
+    assert [entry["path"] for entry in entries] == ["a.jpg", "b.jpg", "c.jpg"]
+    
+    os.remove(os.path.join(temp_dir, "b.jpg"))
+    store.restore("b.jpg", os.path.join(temp_dir, "b.jpg"))
+    with open(os.path.join(temp_dir, "b.jpg"), "rb") as f:
+        assert f.read() == b"same"
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_dedup_backup(mock_get_exif, temp_dir):
+    """Test that re-imported copies of backed up files add no objects."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    for i in range(3):
+        with open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "wb") as f:
+            f.write(b"photo")
+    
+    stats = rename_images(temp_dir, create_backup=True, dedup_backup=True, callback=lambda message: None)
+    assert stats["renamed"] == 3
+    
+    # The same card imported again
+    for i in range(3):
+        with open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "wb") as f:
+            f.write(b"photo")
+    rename_images(temp_dir, create_backup=True, dedup_backup=True, callback=lambda message: None)
+    
+    objects = [name for _, _, names in os.walk(os.path.join(temp_dir, "backup", "objects"))
+               for name in names]
+    assert objects == [hashlib.sha256(b"photo").hexdigest()]
+    store = BackupStore(os.path.join(temp_dir, "backup"))
+    assert sorted(store.paths) == ["IMG_000.jpg", "IMG_001.jpg", "IMG_002.jpg"]
+
+@pytest.mark.parametrize("archive_format", ["tar", "zip"])
+def test_backup_archive(temp_dir, archive_format):
+    """Test that files renamed right after being queued are archived, appended and restored."""
+    path = os.path.join(temp_dir, f"backup.{archive_format}")
+    contents = {}
+    for run in range(2):
+        with BackupArchive(path, archive_format) as archive:
+            for i in range(3):
+                name = f"IMG_{run}{i}.jpg"
+                contents[name] = os.urandom(1000 * i + run)
+                file_path = os.path.join(temp_dir, name)
+                with open(file_path, "wb") as f:
+                    f.write(contents[name])
+                archive.add(file_path)
+                os.rename(file_path, file_path + ".renamed")
+    
+    # A standard tool reads the archive
+    if archive_format == "tar":
+        with tarfile.open(path) as archive:
+            assert sorted(archive.getnames()) == sorted(contents)
+    else:
+        with zipfile.ZipFile(path) as archive:
+            assert sorted(archive.namelist()) == sorted(contents)
+    
+    for name, data in contents.items():
+        target = os.path.join(temp_dir, "restored")
+        restore_from_archive(path, name, target)
+        with open(target, "rb") as f:
+            assert f.read() == data
+
+def test_backup_archive_waits_for_copy(temp_dir):
+    """Test that add() returns with the file closed where open files cannot be renamed."""
+    file_path = os.path.join(temp_dir, "IMG_001.jpg")
+    with open(file_path, "wb") as f:
+        f.write(b"photo")
+    
+    with patch('imagerenamer.backup.WAIT_FOR_COPY', True):
+        with BackupArchive(os.path.join(temp_dir, "backup.tar")) as archive:
+            archive.add(file_path)
+            assert archive.index["IMG_001.jpg"]["size"] == len(b"photo")
+            assert HANDLES.in_use == 0
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_backup_archive(mock_get_exif, temp_dir):
+    """Test that backups go into one archive instead of a file each."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    for i in range(3):
+        with open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "wb") as f:
+            f.write(f"photo {i}".encode())
+    
+    stats = rename_images(temp_dir, create_backup=True, backup_archive="tar", workers={"apply": 2},
+                          callback=lambda message: None)
+    
+    assert stats["renamed"] == 3
+    assert sorted(os.listdir(os.path.join(temp_dir, "backup"))) == ["backup.tar", "backup.tar.index.json"]
+    restore_from_archive(os.path.join(temp_dir, "backup", "backup.tar"), "IMG_001.jpg",
+                         os.path.join(temp_dir, "restored.jpg"))
+    with open(os.path.join(temp_dir, "restored.jpg"), "rb") as f:
+        assert f.read() == b"photo 1"
+    
+    with pytest.raises(ValueError):
+        rename_images(temp_dir, create_backup=True, backup_archive="rar")
@@ -0,0 +1,116 @@
+"""
+Tests for the metadata catalog export of the Image Renamer.
+"""
+
+import csv
+import hashlib
+import json
+import os
+import sys
+from unittest.mock import patch
+import pytest
+from PIL import Image
+from imagerenamer.catalog import catalog_folder, catalog_row
+from imagerenamer.cli import main
+from imagerenamer.metadata import HeaderFile, read_exif_date
+
+def create_camera_image(path, date="2021:03:04 05:06:07", model="EOS R5"):
+    """Create a small JPEG with a camera make, model and DateTimeOriginal."""
+    exif = Image.Exif()
+    exif[0x010F] = "Canon"
+    exif[0x0110] = model
+    exif[0x8769] = {0x9003: date}
+    Image.new("RGB", (8, 8)).save(path, exif=exif.tobytes())
+    return path
+
+def create_library(folder):
+    """Create a small library with nested folders, a file without EXIF and a non-media file."""
+    os.makedirs(os.path.join(folder, "2021", "03"))
+    create_camera_image(os.path.join(folder, "2021", "03", "IMG_0001.jpg"))
+    create_camera_image(os.path.join(folder, "2021", "03", "IMG_0002.jpg"), "2021:03:05 10:00:00", "EOS R6")
+    Image.new("RGB", (8, 8)).save(os.path.join(folder, "scan.png"))
+    with open(os.path.join(folder, "notes.txt"), "w") as f:
+        f.write("not media")
+
+def test_read_exif_date_camera_tags(temp_dir):
+    """Test that the camera make and model are read in the same pass as the date."""
+    path = create_camera_image(os.path.join(temp_dir, "camera.jpg"))
+    tags = {}
+    with HeaderFile(path) as reader:
+        assert read_exif_date(reader, tags=tags) is not None
+    assert tags == {"Make": "Canon", "Model": "EOS R5"}
+
+def test_catalog_folder_jsonl(temp_dir):
+    """Test the rows of a catalog written in several batches, in walk order."""
+    library = os.path.join(temp_dir, "library")
+    create_library(library)
+    output = os.path.join(temp_dir, "catalog.jsonl")
+    
+    stats = catalog_folder(library, output, hash_files=True, batch_size=2, callback=lambda message: None)
+    
+    assert stats == {"total": 3, "errors": 0}
+    with open(output, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f]
+    assert [row["path"] for row in rows] == [
+        "scan.png", os.path.join("2021", "03", "IMG_0001.jpg"), os.path.join("2021", "03", "IMG_0002.jpg")
+    ]
+    photo = rows[1]
+    assert photo["date"] == "2021-03-04T05:06:07"
+    assert photo["date_source"] == "metadata"
+    assert (photo["camera_make"], photo["camera_model"]) == ("Canon", "EOS R5")
+    path = os.path.join(library, photo["path"])
+    assert photo["size"] == os.path.getsize(path)
+    assert photo["inode"] == os.stat(path).st_ino
+    with open(path, "rb") as f:
+        assert photo["sha256"] == hashlib.sha256(f.read()).hexdigest()
+    assert rows[0]["date_source"] == "stat"
+    assert rows[0]["camera_model"] is None
+
+def test_catalog_row_parses_exif_once(temp_dir):
+    """Test that the date and the camera fields come from a single EXIF pass."""
+    path = create_camera_image(os.path.join(temp_dir, "IMG_0001.jpg"))
+    
+    with patch("imagerenamer.core.read_exif_date", wraps=read_exif_date) as mock_read:
+        row = catalog_row("IMG_0001.jpg", path)
+    
+    assert mock_read.call_count == 1
+    assert (row["date"], row["date_source"]) == ("2021-03-04T05:06:07", "metadata")
+    assert (row["camera_make"], row["camera_model"]) == ("Canon", "EOS R5")
+    
+    # The camera fields are still read when the file name gives the date
+    path = create_camera_image(os.path.join(temp_dir, "IMG_20200101_000000.jpg"))
+    row = catalog_row("IMG_20200101_000000.jpg", path, date_sources=("filename", "metadata"))
+    assert row["date_source"] == "filename"
+    assert row["camera_model"] == "EOS R5"
+
+def test_catalog_folder_parquet(temp_dir):
+    """Test that Parquet catalogs get one row group per batch."""
+    pyarrow_parquet = pytest.importorskip("pyarrow.parquet")
+    library = os.path.join(temp_dir, "library")
+    create_library(library)
+    output = os.path.join(temp_dir, "catalog.parquet")
+    
+    catalog_folder(library, output, batch_size=2, callback=lambda message: None)
+    
+    parquet_file = pyarrow_parquet.ParquetFile(output)
+    assert parquet_file.metadata.num_row_groups == 2
+    assert parquet_file.read().column("camera_model").to_pylist() == [None, "EOS R5", "EOS R6"]
+
+def test_cli_catalog(temp_dir, capsys):
+    """Test the catalog subcommand writing CSV without changing the library."""
+    library = os.path.join(temp_dir, "library")
+    create_library(library)
+    before = sorted(os.path.join(root, name) for root, _, names in os.walk(library) for name in names)
+    output = os.path.join(temp_dir, "catalog.csv")
+    
+    with patch.object(sys, 'argv', ['imagerenamer', 'catalog', library, '-o', output]):
+        assert main() == 0
+    
+    assert sorted(os.path.join(root, name) for root, _, names in os.walk(library) for name in names) == before
+    with open(output, encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert [row["camera_model"] for row in rows] == ["", "EOS R5", "EOS R6"]
+    assert "Files cataloged: 3" in capsys.readouterr().out
+    
+    with patch.object(sys, 'argv', ['imagerenamer', 'catalog', library, '-o', os.path.join(temp_dir, "catalog.xls")]):
+        assert main() == 1
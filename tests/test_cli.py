@@ -246,4 +246,96 @@ def test_cli_help_includes_video_option(capsys):
     captured = capsys.readouterr()
     
     # Check that the help text includes the new option
-    assert "--include-videos" in captured.out 
\ No newline at end of file
+    assert "--include-videos" in captured.out
+
+def test_cli_main_with_date_sources(sample_image_directory):
+    """Test that the --date-sources option is passed on to rename_images."""
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--date-sources', 'filename,stat']):
+        with patch('imagerenamer.cli.rename_images') as mock_rename:
+            mock_rename.return_value = {"total": 0, "renamed": 0, "skipped": 0, "error": False}
+            main()
+            
+            args, kwargs = mock_rename.call_args
+            assert kwargs.get('date_sources') == ("filename", "stat")
+
+def test_cli_main_with_invalid_date_sources(sample_image_directory):
+    """Test that an unknown date source is rejected by the argument parser."""
+    with pytest.raises(SystemExit) as excinfo:
+        with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--date-sources', 'exiftool']):
+            main()
+    
+    assert excinfo.value.code == 2
+
+def test_cli_main_with_verify(sample_image_directory):
+    """Test that the --verify option is passed on to rename_images."""
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--verify']):
+        with patch('imagerenamer.cli.rename_images') as mock_rename:
+            mock_rename.return_value = {"total": 0, "renamed": 0, "skipped": 0, "error": False}
+            main()
+            
+            args, kwargs = mock_rename.call_args
+            assert kwargs.get('verify') is True
+
+def test_cli_main_with_streaming_and_report(sample_image_directory):
+    """Test that the --streaming and --report options are passed on to rename_images."""
+    report_path = os.path.join(sample_image_directory, "report.jsonl")
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--streaming', '--report', report_path]):
+        with patch('imagerenamer.cli.rename_images') as mock_rename:
+            mock_rename.return_value = {"total": 0, "renamed": 0, "skipped": 0, "error": False}
+            main()
+            
+            args, kwargs = mock_rename.call_args
+            assert kwargs.get('streaming') is True
+            assert kwargs.get('report_path') == report_path
+
+def test_cli_main_with_workers(sample_image_directory):
+    """Test that the worker options are passed on to rename_images."""
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory,
+                                    '--extract-workers', '4', '--apply-workers', 'auto']):
+        with patch('imagerenamer.cli.rename_images') as mock_rename:
+            mock_rename.return_value = {"total": 0, "renamed": 0, "skipped": 0, "error": False}
+            main()
+            
+            args, kwargs = mock_rename.call_args
+            assert kwargs.get('workers') == {"extract": 4, "apply": "auto"}
+    
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--extract-workers', '0']):
+        with pytest.raises(SystemExit):
+            main()
+
+def test_cli_main_with_io_options(sample_image_directory):
+    """Test that the I/O scheduling options are passed on to rename_images."""
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--io-order', 'extent',
+                                    '--fadvise', '--network', '--timeout', '2.5']):
+        with patch('imagerenamer.cli.rename_images') as mock_rename:
+            mock_rename.return_value = {"total": 0, "renamed": 0, "skipped": 0, "error": False}
+            main()
+            
+            args, kwargs = mock_rename.call_args
+            assert kwargs.get('io_order') == "extent"
+            assert kwargs.get('fadvise') is True
+            assert kwargs.get('network') is True
+            assert kwargs.get('timeout') == 2.5
+
+def test_cli_main_with_several_folders(temp_dir, capsys):
+    """Test that globs and folder lists are expanded and run together."""
+    for name in ("2021-01", "2021-02", "2022-01"):
+        os.mkdir(os.path.join(temp_dir, name))
+    list_path = os.path.join(temp_dir, "folders.txt")
+    with open(list_path, "w") as f:
+        f.write(f"# extra folders\n\n{os.path.join(temp_dir, '2022-01')}\n")
+    
+    stats = {"total": 1, "renamed": 1, "skipped": 0, "error": False}
+    with patch.object(sys, 'argv', ['imagerenamer', os.path.join(temp_dir, '2021-*'),
+                                    '--from-file', list_path]):
+        with patch('imagerenamer.cli.rename_folders') as mock_rename:
+            mock_rename.return_value = {"folders": {}, "total": dict(stats, renamed=3)}
+            assert main() == 0
+            
+            args, kwargs = mock_rename.call_args
+            assert args[0] == [os.path.join(temp_dir, name) for name in ("2021-01", "2021-02", "2022-01")]
+    assert "Total of 3 folders" in capsys.readouterr().out
+    
+    with patch.object(sys, 'argv', ['imagerenamer', os.path.join(temp_dir, '2021-*'), '--watch']):
+        with pytest.raises(SystemExit):
+            main()
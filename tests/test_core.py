@@ -2,16 +2,28 @@
 Tests for the core functionality of the Image Renamer.
 """
 
+import errno
+import hashlib
 import os
+import json
 import pytest
 import shutil
+import tempfile
+import threading
 import time
+import tracemalloc
 from datetime import datetime
 from unittest.mock import patch, mock_open, MagicMock
 from pathlib import Path
 from PIL import Image
 from PIL.ExifTags import TAGS
-from imagerenamer.core import get_exif_creation_date, rename_images
+from conftest import create_sample_image
+from imagerenamer.core import (
+    get_exif_creation_date, rename_images, get_filename_date, get_creation_date,
+    compile_format_pattern, is_conforming_name, group_related_files, stream_media_files,
+    Pipeline, get_first_extent, sort_for_io, ConcurrencyLimit, LatencyLimit, NETWORK_MIN_IN_FLIGHT,
+    ThroughputLimit, rename_folders, move_file, rename_no_replace, ingest_images, copy_with_hash, hash_file
+)
 
 def test_get_exif_creation_date(sample_image_directory):
     """Test extracting EXIF creation date from an image."""
@@ -312,7 +324,7 @@ def test_rename_images_with_callback(sample_image_directory):
     assert any("Found" in message for message in messages)
     assert any("Renamed" in message for message in messages) or any("Skipping" in message for message in messages)
 
-@patch('os.rename')
+@patch('imagerenamer.core.rename_no_replace')
 def test_rename_images_permission_error(mock_rename, sample_image_directory):
     """Test handling permission errors during renaming."""
     # Setup mock to raise PermissionError
@@ -526,4 +538,710 @@ def test_rename_images_with_images_only_filter(sample_image_directory):
     try:
         os.remove(test_video_path)
     except:
-        pass  # Ignore cleanup errors 
\ No newline at end of file
+        pass  # Ignore cleanup errors
+
+def test_get_filename_date_patterns():
+    """Test extracting timestamps embedded in common camera and phone filenames."""
+    assert get_filename_date("IMG_20220510_143045.jpg") == datetime(2022, 5, 10, 14, 30, 45)
+    assert get_filename_date("PXL_20230101_101010123.mp4") == datetime(2023, 1, 1, 10, 10, 10, 123000)
+    assert get_filename_date("VID-20220510-WA0003.mp4") == datetime(2022, 5, 10)
+    assert get_filename_date("2022-05-10_14-30-45_1.jpg") == datetime(2022, 5, 10, 14, 30, 45)
+    assert get_filename_date("Screenshot 2022-05-10 at 14.30.45.png") == datetime(2022, 5, 10, 14, 30, 45)
+    
+    # Names without a (valid) timestamp
+    assert get_filename_date("IMG_001.jpg") is None
+    assert get_filename_date("DSC_20221350_101010.jpg") is None
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_filename_date_source_skips_metadata(mock_get_exif, temp_dir):
+    """Test that files with a timestamp in their name are resolved without reading metadata."""
+    open(os.path.join(temp_dir, "IMG_20220510_143045.jpg"), "w").close()
+    
+    stats = rename_images(temp_dir, date_sources=("filename", "metadata", "stat"))
+    
+    assert stats['renamed'] == 1
+    assert os.path.exists(os.path.join(temp_dir, "2022-05-10_14-30-45.jpg"))
+    mock_get_exif.assert_not_called()
+
+def test_get_creation_date_chain(sample_image_directory):
+    """Test that the date source chain falls through to the next source."""
+    image_path = os.path.join(sample_image_directory, "IMG_001.jpg")
+    
+    creation_date, source = get_creation_date(image_path, ("filename", "metadata", "stat"))
+    assert source == "stat"
+    assert isinstance(creation_date, datetime)
+    
+    # Without a stat fallback nothing matches
+    assert get_creation_date(image_path, ("filename",)) == (None, None)
+
+def test_rename_images_invalid_date_source(sample_image_directory):
+    """Test that unknown date sources are rejected."""
+    with pytest.raises(ValueError):
+        rename_images(sample_image_directory, date_sources=("exiftool",))
+
+def test_compile_format_pattern():
+    """Test matching filenames against a compiled format string."""
+    pattern = compile_format_pattern("%Y-%m-%d_%H-%M-%S")
+    
+    assert is_conforming_name("2022-05-10_14-30-45.jpg", pattern)
+    assert is_conforming_name("2022-05-10_14-30-45_3.jpg", pattern)
+    assert not is_conforming_name("2022-05-10_14-30-45.JPG", pattern)
+    assert not is_conforming_name("IMG_001.jpg", pattern)
+    assert not is_conforming_name("2022-05-10.jpg", pattern)
+    
+    pattern = compile_format_pattern("%Y%m%d_%Hh%Mm%Ss")
+    assert is_conforming_name("20220510_14h30m45s.png", pattern)
+    assert not is_conforming_name("2022-05-10_14-30-45.png", pattern)
+
+def test_rename_images_already_renamed_files_not_opened(sample_image_directory):
+    """Test that conforming names are skipped without reading any metadata."""
+    rename_images(sample_image_directory, create_backup=False)
+    
+    with patch('imagerenamer.core.get_creation_date') as mock_get_date:
+        stats = rename_images(sample_image_directory, create_backup=False)
+    
+    assert stats['renamed'] == 0
+    assert stats['skipped'] == stats['total']
+    mock_get_date.assert_not_called()
+
+def test_rename_images_verify_rechecks_conforming_names(temp_dir):
+    """Test that verify mode re-reads dates for files that already conform."""
+    wrong_name = os.path.join(temp_dir, "2000-01-01_00-00-00.jpg")
+    create_sample_image(wrong_name)
+    
+    # Without verify the (wrong) name is trusted
+    stats = rename_images(temp_dir)
+    assert stats['skipped'] == 1
+    assert os.path.exists(wrong_name)
+    
+    # With verify the file is renamed to its actual creation time
+    stats = rename_images(temp_dir, verify=True)
+    assert stats['renamed'] == 1
+    assert not os.path.exists(wrong_name)
+
+def test_group_related_files():
+    """Test grouping RAW+JPEG pairs and sidecars by stem."""
+    groups = group_related_files(
+        ["DSC_0001.NEF", "DSC_0001.JPG", "DSC_0002.NEF"],
+        ["DSC_0001.xmp", "DSC_0002.NEF.xmp", "orphan.xmp"]
+    )
+    
+    assert groups == [
+        ("DSC_0001", ["DSC_0001.JPG", "DSC_0001.NEF"], ["DSC_0001.xmp"]),
+        ("DSC_0002", ["DSC_0002.NEF"], ["DSC_0002.NEF.xmp"]),
+    ]
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_groups_raw_jpeg_pairs(mock_get_exif, temp_dir):
+    """Test that a RAW+JPEG pair and its sidecar are renamed together from one metadata read."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    for name in ("DSC_0001.NEF", "DSC_0001.JPG", "DSC_0001.xmp"):
+        open(os.path.join(temp_dir, name), "w").close()
+    # An existing file forces a counter suffix, which the whole group must share
+    open(os.path.join(temp_dir, "2022-05-10_14-30-45.jpg"), "w").close()
+    
+    stats = rename_images(temp_dir)
+    
+    assert mock_get_exif.call_count == 1
+    assert mock_get_exif.call_args[0][0].endswith("DSC_0001.JPG")
+    assert stats['renamed'] == 2
+    assert sorted(os.listdir(temp_dir)) == [
+        "2022-05-10_14-30-45.jpg",
+        "2022-05-10_14-30-45_1.jpg",
+        "2022-05-10_14-30-45_1.nef",
+        "2022-05-10_14-30-45_1.xmp",
+    ]
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_without_grouping(mock_get_exif, temp_dir):
+    """Test that grouping can be disabled."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    for name in ("DSC_0001.NEF", "DSC_0001.JPG", "DSC_0001.xmp"):
+        open(os.path.join(temp_dir, name), "w").close()
+    
+    stats = rename_images(temp_dir, group_related=False)
+    
+    assert mock_get_exif.call_count == 2
+    assert stats['renamed'] == 2
+    assert "DSC_0001.xmp" in os.listdir(temp_dir)
+
+def test_stream_media_files(sample_image_directory):
+    """Test lazily scanning a folder through a spool written in small batches."""
+    os.mkdir(os.path.join(sample_image_directory, "subfolder.jpg"))
+    scanned = threading.Event()
+    
+    names = list(stream_media_files(
+        sample_image_directory,
+        lambda filename: filename.lower().endswith(".jpg"),
+        scanned,
+        batch_size=1
+    ))
+    
+    assert sorted(names) == ["IMG_001.jpg", "IMG_002.jpg", "IMG_003.jpg"]
+    assert scanned.is_set()
+
+def test_rename_images_streaming_with_report(temp_dir):
+    """Test streaming mode renames each file once and writes one result per file to the report."""
+    # Enough files for the scan to hand them over in several batches
+    names = [f"IMG_20220101_{i // 3600:02d}{i // 60 % 60:02d}{i % 60:02d}.jpg" for i in range(3000)]
+    names += ["2021-01-01_00-00-00.jpg", "2021-01-01_00-00-01.jpg"]
+    for name in names:
+        open(os.path.join(temp_dir, name), "w").close()
+    report_path = os.path.join(temp_dir, "report.jsonl")
+    
+    stats = rename_images(temp_dir, callback=lambda message: None, date_sources=("filename",),
+                          streaming=True, report_path=report_path)
+    
+    assert not stats.get('error')
+    assert stats['total'] == 3002
+    assert stats['renamed'] == 3000
+    assert stats['skipped'] == 2
+    with open(report_path, encoding="utf-8") as f:
+        results = [json.loads(line) for line in f]
+    assert sorted(result["file"] for result in results) == sorted(names)
+    assert {result["file"]: result["status"] for result in results if result["status"] != "renamed"} == {
+        "2021-01-01_00-00-00.jpg": "skipped", "2021-01-01_00-00-01.jpg": "skipped"
+    }
+    for result in results:
+        if result["status"] == "renamed":
+            assert result["new_name"] == "2022-01-01_{}-{}-{}.jpg".format(
+                result["file"][13:15], result["file"][15:17], result["file"][17:19])
+    assert sorted(os.listdir(temp_dir)) == sorted(
+        [result["new_name"] for result in results] + ["report.jsonl"])
+
+def _streaming_peak_memory(folder, count):
+    """Create count files in folder and return the peak traced memory of a streaming run."""
+    for i in range(count):
+        open(os.path.join(folder, f"IMG_20220101_{i // 3600:02d}{i // 60 % 60:02d}{i % 60:02d}.jpg"), "w").close()
+    
+    tracemalloc.start()
+    try:
+        rename_images(folder, callback=lambda message: None, date_sources=("filename",),
+                      streaming=True, report_path=os.devnull)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_rename_images_streaming_memory_is_flat(tmp_path):
+    """Test that peak memory in streaming mode does not grow with the entry count."""
+    small = tmp_path / "small"
+    large = tmp_path / "large"
+    small.mkdir()
+    large.mkdir()
+    
+    small_peak = _streaming_peak_memory(str(small), 1500)
+    large_peak = _streaming_peak_memory(str(large), 6000)
+    
+    # Both runs fill the scan queue; four times the entries must not cost more memory
+    assert large_peak < small_peak * 1.5
+
+def test_pipeline_ordered_stage_and_backpressure():
+    """Test that ordered stages see items in source order and queues stay bounded."""
+    seen = []
+    
+    def extract(item):
+        # Later items finish first to shuffle the order between stages
+        time.sleep(0.001 * (5 - item % 5))
+        return None if item % 7 == 0 else item
+    
+    def resolve(item):
+        seen.append(item)
+        return item
+    
+    pipeline = Pipeline(
+        [("extract", extract, 4), ("resolve", resolve, 3)],
+        queue_size=2,
+        ordered=("resolve",)
+    )
+    pipeline.run(range(50))
+    
+    assert seen == [item for item in range(50) if item % 7 != 0]
+    assert all(peak <= 2 for peak in pipeline.peak_queue_depths().values())
+    assert pipeline.queue_depths() == {"extract": 0, "resolve": 0}
+
+def test_pipeline_propagates_errors():
+    """Test that an error in a stage stops the pipeline and is raised by run."""
+    def fail(item):
+        if item == 3:
+            raise IOError("I/O error")
+        return item
+    
+    pipeline = Pipeline([("extract", fail, 2), ("apply", lambda item: None, 1)])
+    
+    with pytest.raises(IOError):
+        pipeline.run(range(1000))
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_parallel_workers_are_deterministic(mock_get_exif, temp_dir):
+    """Test that collision suffixes follow scan order regardless of worker counts."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    for i in range(20):
+        open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "w").close()
+    
+    scan_order = os.listdir(temp_dir)
+    report_path = os.path.join(temp_dir, "..", os.path.basename(temp_dir) + ".jsonl")
+    stats = rename_images(temp_dir, report_path=report_path, workers={"extract": 4, "apply": 3},
+                          group_related=False)
+    
+    assert stats['renamed'] == 20
+    assert set(stats['queue_peaks']) == {"extract", "resolve", "apply"}
+    with open(report_path, encoding="utf-8") as f:
+        new_names = {result["file"]: result["new_name"] for result in map(json.loads, f)}
+    os.remove(report_path)
+    
+    expected = ["2022-05-10_14-30-45.jpg"] + [f"2022-05-10_14-30-45_{i}.jpg" for i in range(1, 20)]
+    assert [new_names[name] for name in scan_order] == expected
+
+def test_rename_images_unknown_stage(sample_image_directory):
+    """Test that unknown pipeline stages are rejected."""
+    with pytest.raises(ValueError):
+        rename_images(sample_image_directory, workers={"upload": 2})
+
+def test_pipeline_sequenced_source():
+    """Test that ordered stages follow sequence numbers, not the feeding order."""
+    fed = []
+    seen = []
+    
+    def extract(item):
+        fed.append(item)
+        return item
+    
+    pipeline = Pipeline([("extract", extract, 1), ("resolve", seen.append, 1)], ordered=("resolve",))
+    pipeline.run(((item, item) for item in reversed(range(200))), sequenced=True)
+    
+    assert fed == list(reversed(range(200)))
+    assert seen == list(range(200))
+
+def test_sort_for_io(temp_dir):
+    """Test the read orders for scan, inode and extent scheduling."""
+    paths = []
+    for i in range(10):
+        path = os.path.join(temp_dir, f"IMG_{i:03d}.jpg")
+        with open(path, "wb") as f:
+            f.write(os.urandom(4096))
+        paths.append(path)
+    paths.reverse()
+    
+    assert sort_for_io(paths, "scan") == list(range(10))
+    inodes = [os.stat(path).st_ino for path in paths]
+    assert [inodes[index] for index in sort_for_io(paths, "inode")] == sorted(inodes)
+    
+    # Extents need file system support; without it extent order is inode order
+    offsets = [get_first_extent(path) for path in paths]
+    order = sort_for_io(paths, "extent")
+    assert sorted(order) == list(range(10))
+    if None not in offsets:
+        assert [offsets[index] for index in order] == sorted(offsets)
+    
+    assert get_first_extent(os.path.join(temp_dir, "missing.jpg")) is None
+    with pytest.raises(ValueError):
+        sort_for_io(paths, "random")
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_io_order_keeps_names_deterministic(mock_get_exif, temp_dir):
+    """Test that headers are read in inode order while names follow scan order."""
+    read_order = []
+    
+    def read_date(path, **kwargs):
+        read_order.append(os.path.basename(path))
+        return datetime(2022, 5, 10, 14, 30, 45)
+    
+    mock_get_exif.side_effect = read_date
+    for i in range(20):
+        open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "w").close()
+    
+    scan_order = os.listdir(temp_dir)
+    inodes = {name: os.stat(os.path.join(temp_dir, name)).st_ino for name in scan_order}
+    report_path = os.path.join(temp_dir, "..", os.path.basename(temp_dir) + ".jsonl")
+    stats = rename_images(temp_dir, report_path=report_path, io_order="inode", group_related=False)
+    
+    assert stats['renamed'] == 20
+    assert read_order == sorted(scan_order, key=inodes.get)
+    with open(report_path, encoding="utf-8") as f:
+        new_names = {result["file"]: result["new_name"] for result in map(json.loads, f)}
+    os.remove(report_path)
+    
+    expected = ["2022-05-10_14-30-45.jpg"] + [f"2022-05-10_14-30-45_{i}.jpg" for i in range(1, 20)]
+    assert [new_names[name] for name in scan_order] == expected
+
+def test_rename_images_unknown_io_order(sample_image_directory):
+    """Test that unknown I/O orders are rejected."""
+    with pytest.raises(ValueError):
+        rename_images(sample_image_directory, io_order="random")
+
+def test_concurrency_limit_fixed():
+    """Test that the base ConcurrencyLimit keeps its starting limit."""
+    limit = ConcurrencyLimit(initial=3, minimum=1, maximum=8)
+    for latency in (0.01, 1.0, 0.01):
+        assert limit.call(len, "abc") == 3
+        limit.acquire()
+        limit.release(latency)
+    assert limit.limit == 3
+
+def _run_windows(limit, latency, windows=300):
+    """Drive a LatencyLimit with windows of calls whose latency depends on the load."""
+    for _ in range(windows):
+        in_flight = limit.limit
+        for _ in range(in_flight):
+            limit.acquire()
+        for position in range(in_flight):
+            limit.release(latency(position, in_flight))
+
+def test_latency_limit_settles_at_server_capacity():
+    """Test that the limit grows until calls start queueing at the server."""
+    # The server handles 16 calls at a time, in rounds of 10 ms
+    limit = LatencyLimit(initial=1)
+    _run_windows(limit, lambda position, in_flight: 0.01 * (1 + position // 16))
+    assert 16 <= limit.limit <= 16 + 2 * limit.beta
+    
+    # Without queueing the limit grows to its maximum
+    limit = LatencyLimit(initial=1, maximum=32)
+    _run_windows(limit, lambda position, in_flight: 0.01)
+    assert limit.limit == 32
+    
+    # The server becomes ten times slower once more than 4 calls are in flight
+    _run_windows(limit, lambda position, in_flight: 0.01 * (1 + position // 4))
+    assert limit.limit <= 4 + 2 * limit.beta
+
+class LatencyShim:
+    """Stand-in for a network file system: every open is a round trip to a
+    server handling a limited number of requests at a time."""
+    
+    def __init__(self, latency, capacity):
+        self.latency = latency
+        self.slots = threading.Semaphore(capacity)
+        self.opens = 0
+    
+    def open(self, *args, **kwargs):
+        with self.slots:
+            time.sleep(self.latency)
+            self.opens += 1
+        return open(*args, **kwargs)
+
+def test_rename_images_network_mode_hides_latency(temp_dir):
+    """Test that network mode keeps many header reads in flight."""
+    for i in range(200):
+        image = Image.new("RGB", (8, 8))
+        exif = image.getexif()
+        exif[0x8769] = {0x9003: f"2022:05:10 14:{i // 60:02d}:{i % 60:02d}"}
+        image.save(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), exif=exif.tobytes())
+    
+    # 200 round trips of 10 ms take 2 seconds one at a time
+    shim = LatencyShim(latency=0.01, capacity=32)
+    started = time.monotonic()
+    with patch("imagerenamer.metadata.open", shim.open, create=True):
+        stats = rename_images(temp_dir, network=True)
+    elapsed = time.monotonic() - started
+    
+    assert stats["renamed"] == 200
+    # One open per file: the header and file status come from the same round trip
+    assert shim.opens == 200
+    assert stats["concurrency"]["fetch"] > NETWORK_MIN_IN_FLIGHT
+    assert elapsed < 1.0
+    assert os.path.exists(os.path.join(temp_dir, "2022-05-10_14-03-19.jpg"))
+
+def _run_throughput(limit, files_per_second, seconds=60):
+    """Drive a ThroughputLimit on a simulated clock; return the limits chosen."""
+    now = 0.0
+    history = []
+    while now < seconds:
+        workers = limit.limit
+        rate = files_per_second(workers)
+        for _ in range(workers):
+            limit.acquire()
+        for _ in range(workers):
+            now += 1 / rate
+            limit.release(workers / rate, now)
+        history.append(limit.limit)
+    return history
+
+def test_throughput_limit_climbs_to_the_knee():
+    """Test that the worker count settles where more workers stop helping."""
+    # A device that serves at most 8 reads at a time
+    history = _run_throughput(ThroughputLimit(), lambda workers: 100 * min(workers, 8))
+    recent = history[len(history) // 2:]
+    assert 5 <= sum(recent) / len(recent) <= 11
+    
+    # A card reader that only handles one read at a time
+    history = _run_throughput(ThroughputLimit(), lambda workers: 100)
+    recent = history[len(history) // 2:]
+    assert sum(recent) / len(recent) <= 3
+    
+    # Storage that scales with the number of readers
+    history = _run_throughput(ThroughputLimit(maximum=32), lambda workers: 100 * workers)
+    assert history[-1] == 32
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_auto_workers(mock_get_exif, temp_dir):
+    """Test that automatic worker counts are tuned and reported."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    for i in range(50):
+        open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "w").close()
+    
+    stats = rename_images(temp_dir, workers={"extract": "auto"})
+    
+    assert stats["renamed"] == 50
+    assert 1 <= stats["concurrency"]["extract"] <= 32
+    assert os.path.exists(os.path.join(temp_dir, "2022-05-10_14-30-45_49.jpg"))
+    
+    with pytest.raises(ValueError):
+        rename_images(temp_dir, workers={"extract": "many"})
+
+def test_pipeline_lanes_isolate_a_stalled_source():
+    """Test that a stalled lane does not take workers away from the others."""
+    card_released = threading.Event()
+    seen = []
+    
+    def extract(item):
+        if item[0] == "card":
+            # The card reader hangs until every SSD item went through
+            assert card_released.wait(5)
+        return item
+    
+    def resolve(item):
+        seen.append(item)
+        if sum(1 for lane, _ in seen if lane == "ssd") == 100:
+            card_released.set()
+        return item
+    
+    pipeline = Pipeline([("extract", extract, 2), ("resolve", resolve, 1)], queue_size=4,
+                        ordered=("resolve",))
+    pipeline.run_lanes({
+        "card": (("card", number) for number in range(20)),
+        "ssd": (("ssd", number) for number in range(100)),
+    })
+    
+    assert seen[:100] == [("ssd", number) for number in range(100)]
+    assert seen[100:] == [("card", number) for number in range(20)]
+
+@pytest.mark.skipif(not os.path.isdir("/dev/shm"), reason="needs a second file system")
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_device_lanes(mock_get_exif, temp_dir):
+    """Test that files on another device, reached through symlinks, get their own lane."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    other_device = tempfile.mkdtemp(dir="/dev/shm")
+    try:
+        if os.stat(other_device).st_dev == os.stat(temp_dir).st_dev:
+            pytest.skip("/dev/shm is on the same device")
+        for i in range(10):
+            open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "w").close()
+            target = os.path.join(other_device, f"CARD_{i:03d}.jpg")
+            open(target, "w").close()
+            os.symlink(target, os.path.join(temp_dir, f"CARD_{i:03d}.jpg"))
+        
+        scan_order = os.listdir(temp_dir)
+        report_path = os.path.join(temp_dir, "..", os.path.basename(temp_dir) + ".jsonl")
+        stats = rename_images(temp_dir, workers={"extract": "auto"}, report_path=report_path)
+    finally:
+        shutil.rmtree(other_device)
+    
+    assert stats["renamed"] == 20
+    assert len(stats["device_concurrency"]) == 2
+    assert all(levels["extract"] >= 1 for levels in stats["device_concurrency"].values())
+    
+    # Collision suffixes still follow scan order across devices
+    with open(report_path, encoding="utf-8") as f:
+        new_names = {result["file"]: result["new_name"] for result in map(json.loads, f)}
+    os.remove(report_path)
+    expected = ["2022-05-10_14-30-45.jpg"] + [f"2022-05-10_14-30-45_{i}.jpg" for i in range(1, 20)]
+    assert [new_names[name] for name in scan_order] == expected
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_folders(mock_get_exif, temp_dir):
+    """Test that several folders share a run with per-folder and total statistics."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    folders = [os.path.join(temp_dir, name) for name in ("a", "b")]
+    for count, folder in zip((3, 2), folders):
+        os.mkdir(folder)
+        for i in range(count):
+            open(os.path.join(folder, f"IMG_{i:03d}.jpg"), "w").close()
+    missing = os.path.join(temp_dir, "missing")
+    report_path = os.path.join(temp_dir, "report.jsonl")
+    
+    results = rename_folders(folders + [missing, folders[0]], workers={"extract": "auto"},
+                             report_path=report_path)
+    
+    assert list(results["folders"]) == folders + [missing]
+    assert results["folders"][folders[0]]["renamed"] == 3
+    assert results["folders"][folders[1]]["renamed"] == 2
+    assert results["folders"][missing]["error"] is True
+    assert results["total"]["renamed"] == 5
+    assert results["total"]["error"] is True
+    assert results["total"]["concurrency"]["extract"] >= 1
+    
+    # Collision suffixes are picked per folder
+    assert sorted(os.listdir(folders[1])) == ["2022-05-10_14-30-45.jpg", "2022-05-10_14-30-45_1.jpg"]
+    with open(report_path, encoding="utf-8") as f:
+        results = [json.loads(line) for line in f]
+    assert sorted(result["folder"] for result in results) == [folders[0]] * 3 + [folders[1]] * 2
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_organize(mock_get_exif, temp_dir):
+    """Test that files are moved into a date tree, creating each directory once."""
+    dates = [datetime(2022, 5, 10, 14, 30, 45), datetime(2022, 5, 10, 14, 30, 45),
+             datetime(2022, 5, 11, 9, 0, 0), datetime(2023, 1, 2, 3, 4, 5)]
+    mock_get_exif.side_effect = lambda path, *args, **kwargs: dates[int(os.path.basename(path)[4:7])]
+    for i in range(len(dates)):
+        open(os.path.join(temp_dir, f"IMG_{i:03d}.jpg"), "w").close()
+    # A file already in the tree takes the first name
+    os.makedirs(os.path.join(temp_dir, "2023", "01", "02"))
+    open(os.path.join(temp_dir, "2023", "01", "02", "2023-01-02_03-04-05.jpg"), "w").close()
+    report_path = os.path.join(temp_dir, "report.jsonl")
+    
+    with patch('imagerenamer.core.os.makedirs', wraps=os.makedirs) as mock_makedirs:
+        stats = rename_images(temp_dir, target_format="%Y/%m/%d", report_path=report_path,
+                              callback=lambda message: None)
+    
+    assert stats["renamed"] == 4
+    # Two new leaf directories (parents are made by makedirs recursing), none twice
+    created = [call.args[0] for call in mock_makedirs.call_args_list]
+    assert len(created) == len(set(created)) == 4
+    assert sorted(os.listdir(os.path.join(temp_dir, "2022", "05", "10"))) == [
+        "2022-05-10_14-30-45.jpg", "2022-05-10_14-30-45_1.jpg"
+    ]
+    assert os.listdir(os.path.join(temp_dir, "2022", "05", "11")) == ["2022-05-11_09-00-00.jpg"]
+    assert sorted(os.listdir(os.path.join(temp_dir, "2023", "01", "02"))) == [
+        "2023-01-02_03-04-05.jpg", "2023-01-02_03-04-05_1.jpg"
+    ]
+    with open(report_path, encoding="utf-8") as f:
+        new_names = {result["file"]: result["new_name"] for result in map(json.loads, f)}
+    assert new_names["IMG_002.jpg"] == os.path.join("2022", "05", "11", "2022-05-11_09-00-00.jpg")
+    
+    # Nothing is left to move on a second run
+    stats = rename_images(temp_dir, target_format="%Y/%m/%d", callback=lambda message: None)
+    assert stats["total"] == 0
+
+def test_rename_images_with_stale_name_index(temp_dir):
+    """Test that a file missing from a stale name index is never renamed over."""
+    with open(os.path.join(temp_dir, "IMG_20220101_100000.jpg"), "w") as f:
+        f.write("photo")
+    with open(os.path.join(temp_dir, "2022-01-01_10-00-00.jpg"), "w") as f:
+        f.write("precious")
+    
+    stats = rename_images(temp_dir, date_sources=("filename",), callback=lambda message: None,
+                          name_index={"IMG_20220101_100000.jpg"})
+    
+    assert stats["renamed"] == 0
+    assert stats["skipped"] == 2
+    with open(os.path.join(temp_dir, "2022-01-01_10-00-00.jpg")) as f:
+        assert f.read() == "precious"
+    with open(os.path.join(temp_dir, "IMG_20220101_100000.jpg")) as f:
+        assert f.read() == "photo"
+
+def test_rename_no_replace(temp_dir):
+    """Test renaming with and without hard links never replaces an existing file."""
+    source = os.path.join(temp_dir, "source.jpg")
+    target = os.path.join(temp_dir, "target.jpg")
+    other = os.path.join(temp_dir, "other.jpg")
+    with open(source, "w") as f:
+        f.write("source")
+    with open(other, "w") as f:
+        f.write("other")
+    
+    with pytest.raises(FileExistsError):
+        rename_no_replace(source, other)
+    rename_no_replace(source, target)
+    assert sorted(os.listdir(temp_dir)) == ["other.jpg", "target.jpg"]
+    
+    # File systems without hard links check for the target before renaming
+    no_links = OSError(errno.EPERM, "Operation not permitted")
+    with patch('imagerenamer.core.os.link', side_effect=no_links):
+        with pytest.raises(FileExistsError):
+            rename_no_replace(target, other)
+        rename_no_replace(target, source)
+    assert sorted(os.listdir(temp_dir)) == ["other.jpg", "source.jpg"]
+    with open(other) as f:
+        assert f.read() == "other"
+
+def test_move_file_across_devices(temp_dir):
+    """Test that a move across devices copies in the kernel, keeps times and removes the source."""
+    source = os.path.join(temp_dir, "source.jpg")
+    target = os.path.join(temp_dir, "target.jpg")
+    data = os.urandom(300000)
+    with open(source, "wb") as f:
+        f.write(data)
+    os.utime(source, (1600000000, 1600000000))
+    
+    def cross_device(src, dst, **kwargs):
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+    with patch('imagerenamer.core.os.link', side_effect=cross_device):
+        assert move_file(source, target) is True
+    
+    assert not os.path.exists(source)
+    with open(target, "rb") as f:
+        assert f.read() == data
+    assert os.stat(target).st_mtime == 1600000000
+    
+    # An existing file is never replaced
+    open(source, "w").close()
+    with patch('imagerenamer.core.os.link', side_effect=cross_device):
+        with pytest.raises(FileExistsError):
+            move_file(source, target)
+    assert os.path.exists(source) and os.path.getsize(target) == len(data)
+    assert move_file(source, os.path.join(temp_dir, "renamed.jpg")) is False
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_ingest_images(mock_get_exif, temp_dir):
+    """Test that ingest copies under the new names, hashing during the copy, and leaves the source alone."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    card = os.path.join(temp_dir, "card")
+    destination = os.path.join(temp_dir, "photos%")
+    os.mkdir(card)
+    contents = {}
+    for i in range(3):
+        contents[f"IMG_{i:03d}.jpg"] = os.urandom(100000 + i)
+        with open(os.path.join(card, f"IMG_{i:03d}.jpg"), "wb") as f:
+            f.write(contents[f"IMG_{i:03d}.jpg"])
+    report_path = os.path.join(temp_dir, "report.jsonl")
+    
+    with patch('imagerenamer.core.hash_file', wraps=hash_file) as mock_hash:
+        stats = ingest_images(card, destination, target_format="%Y/%m", report_path=report_path,
+                              workers={"apply": 3}, verify_copies=True, callback=lambda message: None)
+    
+    assert stats["renamed"] == 3
+    assert stats["bytes_copied"] == sum(len(data) for data in contents.values())
+    assert mock_hash.call_count == 3
+    assert sorted(os.listdir(card)) == sorted(contents)
+    with open(report_path, encoding="utf-8") as f:
+        results = [json.loads(line) for line in f]
+    for result in results:
+        assert result["status"] == "copied"
+        with open(os.path.join(destination, "2022", "05", os.path.basename(result["new_name"])), "rb") as f:
+            data = f.read()
+        assert data == contents[result["file"]]
+        assert result["sha256"] == hashlib.sha256(data).hexdigest()
+    
+    # A second ingest finds the names taken and adds suffixes instead of overwriting
+    stats = ingest_images(card, destination, target_format="%Y/%m", callback=lambda message: None)
+    assert stats["renamed"] == 3
+    assert len(os.listdir(os.path.join(destination, "2022", "05"))) == 6
+
+def test_ingest_images_verification_failure(temp_dir):
+    """Test that a copy which reads back differently is removed and reported."""
+    card = os.path.join(temp_dir, "card")
+    os.mkdir(card)
+    with open(os.path.join(card, "2022-05-10_14-30-45.jpg"), "wb") as f:
+        f.write(b"data")
+    destination = os.path.join(temp_dir, "photos")
+    messages = []
+    with patch('imagerenamer.core.hash_file', return_value="0" * 64):
+        stats = ingest_images(card, destination, date_sources=("filename",), verify_copies=True,
+                              callback=messages.append)
+    
+    assert stats["renamed"] == 0
+    assert stats["skipped"] == 1
+    assert os.listdir(destination) == []
+    assert any("does not match" in message for message in messages)
+    # The name is free again for the next attempt
+    stats = ingest_images(card, destination, date_sources=("filename",), callback=lambda message: None)
+    assert os.listdir(destination) == ["2022-05-10_14-30-45.jpg"]
+
+def test_copy_with_hash(temp_dir):
+    """Test that copy_with_hash never replaces an existing file."""
+    source = os.path.join(temp_dir, "source.jpg")
+    target = os.path.join(temp_dir, "target.jpg")
+    with open(source, "wb") as f:
+        f.write(b"x" * 3000000)
+    assert copy_with_hash(source, target) == (hashlib.sha256(b"x" * 3000000).hexdigest(), 3000000)
+    with pytest.raises(FileExistsError):
+        copy_with_hash(source, target)
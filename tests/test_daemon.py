@@ -0,0 +1,164 @@
+"""
+Tests for the renamer daemon and its Unix socket job API.
+"""
+
+import importlib
+import os
+import socket
+import socketserver
+import sys
+import threading
+import pytest
+from datetime import datetime
+from unittest.mock import patch
+from PIL import Image
+import imagerenamer.cli
+import imagerenamer.daemon
+from imagerenamer.daemon import RenamerDaemon, LRUCache, submit_job
+from imagerenamer.cli import main
+
+pytestmark = pytest.mark.skipif(not hasattr(socket, "AF_UNIX"), reason="Unix domain sockets required")
+
+@pytest.fixture
+def daemon(temp_dir):
+    """Run a daemon on a socket in a temporary directory."""
+    socket_path = os.path.join(temp_dir, "daemon.sock")
+    server = RenamerDaemon(socket_path)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+def test_lru_cache():
+    """Test that the cache forgets the least recently used entries."""
+    cache = LRUCache(max_size=2)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.get("a") == 1
+    cache["c"] = 3
+    
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert len(cache) == 2
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_submit_job_streams_progress_and_keeps_cache_warm(mock_get_exif, daemon, sample_image_directory):
+    """Test running jobs on the daemon and reusing its metadata cache."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    messages = []
+    
+    stats = submit_job(sample_image_directory, socket_path=daemon.socket_path,
+                       callback=messages.append, extensions=[".jpg"])
+    
+    assert stats["renamed"] == 3
+    assert stats["error"] is False
+    assert any(message.startswith("Renamed:") for message in messages)
+    assert mock_get_exif.call_count == 3
+    
+    # Verifying the renamed files is answered from the warm cache
+    stats = submit_job(sample_image_directory, socket_path=daemon.socket_path,
+                       callback=messages.append, extensions=[".jpg"], verify=True)
+    
+    assert stats["total"] == 3
+    assert mock_get_exif.call_count == 3
+
+def test_submit_job_date_sources_not_shared_through_cache(daemon, temp_dir):
+    """Test that a job with other date sources does not get a date cached by an earlier job."""
+    folder = os.path.join(temp_dir, "photos")
+    os.mkdir(folder)
+    exif = Image.Exif()
+    exif[0x8769] = {0x9003: "2022:05:10 14:30:45"}
+    Image.new("RGB", (10, 10)).save(os.path.join(folder, "IMG_20200101_000000.jpg"), exif=exif.tobytes())
+    
+    submit_job(folder, socket_path=daemon.socket_path, callback=lambda message: None,
+               date_sources=["filename"])
+    assert os.listdir(folder) == ["2020-01-01_00-00-00.jpg"]
+    
+    submit_job(folder, socket_path=daemon.socket_path, callback=lambda message: None,
+               date_sources=["metadata"], verify=True)
+    assert os.listdir(folder) == ["2022-05-10_14-30-45.jpg"]
+
+def test_submit_job_keeps_files_added_between_jobs(daemon, temp_dir):
+    """Test that a file added after a job is not overwritten by the next job's renames."""
+    folder = os.path.join(temp_dir, "photos")
+    os.mkdir(folder)
+    with open(os.path.join(folder, "IMG_20220101_100000.jpg"), "w") as f:
+        f.write("photo")
+    rename_images = imagerenamer.daemon.rename_images
+    
+    def rename_then_add(*args, **kwargs):
+        stats = rename_images(*args, **kwargs)
+        with open(os.path.join(folder, "2022-01-01.jpg"), "w") as f:
+            f.write("precious")
+        return stats
+    
+    with patch('imagerenamer.daemon.rename_images', side_effect=rename_then_add):
+        submit_job(folder, socket_path=daemon.socket_path, callback=lambda message: None,
+                   date_sources=["filename"])
+    submit_job(folder, socket_path=daemon.socket_path, callback=lambda message: None,
+               date_sources=["filename"], format_string="%Y-%m-%d")
+    
+    assert sorted(os.listdir(folder)) == ["2022-01-01.jpg", "2022-01-01_1.jpg"]
+    with open(os.path.join(folder, "2022-01-01.jpg")) as f:
+        assert f.read() == "precious"
+
+def test_submit_job_reuses_sandbox_processes(daemon, temp_dir):
+    """Test that jobs with the same timeout run the Pillow fallback in the same worker process."""
+    folder = os.path.join(temp_dir, "photos")
+    os.mkdir(folder)
+    Image.new("RGB", (10, 10)).save(os.path.join(folder, "IMG_001.jpg"))
+    
+    submit_job(folder, socket_path=daemon.socket_path, callback=lambda message: None, timeout=10)
+    workers = [process.pid for process, _ in daemon.sandboxes[10.0]._idle]
+    submit_job(folder, socket_path=daemon.socket_path, callback=lambda message: None, timeout=10,
+               verify=True)
+    
+    assert len(workers) == 1
+    assert [process.pid for process, _ in daemon.sandboxes[10.0]._idle] == workers
+
+def test_submit_job_reports_errors(daemon, sample_image_directory):
+    """Test that errors raised by a job are reported back to the client."""
+    with pytest.raises(RuntimeError) as excinfo:
+        submit_job(sample_image_directory, socket_path=daemon.socket_path,
+                   callback=lambda message: None, date_sources=["exiftool"])
+    
+    assert "Unknown date source" in str(excinfo.value)
+
+def test_submit_job_without_daemon(temp_dir):
+    """Test that submitting without a running daemon raises OSError."""
+    with pytest.raises(OSError):
+        submit_job(temp_dir, socket_path=os.path.join(temp_dir, "missing.sock"))
+
+def test_daemon_refuses_second_instance(daemon):
+    """Test that a second daemon does not take over a live socket."""
+    with pytest.raises(OSError):
+        RenamerDaemon(daemon.socket_path)
+
+def test_cli_main_with_use_daemon(daemon, sample_image_directory):
+    """Test that --use-daemon submits the job to the daemon."""
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory,
+                                    '--use-daemon', '--socket', daemon.socket_path]):
+        assert main() == 0
+    
+    renamed = [f for f in os.listdir(sample_image_directory) if f.endswith(".jpg")]
+    assert len(renamed) == 3
+    assert all(name[4] == "-" for name in renamed)
+
+def test_daemon_without_unix_sockets(monkeypatch):
+    """Test that the CLI loads where Unix domain sockets are missing and the daemon refuses to run."""
+    monkeypatch.delattr(socketserver, "UnixStreamServer")
+    try:
+        daemon_module = importlib.reload(imagerenamer.daemon)
+        importlib.reload(imagerenamer.cli)
+        assert daemon_module.daemon_available() is False
+        with pytest.raises(OSError):
+            daemon_module.RenamerDaemon("daemon.sock")
+        with pytest.raises(OSError):
+            daemon_module.submit_job(".", socket_path="daemon.sock")
+    finally:
+        monkeypatch.undo()
+        importlib.reload(imagerenamer.daemon)
+        importlib.reload(imagerenamer.cli)
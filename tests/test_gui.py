@@ -94,23 +94,23 @@ class TestFileFilter:
     def test_media_extensions_constants(self):
         """Test that the media extension constants are defined correctly."""
         # The constants should be defined in the module
-        assert hasattr(gui, 'image_extensions')
+        assert hasattr(gui, 'IMAGE_EXTENSIONS')
         
         # Define expected extension lists - these should match what's in the code
         expected_image_extensions = (".jpg", ".jpeg", ".png", ".nef", ".cr2", ".arw")
         expected_video_extensions = (".mp4", ".mov", ".avi", ".mkv", ".wmv", ".m4v", ".3gp", ".webm", ".flv")
         
         # Patch the module with our expected values for testing
-        with patch.object(gui, 'image_extensions', expected_image_extensions):
-            with patch.object(gui, 'video_extensions', expected_video_extensions):
+        with patch.object(gui, 'IMAGE_EXTENSIONS', expected_image_extensions):
+            with patch.object(gui, 'VIDEO_EXTENSIONS', expected_video_extensions):
                 # The filter function we want to test
                 def file_filter(extensions):
                     return lambda filename: filename.lower().endswith(extensions)
                 
                 # Create filters for different extension sets
-                image_filter = file_filter(gui.image_extensions)
-                video_filter = file_filter(gui.video_extensions)
-                all_filter = file_filter(gui.image_extensions + gui.video_extensions)
+                image_filter = file_filter(gui.IMAGE_EXTENSIONS)
+                video_filter = file_filter(gui.VIDEO_EXTENSIONS)
+                all_filter = file_filter(gui.IMAGE_EXTENSIONS + gui.VIDEO_EXTENSIONS)
                 
                 # Test the filters
                 assert image_filter("test.jpg")
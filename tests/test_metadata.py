@@ -0,0 +1,443 @@
+"""
+Tests for the header-only metadata reads of the Image Renamer.
+"""
+
+import json
+import os
+import struct
+import time
+import zlib
+from datetime import datetime, timedelta, timezone
+from unittest.mock import patch, MagicMock
+import pytest
+from PIL import Image
+from PIL.PngImagePlugin import PngInfo
+from imagerenamer.core import get_exif_creation_date, rename_images, index_xmp_sidecars, _pillow_exif_date
+from imagerenamer.metadata import (
+    HeaderFile, prefetch_headers, read_exif_date, ProcessSandbox, MetadataLimitError, MetadataTimeout,
+    parse_date_text, parse_xmp_date, read_xmp_date, HANDLES, HEADER_SIZE
+)
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def create_exif_image(path, date="2021:03:04 05:06:07", size=(1500, 1500)):
+    """Create a noisy (hence large) JPEG with a DateTimeOriginal tag."""
+    exif = Image.Exif()
+    exif[0x8769] = {0x9003: date}
+    Image.effect_noise(size, 50).convert("RGB").save(path, exif=exif.tobytes())
+    return path
+
+def create_endless_ifd_image(path):
+    """Create a JPEG whose Exif segment claims an IFD with 65535 entries."""
+    tiff = b"II" + struct.pack("<HI", 42, 8) + struct.pack("<H", 0xFFFF) + b"\0" * 1000
+    segment = b"Exif\0\0" + tiff
+    with open(path, "wb") as f:
+        f.write(b"\xff\xd8\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment + b"\xff\xd9")
+    return path
+
+def _box(box_type, payload, version=None):
+    """Build an ISO-BMFF box; full boxes get a version and zero flags."""
+    if version is not None:
+        payload = bytes([version, 0, 0, 0]) + payload
+    return struct.pack(">I4s", len(payload) + 8, box_type) + payload
+
+def create_heif_image(path, brand=b"heic", date="2021:03:04 05:06:07", image_size=1024 * 1024):
+    """Create a HEIF file whose Exif item is stored after a large block of image data."""
+    exif = Image.Exif()
+    exif[0x8769] = {0x9003: date}
+    # The Exif item starts with the offset of the TIFF header past "Exif\0\0"
+    item = struct.pack(">I", 6) + exif.tobytes()
+    
+    infe = [_box(b"infe", struct.pack(">HH4s", item_id, 0, item_type) + b"\0", version=2)
+            for item_id, item_type in ((1, b"hvc1"), (2, b"Exif"))]
+    iinf = _box(b"iinf", struct.pack(">H", 2) + b"".join(infe), version=0)
+    ftyp = _box(b"ftyp", brand + b"\0\0\0\0" + b"mif1" + brand)
+    
+    def meta_box(image_offset, exif_offset):
+        # Version 1 item locations, 4-byte offsets and lengths, no base offset
+        iloc = struct.pack(">BBH", 0x44, 0x00, 2)
+        iloc += struct.pack(">HHHHII", 1, 0, 0, 1, image_offset, image_size)
+        iloc += struct.pack(">HHHHII", 2, 0, 0, 1, exif_offset, len(item))
+        return _box(b"meta", _box(b"hdlr", b"\0" * 4 + b"pict" + b"\0" * 13, version=0) + iinf
+                    + _box(b"iloc", iloc, version=1), version=0)
+    
+    data_offset = len(ftyp) + len(meta_box(0, 0)) + 8
+    meta = meta_box(data_offset, data_offset + image_size)
+    mdat = _box(b"mdat", os.urandom(image_size) + item)
+    with open(path, "wb") as f:
+        f.write(ftyp + meta + mdat)
+    return path
+
+def test_header_file_reads(temp_dir):
+    """Test that the header is served from memory and the rest read on demand."""
+    path = os.path.join(temp_dir, "data.bin")
+    data = os.urandom(HEADER_SIZE + 1000)
+    with open(path, "wb") as f:
+        f.write(data)
+    
+    with HeaderFile(path) as reader:
+        assert reader.bytes_read == HEADER_SIZE
+        assert reader.read(10) == data[:10]
+        reader.seek(HEADER_SIZE - 5)
+        assert reader.read(10) == data[HEADER_SIZE - 5:HEADER_SIZE + 5]
+        assert reader.tell() == HEADER_SIZE + 5
+        assert reader.bytes_read == HEADER_SIZE + 5
+        reader.seek(-3, os.SEEK_END)
+        assert reader.read() == data[-3:]
+        assert reader.read(10) == b""
+
+@pytest.mark.skipif(not hasattr(os, "posix_fadvise"), reason="posix_fadvise not available")
+def test_header_file_drops_cache(temp_dir):
+    """Test that only the ranges read are dropped from the page cache."""
+    path = os.path.join(temp_dir, "data.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(2 * HEADER_SIZE))
+    
+    with patch("os.posix_fadvise") as mock_fadvise:
+        with HeaderFile(path, header_size=4096, drop_cache=True) as reader:
+            reader.seek(HEADER_SIZE)
+            reader.read(100)
+    
+    advice = [call.args[1:] for call in mock_fadvise.call_args_list]
+    assert (0, 0, os.POSIX_FADV_RANDOM) in advice
+    assert (0, 4096, os.POSIX_FADV_DONTNEED) in advice
+    assert (HEADER_SIZE, 100, os.POSIX_FADV_DONTNEED) in advice
+
+@pytest.mark.skipif(not hasattr(os, "posix_fadvise"), reason="posix_fadvise not available")
+def test_header_file_keeps_readahead(temp_dir):
+    """Test that readahead is left on unless the cache is dropped."""
+    path = os.path.join(temp_dir, "data.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(2 * HEADER_SIZE))
+    
+    with patch("os.posix_fadvise") as mock_fadvise:
+        with HeaderFile(path, header_size=4096) as reader:
+            reader.seek(HEADER_SIZE)
+            reader.read(100)
+    
+    assert mock_fadvise.call_count == 0
+
+@pytest.mark.skipif(not hasattr(os, "posix_fadvise"), reason="posix_fadvise not available")
+def test_prefetch_headers(temp_dir):
+    """Test that headers are prefetched and missing files are ignored."""
+    path = create_exif_image(os.path.join(temp_dir, "IMG_001.jpg"), size=(10, 10))
+    
+    with patch("os.posix_fadvise") as mock_fadvise:
+        prefetch_headers([path, os.path.join(temp_dir, "missing.jpg")])
+    
+    assert mock_fadvise.call_count == 1
+    assert mock_fadvise.call_args.args[1:] == (0, HEADER_SIZE, os.POSIX_FADV_WILLNEED)
+
+def test_get_exif_creation_date_reads_header_only(temp_dir):
+    """Test that the date of a large JPEG is found in the header alone."""
+    path = create_exif_image(os.path.join(temp_dir, "IMG_001.jpg"))
+    assert os.path.getsize(path) > 4 * HEADER_SIZE
+    
+    io_stats = {}
+    assert get_exif_creation_date(path, io_stats, drop_cache=True) == datetime(2021, 3, 4, 5, 6, 7)
+    assert io_stats["bytes_read"] == HEADER_SIZE
+
+def test_rename_images_fadvise_prefetches_in_batches(temp_dir):
+    """Test that fadvise mode prefetches the headers of files that will be read."""
+    for i in range(3):
+        create_exif_image(os.path.join(temp_dir, f"IMG_00{i}.jpg"), size=(10, 10))
+    open(os.path.join(temp_dir, "2021-03-04_05-06-07_9.jpg"), "w").close()
+    
+    with patch("imagerenamer.core.prefetch_headers") as mock_prefetch:
+        stats = rename_images(temp_dir, fadvise=True)
+    
+    assert stats["renamed"] == 3
+    prefetched = [os.path.basename(path) for call in mock_prefetch.call_args_list for path in call.args[0]]
+    # Names that already match the format are never read, so never prefetched
+    assert sorted(prefetched) == ["IMG_000.jpg", "IMG_001.jpg", "IMG_002.jpg"]
+
+def test_read_exif_date(temp_dir):
+    """Test the bounded EXIF walker on good, plain and hostile files."""
+    path = create_exif_image(os.path.join(temp_dir, "IMG_001.jpg"), size=(10, 10))
+    with HeaderFile(path) as reader:
+        assert read_exif_date(reader) == datetime(2021, 3, 4, 5, 6, 7)
+    
+    plain = os.path.join(temp_dir, "plain.png")
+    Image.new("RGB", (10, 10)).save(plain)
+    with HeaderFile(plain) as reader:
+        assert read_exif_date(reader) is None
+    
+    hostile = create_endless_ifd_image(os.path.join(temp_dir, "hostile.jpg"))
+    with HeaderFile(hostile) as reader:
+        with pytest.raises(MetadataLimitError):
+            read_exif_date(reader)
+
+def test_header_file_byte_limit(temp_dir):
+    """Test that reads past the byte limit are refused."""
+    path = os.path.join(temp_dir, "data.bin")
+    with open(path, "wb") as f:
+        f.write(os.urandom(4 * HEADER_SIZE))
+    
+    with HeaderFile(path, max_bytes=2 * HEADER_SIZE) as reader:
+        reader.read(HEADER_SIZE + 10)
+        with pytest.raises(MetadataLimitError):
+            reader.read()
+
+def test_pillow_fallback_byte_limit(temp_dir):
+    """Test that Pillow decoding past the byte limit finds no date instead of failing the file."""
+    path = os.path.join(temp_dir, "noise.png")
+    Image.effect_noise((500, 500), 50).convert("RGB").save(path)
+    
+    with HeaderFile(path, max_bytes=2 * HEADER_SIZE) as reader:
+        assert _pillow_exif_date(reader) is None
+
+def test_process_sandbox_deadline():
+    """Test that a call overrunning its deadline is killed without blocking the next one."""
+    with ProcessSandbox(timeout=1.0, processes=1) as sandbox:
+        started = time.monotonic()
+        with pytest.raises(MetadataTimeout):
+            sandbox.call(time.sleep, 30)
+        assert time.monotonic() - started < 10
+        assert sandbox.call(len, "abc") == 3
+        with pytest.raises(ValueError):
+            sandbox.call(int, "not a number")
+
+def test_process_sandbox_stops_worker_when_send_fails():
+    """Test that a worker whose call could not be sent is stopped instead of leaked."""
+    with ProcessSandbox(timeout=10.0, processes=1) as sandbox:
+        assert sandbox.call(len, "abc") == 3
+        process, _ = sandbox._idle[0]
+        with pytest.raises(Exception):
+            sandbox.call(len, lambda: None)
+        assert not process.is_alive()
+        assert sandbox._idle == []
+        assert sandbox.call(len, "abc") == 3
+
+def test_get_exif_creation_date_sends_only_pillow_formats_to_sandbox(temp_dir):
+    """Test that files Pillow has no plugin for never make a round trip to the sandbox."""
+    video = os.path.join(temp_dir, "clip.mp4")
+    with open(video, "wb") as f:
+        f.write(b"\x00\x00\x00\x18ftypmp42" + os.urandom(1000))
+    bitmap = os.path.join(temp_dir, "scan.bmp")
+    Image.new("RGB", (10, 10)).save(bitmap)
+    sandbox = MagicMock()
+    sandbox.call.return_value = (None, 0)
+    
+    assert get_exif_creation_date(video, sandbox=sandbox) is None
+    assert sandbox.call.call_count == 0
+    assert get_exif_creation_date(bitmap, sandbox=sandbox) is None
+    assert sandbox.call.call_count == 1
+
+def test_rename_images_quarantines_hostile_files(temp_dir):
+    """Test that a hostile file is quarantined while the rest of the batch is renamed."""
+    create_exif_image(os.path.join(temp_dir, "IMG_001.jpg"), size=(10, 10))
+    create_endless_ifd_image(os.path.join(temp_dir, "IMG_002.jpg"))
+    Image.new("RGB", (10, 10)).save(os.path.join(temp_dir, "IMG_003.png"))
+    report_path = os.path.join(temp_dir, "..", os.path.basename(temp_dir) + ".jsonl")
+    
+    try:
+        stats = rename_images(temp_dir, timeout=10, report_path=report_path)
+        with open(report_path, encoding="utf-8") as f:
+            results = {result["file"]: result for result in map(json.loads, f)}
+    finally:
+        os.remove(report_path)
+    
+    assert stats["renamed"] == 2
+    assert stats["quarantined"] == 1
+    assert results["IMG_002.jpg"]["status"] == "quarantined"
+    assert "IFD entries" in results["IMG_002.jpg"]["reason"]
+    assert "2021-03-04_05-06-07.jpg" in os.listdir(temp_dir)
+
+def create_dated_images(folder, count):
+    """Write count small JPEGs, each with its own DateTimeOriginal."""
+    template = create_exif_image(os.path.join(folder, "template.jpg"), "2021:01:01 00:00:00", (8, 8))
+    with open(template, "rb") as f:
+        data = f.read()
+    os.remove(template)
+    for i in range(count):
+        date = f"2021:01:01 {i // 3600:02d}:{i // 60 % 60:02d}:{i % 60:02d}".encode()
+        with open(os.path.join(folder, f"IMG_{i:05d}.jpg"), "wb") as f:
+            f.write(data.replace(b"2021:01:01 00:00:00", date))
+
+@pytest.mark.skipif(resource is None or not os.path.isdir("/proc/self/fd"),
+                    reason="needs RLIMIT_NOFILE and /proc")
+def test_rename_images_under_low_descriptor_limit(temp_dir):
+    """Test that many parallel readers stay within a low RLIMIT_NOFILE."""
+    create_dated_images(temp_dir, 2000)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    # Room for what is open already plus a few dozen descriptors, fewer than the workers need
+    low = len(os.listdir("/proc/self/fd")) + 48
+    resource.setrlimit(resource.RLIMIT_NOFILE, (low, hard))
+    HANDLES.resize()
+    try:
+        stats = rename_images(temp_dir, create_backup=True, callback=lambda message: None,
+                              workers={"extract": 64, "apply": 16})
+        peak, size = HANDLES.peak, HANDLES.size
+    finally:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (soft, hard))
+        HANDLES.resize()
+    
+    assert stats["renamed"] == 2000
+    assert peak <= size < low
+    assert HANDLES.in_use == 0
+    assert len(os.listdir(os.path.join(temp_dir, "backup"))) == 2000
+
+def test_read_exif_date_heif(temp_dir):
+    """Test that HEIF and AVIF dates come from the Exif item's byte range alone."""
+    for brand, name in ((b"heic", "IMG_001.HEIC"), (b"avif", "IMG_002.avif")):
+        path = create_heif_image(os.path.join(temp_dir, name), brand)
+        with HeaderFile(path) as reader:
+            assert read_exif_date(reader) == datetime(2021, 3, 4, 5, 6, 7)
+            # The header plus the Exif item, none of the image data
+            assert reader.bytes_read < HEADER_SIZE + 1024
+    
+    stats = rename_images(temp_dir, date_sources=("metadata",))
+    assert stats["renamed"] == 2
+    assert sorted(os.listdir(temp_dir)) == ["2021-03-04_05-06-07.avif", "2021-03-04_05-06-07.heic"]
+
+def create_xmp_packet(create_date="2020-01-01T00:00:00", date_created="2021-03-04T05:06:07"):
+    """Build an XMP packet like the ones Lightroom writes."""
+    return (
+        '<?xpacket begin="\ufeff" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF '
+        'xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">'
+        '<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/" '
+        'xmlns:photoshop="http://ns.adobe.com/photoshop/1.0/" '
+        f'xmp:CreateDate="{create_date}">'
+        f'<photoshop:DateCreated>{date_created}</photoshop:DateCreated>'
+        '</rdf:Description></rdf:RDF></x:xmpmeta>\n<?xpacket end="w"?>'
+    ).encode("utf-8")
+
+def _png_chunk(chunk_type, data):
+    return struct.pack(">I4s", len(data), chunk_type) + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+def test_parse_date_text():
+    """Test the date formats found in PNG text chunks and XMP."""
+    offset = timezone(timedelta(hours=1))
+    assert parse_date_text("2021-03-04T05:06:07+01:00") == datetime(2021, 3, 4, 5, 6, 7, tzinfo=offset)
+    assert parse_date_text("2021-03-04T05:06:07.25Z") == \
+        datetime(2021, 3, 4, 5, 6, 7, 250000, tzinfo=timezone.utc)
+    assert parse_date_text("2021:03:04 05:06:07") == datetime(2021, 3, 4, 5, 6, 7)
+    assert parse_date_text("2021-03-04") == datetime(2021, 3, 4)
+    utc = datetime(2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc)
+    assert parse_date_text("Thu, 04 Mar 2021 05:06:07 GMT") == utc.astimezone().replace(tzinfo=None)
+    assert parse_date_text("yesterday") is None
+    
+    assert parse_xmp_date(create_xmp_packet()) == datetime(2021, 3, 4, 5, 6, 7)
+
+def test_read_exif_date_png(temp_dir):
+    """Test that PNG dates come from the chunks before the image data, by priority."""
+    path = os.path.join(temp_dir, "screenshot.png")
+    info = PngInfo()
+    info.add_text("Creation Time", "2021-03-04 05:06:07")
+    info.add_itxt("XML:com.adobe.xmp", create_xmp_packet().decode("utf-8"), zip=True)
+    Image.effect_noise((1500, 1500), 50).convert("RGB").save(path, pnginfo=info)
+    with HeaderFile(path) as reader:
+        assert read_exif_date(reader) == datetime(2021, 3, 4, 5, 6, 7)
+        assert reader.bytes_read == HEADER_SIZE
+    
+    # eXIf wins over everything else
+    exif = Image.Exif()
+    exif[0x8769] = {0x9003: "2019:02:03 04:05:06"}
+    Image.new("RGB", (10, 10)).save(path, pnginfo=info, exif=exif.tobytes())
+    with HeaderFile(path) as reader:
+        assert read_exif_date(reader) == datetime(2019, 2, 3, 4, 5, 6)
+    
+    # With nothing else, the last modification time of tIME
+    Image.new("RGB", (10, 10)).save(path)
+    with open(path, "rb") as f:
+        data = f.read()
+    header_end = data.index(b"IDAT") - 4
+    with open(path, "wb") as f:
+        f.write(data[:header_end] + _png_chunk(b"tIME", struct.pack(">HBBBBB", 2021, 3, 4, 5, 6, 7))
+                + data[header_end:])
+    with HeaderFile(path) as reader:
+        expected = datetime(2021, 3, 4, 5, 6, 7, tzinfo=timezone.utc).astimezone().replace(tzinfo=None)
+        assert read_exif_date(reader) == expected
+
+def test_get_exif_creation_date_png_without_date(temp_dir):
+    """Test that a PNG without a date is not handed to Pillow, which would decode it."""
+    path = os.path.join(temp_dir, "screenshot.png")
+    Image.effect_noise((300, 300), 50).convert("RGB").save(path)
+    assert os.path.getsize(path) > 2 * HEADER_SIZE
+    
+    io_stats = {}
+    with patch('imagerenamer.core._pillow_exif_date') as mock_pillow:
+        assert get_exif_creation_date(path, io_stats) is None
+    mock_pillow.assert_not_called()
+    assert io_stats["bytes_read"] == HEADER_SIZE
+
+def test_read_xmp_date(temp_dir):
+    """Test that XMP packets are found in JPEG APP1 segments and by a bounded scan."""
+    packet = create_xmp_packet()
+    jpeg = os.path.join(temp_dir, "edited.jpg")
+    Image.new("RGB", (10, 10)).save(jpeg)
+    with open(jpeg, "rb") as f:
+        data = f.read()
+    segment = b"http://ns.adobe.com/xap/1.0/\0" + packet
+    with open(jpeg, "wb") as f:
+        f.write(data[:2] + b"\xff\xe1" + struct.pack(">H", len(segment) + 2) + segment + data[2:])
+    with HeaderFile(jpeg) as reader:
+        assert read_xmp_date(reader) == datetime(2021, 3, 4, 5, 6, 7)
+    
+    # Packets elsewhere are found by scanning, within the scan limit only
+    video = os.path.join(temp_dir, "clip.mp4")
+    with open(video, "wb") as f:
+        f.write(os.urandom(3 * HEADER_SIZE + 5) + packet + os.urandom(1000))
+    with HeaderFile(video) as reader:
+        assert read_xmp_date(reader) == datetime(2021, 3, 4, 5, 6, 7)
+    with HeaderFile(video) as reader:
+        assert read_xmp_date(reader, max_bytes=2 * HEADER_SIZE) is None
+        assert reader.bytes_read == 2 * HEADER_SIZE
+    
+    # Broken packets keep what was found before the error
+    assert parse_xmp_date(packet[:packet.index(b"<photoshop")] + b"<<<") == datetime(2020, 1, 1)
+
+def test_rename_images_xmp_sidecars(temp_dir):
+    """Test that dates come from Lightroom and darktable style sidecars."""
+    for name in ("IMG_001.jpg", "IMG_002.jpg", "IMG_003.jpg"):
+        Image.new("RGB", (10, 10)).save(os.path.join(temp_dir, name))
+    with open(os.path.join(temp_dir, "IMG_001.xmp"), "wb") as f:
+        f.write(create_xmp_packet(date_created="2021-03-04T05:06:07"))
+    with open(os.path.join(temp_dir, "IMG_002.JPG.xmp"), "wb") as f:
+        f.write(create_xmp_packet(date_created="2022-01-02T03:04:05"))
+    assert index_xmp_sidecars(os.listdir(temp_dir)) == {"img_001": "IMG_001.xmp",
+                                                        "img_002.jpg": "IMG_002.JPG.xmp"}
+    
+    stats = rename_images(temp_dir, date_sources=("xmp",))
+    
+    assert stats["renamed"] == 2
+    assert sorted(os.listdir(temp_dir)) == [
+        "2021-03-04_05-06-07.jpg", "2021-03-04_05-06-07.xmp", "2022-01-02_03-04-05.jpg",
+        "2022-01-02_03-04-05.jpg.xmp", "IMG_003.jpg",
+    ]
+
+def create_burst_image(path, subsec, offset="+02:00"):
+    """Create a small JPEG with the date, fraction of a second and offset of a burst frame."""
+    exif = Image.Exif()
+    exif[0x8769] = {0x9003: "2021:03:04 05:06:07", 0x9291: subsec, 0x9011: offset}
+    Image.new("RGB", (8, 8)).save(path, exif=exif.tobytes())
+    return path
+
+def test_read_exif_date_subsec_and_offset(temp_dir):
+    """Test that the fraction of a second and the offset come with the date."""
+    path = create_burst_image(os.path.join(temp_dir, "burst.jpg"), "25")
+    with HeaderFile(path) as reader:
+        date = read_exif_date(reader)
+    assert date == datetime(2021, 3, 4, 5, 6, 7, 250000, tzinfo=timezone(timedelta(hours=2)))
+
+def test_rename_images_burst_milliseconds(temp_dir):
+    """Test that burst frames within one second get distinct names from %L, in UTC with utc."""
+    for index, subsec in enumerate(("125", "500", "875")):
+        create_burst_image(os.path.join(temp_dir, f"IMG_{index}.jpg"), subsec)
+    
+    stats = rename_images(temp_dir, format_string="%Y%m%d_%H%M%S_%L", callback=lambda message: None)
+    assert stats["renamed"] == 3
+    assert sorted(os.listdir(temp_dir)) == [
+        "20210304_050607_125.jpg", "20210304_050607_500.jpg", "20210304_050607_875.jpg"
+    ]
+    
+    stats = rename_images(temp_dir, format_string="%Y%m%d_%H%M%S_%L%z", verify=True, utc=True,
+                          callback=lambda message: None)
+    assert stats["renamed"] == 3
+    assert sorted(os.listdir(temp_dir)) == [
+        "20210304_030607_125+0000.jpg", "20210304_030607_500+0000.jpg", "20210304_030607_875+0000.jpg"
+    ]
@@ -0,0 +1,85 @@
+"""
+Tests for the Prometheus metrics export of the Image Renamer.
+"""
+
+import os
+import sys
+import urllib.request
+from datetime import datetime
+from unittest.mock import patch
+from imagerenamer.core import rename_images
+from imagerenamer.metrics import Metrics, MetricsExporter
+from imagerenamer.cli import main
+
+def test_metrics_render():
+    """Test rendering counters and histograms in the text exposition format."""
+    metrics = Metrics(buckets=(0.01, 0.1))
+    metrics.inc("imagerenamer_files_processed_total", result="renamed")
+    metrics.inc("imagerenamer_files_processed_total", 2, result="renamed")
+    metrics.inc("imagerenamer_errors_total", type='Bad"Error')
+    metrics.observe("imagerenamer_extraction_seconds", 0.05, format="jpg")
+    metrics.observe("imagerenamer_extraction_seconds", 0.5, format="jpg")
+    
+    text = metrics.render()
+    
+    assert "# TYPE imagerenamer_files_processed_total counter" in text
+    assert 'imagerenamer_files_processed_total{result="renamed"} 3' in text
+    assert 'imagerenamer_errors_total{type="Bad\\"Error"} 1' in text
+    assert "# TYPE imagerenamer_extraction_seconds histogram" in text
+    assert 'imagerenamer_extraction_seconds_bucket{format="jpg",le="0.01"} 0' in text
+    assert 'imagerenamer_extraction_seconds_bucket{format="jpg",le="0.1"} 1' in text
+    assert 'imagerenamer_extraction_seconds_bucket{format="jpg",le="+Inf"} 2' in text
+    assert 'imagerenamer_extraction_seconds_count{format="jpg"} 2' in text
+    assert text.endswith("\n")
+
+@patch('imagerenamer.core.get_exif_creation_date')
+def test_rename_images_records_metrics(mock_get_exif, sample_image_directory):
+    """Test that a run records processed files, timings and resolved collisions."""
+    mock_get_exif.return_value = datetime(2022, 5, 10, 14, 30, 45)
+    metrics = Metrics()
+    
+    rename_images(sample_image_directory, metrics=metrics)
+    
+    assert metrics.get("imagerenamer_files_processed_total", result="renamed") == 3
+    # All three files share a timestamp, so two needed a suffix
+    assert metrics.get("imagerenamer_collisions_resolved_total") == 2
+    assert 'imagerenamer_extraction_seconds_count{format="jpg"} 3' in metrics.render()
+
+@patch('imagerenamer.core.rename_no_replace')
+def test_rename_images_records_errors(mock_rename, sample_image_directory):
+    """Test that rename errors are counted by exception type."""
+    mock_rename.side_effect = PermissionError("Permission denied")
+    metrics = Metrics()
+    
+    rename_images(sample_image_directory, metrics=metrics)
+    
+    assert metrics.get("imagerenamer_errors_total", type="PermissionError") == 3
+    assert metrics.get("imagerenamer_files_processed_total", result="error") == 3
+
+def test_metrics_exporter_textfile_and_http(temp_dir):
+    """Test exporting metrics to a file and over HTTP."""
+    metrics = Metrics()
+    path = os.path.join(temp_dir, "imagerenamer.prom")
+    
+    with MetricsExporter(metrics, path=path, port=0, interval=0.01) as exporter:
+        metrics.inc("imagerenamer_bytes_read_total", 1024)
+        with urllib.request.urlopen(f"http://127.0.0.1:{exporter.port}/metrics") as response:
+            body = response.read().decode("utf-8")
+        assert "imagerenamer_bytes_read_total 1024" in body
+    
+    with open(path, encoding="utf-8") as f:
+        assert "imagerenamer_bytes_read_total 1024" in f.read()
+    assert os.listdir(temp_dir) == ["imagerenamer.prom"]
+
+def test_cli_main_with_metrics_file(sample_image_directory):
+    """Test that --metrics-file writes the metrics of the run."""
+    path = os.path.join(sample_image_directory, "..", os.path.basename(sample_image_directory) + ".prom")
+    try:
+        with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--metrics-file', path]):
+            assert main() == 0
+        
+        with open(path, encoding="utf-8") as f:
+            text = f.read()
+        assert 'imagerenamer_files_processed_total{result="renamed"} 3' in text
+    finally:
+        os.remove(path)
@@ -0,0 +1,138 @@
+"""
+Tests for the inotify watch mode of the Image Renamer.
+"""
+
+import os
+import sys
+import struct
+import threading
+import time
+import pytest
+from unittest.mock import patch
+from PIL import Image
+from imagerenamer.watch import watch_folder, parse_events, IN_CLOSE_WRITE, IN_MOVED_TO
+from imagerenamer.cli import main
+
+linux_only = pytest.mark.skipif(not sys.platform.startswith("linux"), reason="inotify is Linux only")
+
+def wait_for(condition, timeout=5.0):
+    """Poll until condition() is true or the timeout expires."""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if condition():
+            return True
+        time.sleep(0.02)
+    return False
+
+def test_parse_events():
+    """Test parsing raw inotify events."""
+    data = struct.pack("iIII", 1, IN_CLOSE_WRITE, 0, 16) + b"IMG_001.jpg".ljust(16, b"\0")
+    data += struct.pack("iIII", 1, IN_MOVED_TO, 7, 0)
+    
+    assert parse_events(data) == [(IN_CLOSE_WRITE, "IMG_001.jpg"), (IN_MOVED_TO, "")]
+
+@linux_only
+def test_watch_folder_renames_new_files(temp_dir):
+    """Test that files written to a watched folder are renamed once they settle."""
+    open(os.path.join(temp_dir, "IMG_20220101_101010.jpg"), "w").close()
+    
+    messages = []
+    stop = threading.Event()
+    result = {}
+    
+    def run():
+        result["stats"] = watch_folder(temp_dir, callback=messages.append, settle_time=0.05,
+                                       stop_event=stop, date_sources=("filename", "stat"))
+    
+    watcher = threading.Thread(target=run)
+    watcher.start()
+    try:
+        # The initial scan handles files that were already there
+        assert wait_for(lambda: any("Watching" in message for message in messages))
+        assert os.path.exists(os.path.join(temp_dir, "2022-01-01_10-10-10.jpg"))
+        
+        # New arrivals are renamed, files moved in as well
+        with open(os.path.join(temp_dir, "IMG_20220510_143045.jpg"), "w") as f:
+            f.write("data")
+        with open(os.path.join(temp_dir, "..", "PXL_20230101_101010123.jpg.part"), "w") as f:
+            f.write("data")
+        os.rename(os.path.join(temp_dir, "..", "PXL_20230101_101010123.jpg.part"),
+                  os.path.join(temp_dir, "PXL_20230101_101010123.jpg"))
+        
+        assert wait_for(lambda: sorted(os.listdir(temp_dir)) == [
+            "2022-01-01_10-10-10.jpg", "2022-05-10_14-30-45.jpg", "2023-01-01_10-10-10.jpg"
+        ])
+    finally:
+        stop.set()
+        watcher.join()
+    
+    assert result["stats"]["renamed"] == 3
+    # Our own renames must not be picked up again
+    assert not any("already has correct name" in message for message in messages)
+
+@linux_only
+def test_watch_folder_renames_replaced_files(temp_dir):
+    """Test that a file moved over a name the folder already holds is renamed."""
+    # Without a date the file keeps its name and stays in the index
+    Image.new("RGB", (8, 8)).save(os.path.join(temp_dir, "holiday.jpg"))
+    
+    messages = []
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch_folder, args=(temp_dir,),
+                               kwargs={"callback": messages.append, "settle_time": 0.05,
+                                       "stop_event": stop, "date_sources": ("metadata",)})
+    watcher.start()
+    try:
+        assert wait_for(lambda: any("Watching" in message for message in messages))
+        
+        replacement = os.path.join(temp_dir, "..", "holiday.jpg.part")
+        exif = Image.Exif()
+        exif[0x8769] = {0x9003: "2021:03:04 05:06:07"}
+        Image.new("RGB", (8, 8)).save(replacement, format="JPEG", exif=exif.tobytes())
+        os.replace(replacement, os.path.join(temp_dir, "holiday.jpg"))
+        
+        assert wait_for(lambda: os.listdir(temp_dir) == ["2021-03-04_05-06-07.jpg"])
+    finally:
+        stop.set()
+        watcher.join()
+
+@linux_only
+def test_watch_folder_renames_sidecars_with_their_media(temp_dir):
+    """Test that sidecars landing before or shortly after their media file are renamed with it."""
+    messages = []
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch_folder, args=(temp_dir,),
+                               kwargs={"callback": messages.append, "settle_time": 0.3,
+                                       "stop_event": stop, "date_sources": ("filename",)})
+    watcher.start()
+    try:
+        assert wait_for(lambda: any("Watching" in message for message in messages))
+        
+        # A sidecar settling before its media file arrives waits for it
+        open(os.path.join(temp_dir, "IMG_20220101_101010.xmp"), "w").close()
+        time.sleep(0.6)
+        open(os.path.join(temp_dir, "IMG_20220101_101010.jpg"), "w").close()
+        # A sidecar written after its media file settles later than it
+        open(os.path.join(temp_dir, "IMG_20220510_143045.jpg"), "w").close()
+        time.sleep(0.1)
+        open(os.path.join(temp_dir, "IMG_20220510_143045.jpg.aae"), "w").close()
+        
+        assert wait_for(lambda: sorted(os.listdir(temp_dir)) == [
+            "2022-01-01_10-10-10.jpg", "2022-01-01_10-10-10.xmp",
+            "2022-05-10_14-30-45.jpg", "2022-05-10_14-30-45.jpg.aae"
+        ])
+    finally:
+        stop.set()
+        watcher.join()
+
+def test_cli_main_with_watch(sample_image_directory):
+    """Test that --watch runs the watcher with the rename options."""
+    with patch.object(sys, 'argv', ['imagerenamer', sample_image_directory, '--watch', '--settle', '2']):
+        with patch('imagerenamer.cli.watch_folder') as mock_watch:
+            mock_watch.return_value = {"total": 0, "renamed": 0, "skipped": 0, "error": False}
+            assert main() == 0
+            
+            args, kwargs = mock_watch.call_args
+            assert args[0] == sample_image_directory
+            assert kwargs.get('settle_time') == 2.0
+            assert 'file_filter' in kwargs